@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""Benchmark the streaming export of the registered users.
+
+Run from the repository root with `python -m benchmarks.export [nbr_users]`.
+"""
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.fakes import FakeDatabaseBackend
+from benchmarks.fakes import FakeUser
+from classes import Database
+from classes.bulkUsers import ExportFormat
+from classes.bulkUsers import iter_users
+from classes.bulkUsers import write_users
+from classes.database import UlbUser
+
+
+def main(nbr_users: int) -> None:
+    FakeDatabaseBackend().install()
+    tracemalloc.start()
+    for i in range(nbr_users):
+        Database.ulb_users[FakeUser(100_000_000_000_000_000 + i)] = UlbUser(
+            f"Prenom{i} Nom{i}", f"prenom{i}.nom{i}@ulb.be"
+        )
+
+    print(f"Users : {nbr_users}")
+    for format in (ExportFormat.csv, ExportFormat.jsonl):
+        with tempfile.TemporaryFile() as file:
+            baseline, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            start = time.perf_counter()
+            count = write_users(iter_users(), format, file)
+            duration = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            size = file.tell()
+        print(
+            f"{format:<6}: {count} rows in {duration * 1000:.0f} ms ({count / duration:.0f} rows/s), "
+            f"{size / 1024:.0f} KiB compressed, peak memory {(peak - baseline) / 1024:.0f} KiB"
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
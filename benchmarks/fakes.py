@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""Fake Discord interactions, backends and clock used to drive the bot without connecting to anything."""
+import asyncio
+import selectors
+import time
+from typing import Dict
+from typing import List
+from typing import Optional
+
+import disnake
+
+from bot import Readiness
+from bot import Stage
+from classes import Database
+from classes import EmailManager
+
+
+class FakeClock:
+    """Represent a virtual clock, only advanced by the `VirtualTimeLoop` when every task is waiting.
+
+    Parameters
+    ----------
+    start: `float`
+        The initial wall-clock timestamp
+    """
+
+    def __init__(self, start: float = None) -> None:
+        self.start: float = time.time() if start is None else start
+        self.elapsed: float = 0.0
+
+    def monotonic(self) -> float:
+        return self.elapsed
+
+    def time(self) -> float:
+        return self.start + self.elapsed
+
+    def advance(self, seconds: float) -> None:
+        self.elapsed += seconds
+
+
+class _VirtualSelector(selectors.DefaultSelector):
+    def __init__(self, clock: FakeClock) -> None:
+        super().__init__()
+        self._clock = clock
+
+    def select(self, timeout: Optional[float] = None):
+        ready = super().select(0)
+        if not ready and timeout:
+            self._clock.advance(timeout)
+        return ready
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    """Represent an event loop running on a `FakeClock`.
+
+    When no callback is ready, the clock jumps to the next scheduled timer instead of sleeping, so `asyncio.sleep`
+    and timeouts of several minutes are reached instantly.
+    """
+
+    def __init__(self, clock: FakeClock) -> None:
+        self.clock = clock
+        super().__init__(selector=_VirtualSelector(clock))
+
+    def time(self) -> float:
+        return self.clock.monotonic()
+
+
+class FakeTimeModule:
+    """Drop-in replacement of the `time` module of a patched module, backed by a `FakeClock`."""
+
+    def __init__(self, clock: FakeClock) -> None:
+        self._clock = clock
+
+    def time(self) -> float:
+        return self._clock.time()
+
+    def monotonic(self) -> float:
+        return self._clock.monotonic()
+
+    def __getattr__(self, name: str):
+        return getattr(time, name)
+
+
+class FakeUser:
+    def __init__(self, id: int) -> None:
+        self.id: int = id
+        self.name: str = f"user{id}"
+        self.mention: str = f"<@{id}>"
+
+    def __hash__(self) -> int:
+        return self.id
+
+    def __eq__(self, other: object) -> bool:
+        return getattr(other, "id", None) == self.id
+
+
+class FakeScreen:
+    """What a user currently sees: the last message content and the last modal sent to them."""
+
+    def __init__(self) -> None:
+        self.embed: disnake.Embed = None
+        self.view: disnake.ui.View = None
+        self.modal: disnake.ui.Modal = None
+
+    def update(self, kwargs: dict) -> None:
+        if "embed" in kwargs:
+            self.embed = kwargs["embed"]
+        if "view" in kwargs:
+            self.view = kwargs["view"]
+
+    def button(self, label: str) -> Optional[disnake.ui.Button]:
+        if self.view is None:
+            return None
+        return next((item for item in self.view.children if getattr(item, "label", None) == label), None)
+
+
+class FakeResponse:
+    def __init__(self, screen: FakeScreen) -> None:
+        self._screen = screen
+        self._done = False
+
+    def is_done(self) -> bool:
+        return self._done
+
+    async def defer(self, **kwargs) -> None:
+        self._done = True
+
+    async def send_message(self, **kwargs) -> None:
+        self._done = True
+        self._screen.update(kwargs)
+
+    async def edit_message(self, **kwargs) -> None:
+        self._done = True
+        self._screen.update(kwargs)
+
+    async def send_modal(self, modal: disnake.ui.Modal) -> None:
+        self._done = True
+        self._screen.modal = modal
+
+
+class FakeInteraction:
+    """Fake of `disnake.ApplicationCommandInteraction`, and base of the other fake interactions."""
+
+    def __init__(self, user: FakeUser, screen: FakeScreen) -> None:
+        self.author: FakeUser = user
+        self.user: FakeUser = user
+        self.guild = None
+        self.response = FakeResponse(screen)
+        self._screen = screen
+
+    async def edit_original_message(self, **kwargs) -> None:
+        self._screen.update(kwargs)
+
+    edit_original_response = edit_original_message
+
+
+class FakeMessageInteraction(FakeInteraction):
+    """Fake of `disnake.MessageInteraction`."""
+
+
+class FakeModalInteraction(FakeInteraction):
+    """Fake of `disnake.ModalInteraction`.
+
+    Parameters
+    ----------
+    text_values: `Dict[str, str]`
+        The values submitted in the modal
+    custom_id: `str`
+        The custom_id of the modal
+    """
+
+    def __init__(self, user: FakeUser, screen: FakeScreen, text_values: Dict[str, str], custom_id: str) -> None:
+        super().__init__(user, screen)
+        self.text_values: Dict[str, str] = text_values
+        self.custom_id: str = custom_id
+
+
+class FakeEmailBackend:
+    """Replace `EmailManager.send_token` by an in-memory outbox."""
+
+    def __init__(self) -> None:
+        self.outbox: Dict[str, List[str]] = {}
+        self.sent = 0
+
+    def install(self) -> None:
+        def send_token(target_email: str, token: str) -> None:
+            self.outbox.setdefault(target_email, []).append(token)
+            self.sent += 1
+
+        EmailManager.send_token = send_token
+
+    def last_token(self, email: str) -> Optional[str]:
+        tokens = self.outbox.get(email)
+        return tokens[-1] if tokens else None
+
+
+class FakeDatabaseBackend:
+    """Load an empty `Database` and record the writes instead of sending them to the google sheet."""
+
+    def __init__(self) -> None:
+        self.writes: List[tuple] = []
+
+    def install(self) -> None:
+        Database._loaded = True
+        Readiness.set(Stage.storage)
+        Database.ulb_users = {}
+        Database.ulb_guilds = {}
+
+        async def _set_user_task(user_id: int, name: str, email: str) -> None:
+            self.writes.append((user_id, name, email))
+
+        Database._set_user_task = _set_user_task
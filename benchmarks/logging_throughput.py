@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""Benchmark the cost of the log calls on the calling thread.
+
+Compares the log calls per second of the former pipeline (handlers on the root logger, f-strings) with the queue
+pipeline of `bot.logs` (%-style arguments, writer thread), for emitted records and for TRACE records filtered out or
+sampled. The slowest call shows the stalls of the synchronous file I/O, and the time the writer thread needs to drain the queue
+is reported separately.
+
+Run from the repository root with `python -m benchmarks.logging_throughput [nbr_calls]`.
+"""
+import atexit
+import logging.handlers
+import os
+import sys
+import tempfile
+import time
+from typing import Tuple
+
+from bot import setup_logging
+from main import addLoggingLevel
+
+
+class Member:
+    def __init__(self, id: int) -> None:
+        self.id = id
+        self.guild = self
+        self.name = f"member{id}"
+
+
+def reset_root() -> None:
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+
+
+def file_handler(directory: str, level: int) -> logging.Handler:
+    handler = logging.handlers.RotatingFileHandler(os.path.join(directory, "bench.log"), encoding="UTF-8")
+    handler.setFormatter(logging.Formatter("%(asctime)s [%(threadName)-12.12s] [%(levelname)-5.5s]  %(message)s"))
+    handler.setLevel(level)
+    return handler
+
+
+def fstring_calls(nbr_calls: int) -> Tuple[float, float]:
+    members = [Member(i) for i in range(100)]
+    slowest = 0.0
+    start = time.perf_counter()
+    for i in range(nbr_calls):
+        member = members[i % 100]
+        call = time.perf_counter()
+        logging.trace(f"[Cog:Ulb] [Guild:{member.guild.id}] [User:{member.id}] Member already registered.")
+        slowest = max(slowest, time.perf_counter() - call)
+    return time.perf_counter() - start, slowest
+
+
+def lazy_calls(nbr_calls: int) -> Tuple[float, float]:
+    members = [Member(i) for i in range(100)]
+    slowest = 0.0
+    start = time.perf_counter()
+    for i in range(nbr_calls):
+        member = members[i % 100]
+        call = time.perf_counter()
+        logging.trace("[Cog:Ulb] [Guild:%s] [User:%s] Member already registered.", member.guild.id, member.id)
+        slowest = max(slowest, time.perf_counter() - call)
+    return time.perf_counter() - start, slowest
+
+
+def run(name: str, calls, nbr_calls: int, level: int, queued: bool, sample: str = "") -> None:
+    reset_root()
+    os.environ["LOG_TRACE_SAMPLE"] = sample
+    with tempfile.TemporaryDirectory() as directory:
+        handler = file_handler(directory, level)
+        listener = None
+        if queued:
+            listener = setup_logging([handler])
+            atexit.unregister(listener.stop)
+        else:
+            logging.getLogger().setLevel(level)
+            logging.getLogger().addHandler(handler)
+        duration, slowest = calls(nbr_calls)
+        drain = 0.0
+        if listener:
+            start = time.perf_counter()
+            listener.stop()
+            drain = time.perf_counter() - start
+        reset_root()
+        print(
+            f"{name:<42}{nbr_calls / duration:>12,.0f}{duration * 1e6 / nbr_calls:>10.2f}"
+            + f"{slowest * 1e3:>10.2f}{drain:>10.2f}"
+        )
+
+
+def main(nbr_calls: int) -> None:
+    addLoggingLevel("TRACE", logging.INFO - 5)
+    print(f"{'Pipeline':<42}{'calls/s':>12}{'us/call':>10}{'max ms':>10}{'drain s':>10}")
+    run("direct file handler, f-string", fstring_calls, nbr_calls, logging.TRACE, queued=False)
+    run("direct file handler, %-args", lazy_calls, nbr_calls, logging.TRACE, queued=False)
+    run("queue pipeline, f-string", fstring_calls, nbr_calls, logging.TRACE, queued=True)
+    run("queue pipeline, %-args", lazy_calls, nbr_calls, logging.TRACE, queued=True)
+    run("queue pipeline, %-args, TRACE sampled 1%", lazy_calls, nbr_calls, logging.TRACE, queued=True, sample="0.01")
+    run("TRACE filtered out, f-string", fstring_calls, nbr_calls, logging.INFO, queued=True)
+    run("TRACE filtered out, %-args", lazy_calls, nbr_calls, logging.INFO, queued=True)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
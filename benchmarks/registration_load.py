@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""Drive thousands of concurrent registrations against fake Discord, email and database backends.
+
+The registrations run on a virtual clock, so token and user timeouts are reached instantly. Each simulated user
+follows a random scenario (happy path, restarted registration, expired token, wrong tokens...) and the harness
+reports the throughput, the latency percentiles of each step, the leaked tasks and the correctness violations.
+
+Run from the repository root with `python -m benchmarks.registration_load [nbr_users] [seed]`.
+"""
+import asyncio
+import logging
+import random
+import sys
+import time
+from typing import Dict
+from typing import List
+
+import bot.sessions
+import classes.registration
+from benchmarks.fakes import FakeClock
+from benchmarks.fakes import FakeDatabaseBackend
+from benchmarks.fakes import FakeEmailBackend
+from benchmarks.fakes import FakeInteraction
+from benchmarks.fakes import FakeMessageInteraction
+from benchmarks.fakes import FakeModalInteraction
+from benchmarks.fakes import FakeScreen
+from benchmarks.fakes import FakeTimeModule
+from benchmarks.fakes import FakeUser
+from benchmarks.fakes import VirtualTimeLoop
+from bot import Metrics
+from classes import Database
+from classes import Registration
+from classes.registrationStore import RegistrationStore
+from main import addLoggingLevel
+
+
+class Scenario:
+    happy = "happy"
+    restart = "restart"
+    expired = "expired"
+    wrong_tokens = "wrong_tokens"
+    bad_email = "bad_email"
+    duplicate_email = "duplicate_email"
+
+    weights = {happy: 60, restart: 10, expired: 10, wrong_tokens: 10, bad_email: 5, duplicate_email: 5}
+
+
+class LoadReport:
+    def __init__(self) -> None:
+        self.latencies: Dict[str, List[float]] = {}
+        self.violations: List[str] = []
+        self.outcomes: Dict[str, int] = {}
+
+    def timed(self, step: str):
+        report = self
+
+        class _Timer:
+            def __enter__(self):
+                self.start = time.perf_counter()
+
+            def __exit__(self, *exc):
+                report.latencies.setdefault(step, []).append(time.perf_counter() - self.start)
+
+        return _Timer()
+
+    def violation(self, message: str) -> None:
+        self.violations.append(message)
+
+    def outcome(self, name: str) -> None:
+        self.outcomes[name] = self.outcomes.get(name, 0) + 1
+
+    @staticmethod
+    def percentile(values: List[float], p: float) -> float:
+        values = sorted(values)
+        return values[min(int(len(values) * p), len(values) - 1)]
+
+    def print(self, nbr_users: int, duration: float, leaked: int) -> None:
+        print(f"Users                 : {nbr_users}")
+        print(f"Wall time             : {duration:.2f} s ({nbr_users / duration:.0f} registrations/s)")
+        print("Outcomes              : " + ", ".join(f"{k}={v}" for k, v in sorted(self.outcomes.items())))
+        print(f"{'Step':<22}{'count':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for step, values in self.latencies.items():
+            print(
+                f"{step:<22}{len(values):>8}"
+                + "".join(f"{self.percentile(values, p) * 1000:>10.3f}" for p in (0.5, 0.9, 0.99))
+                + f"{max(values) * 1000:>10.3f}"
+            )
+        print(f"Leaked tasks          : {leaked}")
+        print(f"Correctness violations: {len(self.violations)}")
+        for violation in self.violations[:20]:
+            print(f"    {violation}")
+
+
+class SimulatedUser:
+    def __init__(self, id: int, scenario: str, email: FakeEmailBackend, report: LoadReport) -> None:
+        self.user = FakeUser(id)
+        self.scenario = scenario
+        self.email = f"student.{id}@ulb.be"
+        self.screen = FakeScreen()
+        self._email_backend = email
+        self._report = report
+
+    async def slash_ulb(self) -> None:
+        with self._report.timed("start"):
+            await Registration.new(FakeInteraction(self.user, self.screen))
+
+    async def click(self, label: str, step: str) -> bool:
+        button = self.screen.button(label)
+        if button is None:
+            return False
+        with self._report.timed(step):
+            await button.callback(FakeMessageInteraction(self.user, self.screen))
+        return True
+
+    @property
+    def evicted(self) -> bool:
+        """Whether the registration was evicted, and the user asked to relaunch /ulb."""
+        return self.screen.embed is not None and "Relance `/ulb`" in (self.screen.embed.description or "")
+
+    async def submit(self, field: str, value: str, step: str) -> None:
+        modal = self.screen.modal
+        if modal is None:  # The registration was evicted before the modal was sent
+            return
+        self.screen.modal = None
+        with self._report.timed(step):
+            await modal.callback(FakeModalInteraction(self.user, self.screen, {field: value}, modal.custom_id))
+
+    async def enter_email(self, email: str) -> None:
+        if await self.click("Vérifier son identité", "registration_button"):
+            await self.submit("email", email, "email_modal")
+
+    async def enter_token(self, token: str) -> None:
+        if await self.click("Entrer le token", "token_button"):
+            await self.submit("token", token, "token_modal")
+
+    async def run(self) -> None:
+        await asyncio.sleep(random.uniform(0, 60))
+        await self.slash_ulb()
+        if self.scenario == Scenario.restart:
+            await asyncio.sleep(random.uniform(0, 5))
+            await self.slash_ulb()
+        if self.scenario == Scenario.bad_email:
+            await self.enter_email("not-an-email")
+        if self.scenario == Scenario.duplicate_email:
+            self.email = "shared.address@ulb.be"
+        await asyncio.sleep(random.uniform(1, 20))
+        await self.enter_email(self.email)
+        if self.evicted:
+            self._report.outcome("evicted")
+            return
+
+        if self.scenario == Scenario.expired:
+            await asyncio.sleep(Registration.token_validity_time + 1)
+            await self.click("Renvoyer un token", "resend_button")
+        if self.scenario == Scenario.wrong_tokens:
+            for _ in range(Registration.token_nbr_try):
+                await asyncio.sleep(random.uniform(1, 10))
+                await self.enter_token("0" * Registration.token_size)
+            self._report.outcome("timed_out")
+            await asyncio.sleep(0)  # Let the timeout task start
+            if self.user not in Registration._users_timeout:
+                self._report.violation(f"{self.user.id}: not timed out after {Registration.token_nbr_try} tries")
+            return
+
+        await asyncio.sleep(random.uniform(1, 60))
+        token = self._email_backend.last_token(self.email)
+        if token is None:
+            self._report.outcome("no_email")
+            return
+        await self.enter_token(token)
+        if self.evicted:
+            self._report.violation(f"{self.user.id}: registration evicted after its token was sent")
+            return
+        self._report.outcome("registered" if self.user in Database.ulb_users else "not_registered")
+
+
+def check_consistency(users: List[SimulatedUser], report: LoadReport) -> None:
+    emails: Dict[str, int] = {}
+    for user, user_data in Database.ulb_users.items():
+        if user_data.email in emails:
+            report.violation(f"{user.id}: {user_data.email} already registered by {emails[user_data.email]}")
+        emails[user_data.email] = user.id
+    for sim in users:
+        user_data = Database.ulb_users.get(sim.user)
+        if user_data and user_data.email != sim.email:
+            report.violation(f"{sim.user.id}: registered with {user_data.email} instead of {sim.email}")
+        if sim.scenario == Scenario.happy and not user_data and not sim.evicted:
+            report.violation(f"{sim.user.id}: happy path did not register")
+    for user in Registration._current_registrations.keys():
+        if user in Database.ulb_users:
+            report.violation(f"{user.id}: registered but still has a pending registration")
+
+
+async def main(nbr_users: int) -> None:
+    email = FakeEmailBackend()
+    email.install()
+    FakeDatabaseBackend().install()
+    Registration._build_prototypes()
+    RegistrationStore.load(":memory:")
+    report = LoadReport()
+
+    scenarios = random.choices(list(Scenario.weights.keys()), weights=list(Scenario.weights.values()), k=nbr_users)
+    users = [SimulatedUser(i, scenario, email, report) for i, scenario in enumerate(scenarios)]
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*[user.run() for user in users], return_exceptions=True)
+    duration = time.perf_counter() - start
+    for user, result in zip(users, results):
+        if isinstance(result, BaseException):
+            report.violation(f"{user.user.id} ({user.scenario}): {type(result).__name__}: {result}")
+
+    check_consistency(users, report)
+
+    # Let the user timeouts and the abandoned registrations expire and be swept, anything still pending afterward is
+    # leaked
+    await asyncio.sleep(
+        max(Registration.user_timeout_time, Registration.session_ttl) + Registration._users_timeout.sweep_interval + 1
+    )
+    leaked = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    if Registration._users_timeout:
+        report.violation(f"{len(Registration._users_timeout)} users timeouts never expired")
+    if Registration._current_registrations:
+        report.violation(f"{len(Registration._current_registrations)} abandoned registrations never evicted")
+
+    report.print(nbr_users, duration, len(leaked))
+    print("Registration metrics  :")
+    print("\n".join(f"    {line}" for line in Metrics.summary().splitlines()))
+
+
+if __name__ == "__main__":
+    addLoggingLevel("TRACE", logging.INFO - 5)
+    random.seed(int(sys.argv[2]) if len(sys.argv) > 2 else 0)
+    clock = FakeClock()
+    classes.registration.time = FakeTimeModule(clock)
+    bot.sessions.time = FakeTimeModule(clock)
+    loop = VirtualTimeLoop(clock)
+    try:
+        loop.run_until_complete(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5_000))
+    finally:
+        loop.close()
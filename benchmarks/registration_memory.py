@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""Benchmark the allocations and memory held per pending registration.
+
+Run from the repository root with `python -m benchmarks.registration_memory [nbr_sessions]`.
+"""
+import asyncio
+import gc
+import logging
+import sys
+import tracemalloc
+
+from benchmarks.fakes import FakeDatabaseBackend
+from benchmarks.fakes import FakeInteraction
+from benchmarks.fakes import FakeScreen
+from benchmarks.fakes import FakeUser
+from bot import TaskRegistry
+from classes import Registration
+from classes.registrationStore import RegistrationStore
+from main import addLoggingLevel
+
+
+async def main(nbr_sessions: int) -> None:
+    FakeDatabaseBackend().install()
+    Registration._build_prototypes()
+    RegistrationStore.load(":memory:")
+    # Keep all the sessions live, so that none is evicted by `REGISTRATION_MAX_SESSIONS`
+    Registration._current_registrations.max_size = max(Registration._current_registrations.max_size, nbr_sessions)
+    interactions = [FakeInteraction(FakeUser(i), FakeScreen()) for i in range(nbr_sessions)]
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for inter in interactions:
+        await Registration.new(inter)
+    while TaskRegistry.pending("store"):  # The writes to the store are queued in a thread
+        await asyncio.sleep(0.01)
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    stats = after.compare_to(before, "filename")
+    size = sum(stat.size_diff for stat in stats)
+    count = sum(stat.count_diff for stat in stats)
+    live = len(Registration._current_registrations)
+    print(f"Pending registrations : {live}")
+    print(f"Memory held           : {size / 1024 / 1024:.2f} MiB ({size / live:.0f} B per registration)")
+    print(f"Live allocations      : {count} ({count / live:.1f} per registration)")
+    print("Top allocation sites  :")
+    for stat in after.compare_to(before, "lineno")[:10]:
+        print(f"    {stat}")
+
+
+if __name__ == "__main__":
+    addLoggingLevel("TRACE", logging.INFO - 5)
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000))
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""Benchmark the cold start of the bot.
+
+Each run starts a fresh interpreter with `-X importtime`, imports `main`, and builds the `Bot`, which discovers and
+loads the cogs. The harness reports the import time per top-level package, the load time of each cog and the total
+cold start time, with and without `LAZY_IMPORTS`.
+
+With `--live`, the bot also connects to discord with the `.env` credentials, and the time to the gateway READY and to
+the data-ready stages are reported from the readiness timeline.
+
+Run from the repository root with `python -m benchmarks.startup [--runs N] [--live] [--budget SECONDS]`. The exit code
+is 1 if the cold start (or the time to data-ready with `--live`) of the lazy mode is above the budget.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+import types
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+_start = time.perf_counter()
+
+
+def child(live: bool) -> None:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    os.environ.setdefault("ADMIN_GUILD_ID", "0")
+
+    from main import addLoggingLevel
+    from bot import Bot
+    from bot import Readiness
+    from bot import Stage
+
+    imported = time.perf_counter()
+    addLoggingLevel("TRACE", logging.INFO - 5)
+    bot = Bot(logger=logging.getLogger(), logFormatter=None)
+    built = time.perf_counter()
+    result = {
+        "import": imported - _start,
+        "cogs": bot.cog_load_times,
+        "cold_start": built - _start,
+        "loaded": sorted(  # Lazy modules are in sys.modules, but stay a _LazyModule until executed
+            name
+            for name in ("gspread", "oauth2client.service_account", "smtplib")
+            if type(sys.modules.get(name)) is types.ModuleType
+        ),
+    }
+
+    if live:
+
+        async def run() -> None:
+            asyncio.create_task(bot.start(os.getenv("DISCORD_TOKEN")))
+            for stage in (Stage.gateway, Stage.storage, Stage.registration):
+                await Readiness.wait(stage, 120)
+            result["stages"] = {stage: Readiness.reached(stage) for stage in Stage.all}
+            await bot.close()
+
+        asyncio.run(run())
+
+    print(json.dumps(result))
+
+
+def parse_importtime(stderr: str) -> Dict[str, float]:
+    """Sum the self import time of each top-level package, in seconds."""
+    packages: Dict[str, float] = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:") :].split("|", 2)
+        package = name.strip().split(".")[0]
+        packages[package] = packages.get(package, 0.0) + int(self_us) / 1_000_000
+    return packages
+
+
+def run_once(lazy: bool, live: bool) -> Tuple[dict, Dict[str, float]]:
+    env = dict(os.environ, LAZY_IMPORTS="1" if lazy else "0")
+    args = [sys.executable, "-X", "importtime", "-m", "benchmarks.startup", "--child"] + (["--live"] if live else [])
+    process = subprocess.run(args, env=env, capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr[-2000:])
+    return json.loads(process.stdout.strip().splitlines()[-1]), parse_importtime(process.stderr)
+
+
+def report(mode: str, results: List[dict], packages: Dict[str, float]) -> float:
+    cold = statistics.median(result["cold_start"] for result in results)
+    print(f"== {mode} ({len(results)} runs) ==")
+    print(f"Import main + bot     : {statistics.median(result['import'] for result in results) * 1000:8.1f} ms")
+    for cog in results[0]["cogs"]:
+        print(f"Load cog {cog:<13}: {statistics.median(result['cogs'][cog] for result in results) * 1000:8.1f} ms")
+    print(f"Cold start            : {cold * 1000:8.1f} ms")
+    print(f"Heavy modules loaded  : {', '.join(results[0]['loaded']) or 'none'}")
+    print("Top packages by import time:")
+    for package, seconds in sorted(packages.items(), key=lambda item: -item[1])[:12]:
+        print(f"    {package:<24}{seconds * 1000:8.1f} ms")
+    stages = results[-1].get("stages")
+    if stages:
+        for stage, reached in stages.items():
+            print(f"{stage:<22}: " + (f"{reached * 1000:8.1f} ms" if reached is not None else "     n/a"))
+        return stages["registration_ready"]
+    return cold
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--live", action="store_true", help="Connect to discord and wait for the data to be ready")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=None, help="Maximum cold start of the lazy mode, in seconds")
+    args = parser.parse_args()
+    if args.child:
+        child(args.live)
+        return 0
+
+    run_once(lazy=False, live=False)  # Warm the filesystem cache and the bytecode cache
+    measured = 0.0
+    for lazy in (False, True):
+        results = []
+        packages: Dict[str, float] = {}
+        for i in range(args.runs):
+            result, run_packages = run_once(lazy, args.live and i == args.runs - 1)
+            results.append(result)
+            for package, seconds in run_packages.items():
+                packages[package] = packages.get(package, 0.0) + seconds / args.runs
+        measured = report("LAZY_IMPORTS=1" if lazy else "LAZY_IMPORTS=0", results, packages)
+    if args.budget is not None:
+        print(
+            f"Budget                : {args.budget * 1000:8.1f} ms -> {'OK' if measured <= args.budget else 'EXCEEDED'}"
+        )
+        return 0 if measured <= args.budget else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,2 +1,16 @@
 # -*- coding: utf-8 -*-
 from .bot import *
+from .breaker import *
+from .cluster import *
+from .errors import *
+from .instrumentation import *
+from .lazy import *
+from .logs import *
+from .metrics import *
+from .profiling import *
+from .readiness import *
+from .scheduler import *
+from .server import *
+from .sessions import *
+from .tasks import *
+from .watchdog import *
@@ -16,41 +16,139 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
+import asyncio
+import functools
 import logging.handlers
 import os
 import platform
+import signal
+import time
 import traceback
-import tracemalloc
+from typing import Dict
 from typing import List
 
-tracemalloc.start()
-
 import disnake
 from disnake import ApplicationCommandInteraction
+from disnake.ext.commands import AutoShardedInteractionBot
 from disnake.ext.commands import InteractionBot
 
+from .cluster import Cluster
+from .errors import ErrorReporter
+from .instrumentation import CommandTracker
+from .instrumentation import Origin
+from .metrics import Metrics
+from .profiling import MemoryProfiler
+from .readiness import Readiness
+from .readiness import Stage
+from .scheduler import Priority
+from .scheduler import Scheduler
+from .server import StatusServer
+from .tasks import TaskRegistry
+from .watchdog import LoopWatchdog
+
 
 class Bot(InteractionBot):
+    """The bot, on a single gateway connection. See `ShardedBot` for the sharded one.
+
+    The cogs only listen to the shard events (`on_shard_ready`, `on_shard_resumed`), the single connection being
+    dispatched as the shard 0.
+
+    On SIGTERM, the bot stops accepting the commands, stops the long jobs and drains the pending tasks of the
+    `TaskRegistry` for at most `SHUTDOWN_TIMEOUT` seconds (8 by default) before closing. See `shutdown()`.
+    """
 
     BEP_image = "https://i.imgur.com/BHgic3o.png"
     ULB_image = "https://i.imgur.com/0VLBhVJ.png"
 
-    def __init__(self, logger, logFormatter):
+    sharded = False
+
+    def __init__(self, logger, logFormatter, **options):
+        MemoryProfiler.start_from_env()
+        CommandTracker.install()
         self.logger = logger
         self.logFormatter = logFormatter
         self.test_mode = bool(os.getenv("TEST_GUILD"))
         self.cog_not_loaded: List[str] = []
+        self.cog_load_times: Dict[str, float] = {}
+        self._shutdown_task: asyncio.Task = None
         intents = disnake.Intents.default()
         intents.members = True
+        if os.getenv("MEMBER_CACHE", "").lower() == "selective":
+            # Only the ULB guilds are chunked, by the MemberCache of the Ulb cog, and pruned right after
+            options.setdefault("chunk_guilds_at_startup", False)
 
         if self.test_mode:
             logging.info("Starting in test mod...")
-            super().__init__(intents=intents, test_guilds=[int(os.getenv("TEST_GUILD"))])
+            super().__init__(intents=intents, test_guilds=[int(os.getenv("TEST_GUILD"))], **options)
         else:
             logging.info("Starting in prod mod...")
-            super().__init__(intents=intents)
+            super().__init__(intents=intents, **options)
 
         self.load_commands()
+        Metrics.gauge_callback("discord_cached_users", lambda: len(self.users))
+
+    @property
+    def gateway_shards(self) -> List[int]:
+        """The ids of the shards run by this process."""
+        return [0]
+
+    def shard_guilds(self, shard_id: int) -> int:
+        return sum(1 for guild in self.guilds if guild.shard_id == shard_id)
+
+    async def start(self, *args, **kwargs) -> None:
+        await StatusServer.start(self)
+        await Cluster.start()
+        try:
+            # Replace the handler of `run()`, which stops the loop right away
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, self._on_sigterm)
+        except NotImplementedError:  # Windows
+            pass
+        await super().start(*args, **kwargs)
+
+    def _on_sigterm(self) -> None:
+        # A reference is kept, as the loop only keeps a weak one to the tasks
+        if self._shutdown_task is None:
+            self._shutdown_task = asyncio.create_task(self.shutdown("SIGTERM"))
+
+    async def shutdown(self, reason: str) -> None:
+        """Stop the bot without losing the pending work.
+
+        The commands received from now on are answered with a message asking to retry later and `/readyz` fails, then
+        the long jobs are checkpointed and the pending writes, emails and member updates are given `SHUTDOWN_TIMEOUT`
+        seconds to finish. What was drained and abandoned is logged and sent to the log channel before closing.
+
+        Parameters
+        ----------
+        reason : `str`
+            Why the bot is stopped, for the logs
+        """
+        if TaskRegistry.closing:
+            return
+        timeout = float(os.getenv("SHUTDOWN_TIMEOUT") or 8)
+        logging.info(f"[Bot] Shutting down ({reason}), draining the pending tasks for at most {timeout:.0f}s...")
+        report = await TaskRegistry.shutdown(timeout)
+        log = logging.warning if report.abandoned else logging.info
+        log(f"[Bot] Shutdown report after {report.duration:.1f}s:\n{report}")
+        if getattr(self, "log_channel", None) is not None:
+            try:
+                await asyncio.wait_for(
+                    self.log_channel.send(
+                        embed=disnake.Embed(
+                            title=f"Arrêt du bot ({reason})",
+                            description=f"```{str(report)[:4000]}```",
+                            color=disnake.Colour.orange() if report.abandoned else disnake.Colour.green(),
+                        )
+                    ),
+                    timeout=3,
+                )
+            except (asyncio.TimeoutError, disnake.HTTPException) as ex:
+                logging.warning(f"[Bot] Not able to send the shutdown report: {ex}")
+        await self.close()
+
+    async def close(self) -> None:
+        await super().close()
+        await Cluster.stop()
+        await StatusServer.stop()
 
     def tracebackEx(self, ex):
         if type(ex) == str:
@@ -68,6 +166,7 @@ class Bot(InteractionBot):
         self.log_channel = self.get_channel(int(os.getenv("LOG_CHANNEL")))
         if not self.log_channel:
             self.log_channel = self.owner.dm_channel
+        ErrorReporter.channel = self.log_channel
         logging.info("-" * 50)
         logging.info(f"| Logged in as {self.user.name}")
         logging.info(f"| disnake API version: {disnake.__version__}")
@@ -77,8 +176,26 @@ class Bot(InteractionBot):
         logging.info(f"| Cogs loaded : " + ", ".join([f"{cog}" for cog in self.cogs.keys()]))
         if self.cog_not_loaded:
             logging.info("| /!\ Cogs not loaded (see error above): " + ", ".join(self.cog_not_loaded))
+        if self.sharded:
+            logging.info(f"| Shards : {len(self.gateway_shards)}/{self.shard_count}")
         logging.info(f"| Bot Ready !")
+        LoopWatchdog.start()
         logging.info("-" * 50)
+        if not self.sharded:
+            self.dispatch("shard_ready", 0)
+
+    async def on_resumed(self) -> None:
+        if not self.sharded:
+            self.dispatch("shard_resumed", 0)
+
+    async def on_shard_ready(self, shard_id: int) -> None:
+        Readiness.shards = self.gateway_shards
+        if not await Cluster.claim(f"shard-{shard_id}"):
+            logging.warning(f"[Bot] Shard {shard_id} is also run by another node, its guilds will not be swept here")
+        Readiness.set(Stage.gateway, shard=shard_id)
+        Metrics.gauge_callback("discord_guilds", functools.partial(self.shard_guilds, shard_id), shard=shard_id)
+        if self.sharded:
+            logging.info(f"[Bot] Shard {shard_id} ready with {self.shard_guilds(shard_id)} guilds")
 
     def load_commands(self) -> None:
         for extension in os.listdir(f"./cogs"):
@@ -87,8 +204,13 @@ class Bot(InteractionBot):
                     logging.warning("Admin extension skipped because no admin guild set")
                     continue
                 try:
+                    start = time.perf_counter()
                     self.load_extension(f"cogs.{extension[:-3]}")
-                    logging.info(f"Loaded extension '{extension[:-3]}'")
+                    self.cog_load_times[extension[:-3]] = time.perf_counter() - start
+                    Metrics.gauge("startup_cog_load_seconds", self.cog_load_times[extension[:-3]], cog=extension[:-3])
+                    logging.info(
+                        f"Loaded extension '{extension[:-3]}' in {self.cog_load_times[extension[:-3]] * 1000:.1f}ms"
+                    )
                 except Exception as e:
                     exception = f"{type(e).__name__}: {e}"
                     logging.warning(
@@ -110,53 +232,115 @@ class Bot(InteractionBot):
             ),
             delete_after=10,
         )
-        await self.log_channel.send(
-            embed=disnake.Embed(title=f":x: __** ERROR**__ :x:", description=f"```{error}```").add_field(
-                name=f"Raised on command :",
-                value=f"**/{interaction.application_command.name}:{interaction.id}** from {interaction.guild.name+'#'+interaction.channel.name if interaction.guild else 'DM'} by {interaction.author.mention} at {interaction.created_at} with options\n```{interaction.filled_options}```"
-                + (f" and target\n``'{interaction.target}``'." if interaction.target else "."),
-            )
+        ErrorReporter.report(
+            error,
+            tb,
+            f"**/{interaction.application_command.name}:{interaction.id}** from {interaction.guild.name+'#'+interaction.channel.name if interaction.guild else 'DM'} by {interaction.author.mention} at {interaction.created_at} with options\n```{interaction.filled_options}```"
+            + (f" and target\n``'{interaction.target}``'." if interaction.target else "."),
         )
-        n = len(tb) // 4050
-        for i in range(n):
-            await self.log_channel.send(embed=disnake.Embed(description=f"```python\n{tb[4050*i:4050*(i+1)]}```"))
-        await self.log_channel.send(embed=disnake.Embed(description=f"```python\n{tb[4050*n:]}```"))
+
+    async def process_application_commands(self, interaction: disnake.ApplicationCommandInteraction) -> None:
+        if TaskRegistry.closing:
+            await interaction.response.send_message(
+                "Le bot redémarre, veuillez réessayer dans quelques instants.", ephemeral=True
+            )
+            return
+        CommandTracker.start(interaction)
+        with Scheduler.use(Priority.interactive):
+            await super().process_application_commands(interaction)
 
     async def on_slash_command(self, interaction: disnake.ApplicationCommandInteraction) -> None:
         logging.trace(
-            f"[Bot] Slash command '{interaction.application_command.name}:{interaction.id}' from '{interaction.guild.name+'#'+interaction.channel.name if interaction.guild else 'DM'}' by '{interaction.author.name}' started..."
+            "[Bot] Slash command '%s:%s' from '%s' by '%s' started...",
+            interaction.application_command.name,
+            interaction.id,
+            Origin(interaction),
+            interaction.author.name,
         )
 
     async def on_user_command(self, interaction: disnake.UserCommandInteraction) -> None:
         logging.trace(
-            f"[Bot] User command '{interaction.application_command.name}:{interaction.id}' from '{interaction.guild.name+'#'+interaction.channel.name if interaction.guild else 'DM'}' by '{interaction.author.name}' started..."
+            "[Bot] User command '%s:%s' from '%s' by '%s' started...",
+            interaction.application_command.name,
+            interaction.id,
+            Origin(interaction),
+            interaction.author.name,
         )
 
     async def on_message_command(self, interaction: disnake.MessageCommandInteraction) -> None:
         logging.trace(
-            f"[Bot] Message command '{interaction.application_command.name}:{interaction.id}' from '{interaction.guild.name+'#'+interaction.channel.name if interaction.guild else 'DM'}' by '{interaction.author.name}' started..."
+            "[Bot] Message command '%s:%s' from '%s' by '%s' started...",
+            interaction.application_command.name,
+            interaction.id,
+            Origin(interaction),
+            interaction.author.name,
         )
 
     async def on_slash_command_error(self, interaction: ApplicationCommandInteraction, error: Exception) -> None:
+        CommandTracker.finish(interaction, "error")
         await self.send_error_log(interaction, error)
 
     async def on_user_command_error(self, interaction: disnake.UserCommandInteraction, error: Exception) -> None:
+        CommandTracker.finish(interaction, "error")
         await self.send_error_log(interaction, error)
 
     async def on_message_command_error(self, interaction: disnake.MessageCommandInteraction, error: Exception) -> None:
+        CommandTracker.finish(interaction, "error")
         await self.send_error_log(interaction, error)
 
     async def on_slash_command_completion(self, interaction: disnake.ApplicationCommandInteraction) -> None:
+        CommandTracker.finish(interaction, "ok")
         logging.trace(
-            f"[Bot] Slash command '{interaction.application_command.name}:{interaction.id}' from '{interaction.guild.name+'#'+interaction.channel.name if interaction.guild else 'DM'}' by '{interaction.author.name}' at '{interaction.created_at}' ended normally"
+            "[Bot] Slash command '%s:%s' from '%s' by '%s' at '%s' ended normally",
+            interaction.application_command.name,
+            interaction.id,
+            Origin(interaction),
+            interaction.author.name,
+            interaction.created_at,
         )
 
     async def on_user_command_completion(self, interaction: disnake.UserCommandInteraction) -> None:
+        CommandTracker.finish(interaction, "ok")
         logging.trace(
-            f"[Bot] User command '{interaction.application_command.name}:{interaction.id}' from '{interaction.guild.name+'#'+interaction.channel.name if interaction.guild else 'DM'}' by '{interaction.author.name}' at '{interaction.created_at}' ended normally"
+            "[Bot] User command '%s:%s' from '%s' by '%s' at '%s' ended normally",
+            interaction.application_command.name,
+            interaction.id,
+            Origin(interaction),
+            interaction.author.name,
+            interaction.created_at,
         )
 
     async def on_message_command_completion(self, interaction: disnake.MessageCommandInteraction) -> None:
+        CommandTracker.finish(interaction, "ok")
         logging.trace(
-            f"[Bot] Message command '{interaction.application_command.name}:{interaction.id}' from '{interaction.guild.name+'#'+interaction.channel.name if interaction.guild else 'DM'}' by '{interaction.author.name}' at '{interaction.created_at}' ended normally"
+            "[Bot] Message command '%s:%s' from '%s' by '%s' at '%s' ended normally",
+            interaction.application_command.name,
+            interaction.id,
+            Origin(interaction),
+            interaction.author.name,
+            interaction.created_at,
+        )
+
+
+class ShardedBot(Bot, AutoShardedInteractionBot):
+    """The bot, with the guilds split between several gateway connections.
+
+    `SHARD_COUNT` is the total number of shards (`auto` for the number recommended by Discord), and `SHARD_IDS` the
+    comma separated ids of the shards run by this process (all of them by default).
+    """
+
+    sharded = True
+
+    def __init__(self, logger, logFormatter):
+        shard_count = os.getenv("SHARD_COUNT")
+        shard_ids = os.getenv("SHARD_IDS")
+        super().__init__(
+            logger,
+            logFormatter,
+            shard_count=None if shard_count == "auto" else int(shard_count),
+            shard_ids=[int(shard_id) for shard_id in shard_ids.split(",")] if shard_ids else None,
         )
+
+    @property
+    def gateway_shards(self) -> List[int]:
+        return list(self.shard_ids or range(self.shard_count))
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+import logging
+import time
+from typing import Any
+from typing import Awaitable
+from typing import Callable
+
+from .metrics import Metrics
+
+
+class CircuitOpenError(Exception):
+    """The Exception to be raise when a call is rejected by an open circuit breaker."""
+
+    def __init__(self, breaker: "CircuitBreaker") -> None:
+        super().__init__(f"The {breaker.name} circuit is open, next try in {breaker.retry_in():.0f}s.")
+
+
+class CircuitBreaker:
+    """Represent a circuit breaker around a backend (the google sheet, the SMTP server...).
+
+    The circuit is closed while the calls succeed. After `failures` consecutive failures, it opens: the calls are
+    rejected right away with `CircuitOpenError` instead of waiting for the backend to fail. After `reset_timeout`
+    seconds, it is half-open: a single call is let through as a probe. If it succeeds the circuit is closed again, else
+    it opens for twice as long (up to `max_reset_timeout`).
+
+    Only the errors for which `is_failure` returns True count as failures (a refused recipient is not an outage of the
+    SMTP server), the others are raised without changing the state.
+
+    Parameters
+    ----------
+    name: `str`
+        The name of the backend, for the logs and the metrics
+    is_failure: `Callable[[Exception], bool]`
+        Check if an error is a failure of the backend, by default all the errors
+    failures: `int`
+        The number of consecutive failures opening the circuit, by default 3
+    reset_timeout: `float`
+        The time (in sec) before the first probe, by default 30
+    max_reset_timeout: `float`
+        The maximum time (in sec) between two probes, by default 600
+    """
+
+    closed = "closed"
+    open = "open"
+    half_open = "half_open"
+    _states = {closed: 0, half_open: 1, open: 2}
+
+    def __init__(
+        self,
+        name: str,
+        is_failure: Callable[[Exception], bool] = None,
+        failures: int = 3,
+        reset_timeout: float = 30,
+        max_reset_timeout: float = 600,
+    ) -> None:
+        self.name: str = name
+        self.is_failure: Callable[[Exception], bool] = is_failure or (lambda ex: True)
+        self.failures: int = failures
+        self.reset_timeout: float = reset_timeout
+        self.max_reset_timeout: float = max_reset_timeout
+        self.state: str = CircuitBreaker.closed
+        self._failures: int = 0
+        self._timeout: float = reset_timeout
+        self._opened_at: float = 0.0
+        self._probing: bool = False
+        Metrics.gauge_callback("circuit_state", lambda: CircuitBreaker._states[self.state], circuit=name)
+
+    def retry_in(self) -> float:
+        """Get the time (in sec) before the next probe, 0 if a call can be made now."""
+        if self.state == CircuitBreaker.closed:
+            return 0.0
+        return max(0.0, self._opened_at + self._timeout - time.monotonic())
+
+    def allow(self) -> bool:
+        """Check if a call can be made now. When the circuit is half-open, only the first caller gets True, and must
+        report the result of its call with `success()` or `failure()`."""
+        if self.state == CircuitBreaker.closed:
+            return True
+        if self.state == CircuitBreaker.open and self.retry_in() == 0:
+            self._set_state(CircuitBreaker.half_open)
+        if self.state == CircuitBreaker.half_open and not self._probing:
+            self._probing = True
+            return True
+        Metrics.incr("circuit_rejected", circuit=self.name)
+        return False
+
+    def success(self) -> None:
+        self._failures = 0
+        self._probing = False
+        if self.state != CircuitBreaker.closed:
+            self._timeout = self.reset_timeout
+            self._set_state(CircuitBreaker.closed)
+
+    def failure(self, ex: Exception) -> None:
+        self._failures += 1
+        Metrics.incr("circuit_failures", circuit=self.name)
+        if self.state == CircuitBreaker.half_open:
+            self._probing = False
+            self._timeout = min(self._timeout * 2, self.max_reset_timeout)
+            self._open(ex)
+        elif self.state == CircuitBreaker.closed and self._failures >= self.failures:
+            self._open(ex)
+
+    async def call(self, func: Callable[[], Awaitable]) -> Any:
+        """Call the backend through the breaker.
+
+        Parameters
+        ----------
+        func : `Callable[[], Awaitable]`
+            The function making the call
+
+        Returns
+        -------
+        `Any`
+            The result of the call
+
+        Raises
+        ------
+        `CircuitOpenError`
+            Raised if the circuit is open
+        """
+        if not self.allow():
+            raise CircuitOpenError(self)
+        try:
+            result = await func()
+        except Exception as ex:
+            if self.is_failure(ex):
+                self.failure(ex)
+            else:
+                self._probing = False
+            raise
+        except BaseException:  # Cancelled, the probe is not conclusive
+            self._probing = False
+            raise
+        self.success()
+        return result
+
+    def _open(self, ex: Exception) -> None:
+        self._opened_at = time.monotonic()
+        self._set_state(CircuitBreaker.open)
+        logging.warning(
+            f"[CircuitBreaker] {self.name} circuit open for {self._timeout:.0f}s after {self._failures} failures: "
+            + f"{type(ex).__name__}: {ex}"
+        )
+
+    def _set_state(self, state: str) -> None:
+        if state == CircuitBreaker.closed and self.state != state:
+            logging.info(f"[CircuitBreaker] {self.name} circuit closed")
+        self.state = state
+        Metrics.incr("circuit_transitions", circuit=self.name, state=state)
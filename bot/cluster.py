@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+from .breaker import CircuitOpenError
+from .metrics import Metrics
+
+
+class ClusterInstantiationError(Exception):
+    """The Exception to be raise when the Cluster class is instantiated."""
+
+    def __init__(self, *args: object) -> None:
+        super().__init__("The Cluster class cannot be instantiated, but only used as a class.")
+
+
+class Cluster:
+    """Represent the state shared between several processes of the bot, for example one per group of shards.
+
+    The clustered mode is enabled by `CLUSTER_STORE`, the path of a sqlite file shared by all the nodes (on the same
+    host or on a shared volume). Each node is named by `CLUSTER_NODE` (the hostname and the pid by default). The store
+    holds:
+    - `events`: the messages published to the other nodes, read by each node every `poll_interval` seconds. They are
+      used to invalidate the caches (pub/sub)
+    - `jobs`: the work only the leader does, like the writes to the google sheet, run in order. A job failing
+      `job_max_attempts` times is moved to `dead_jobs`, so it does not block the next ones
+    - `leases`: the leases of the nodes, renewed every `poll_interval` seconds and lost after `lease_ttl` seconds. The
+      `leader` lease elects the node running the jobs, and a `shard-<id>` lease is held by the node running a shard
+
+    The store is only used from a dedicated thread, in order, so waiting for a lock held by another node never blocks
+    the event loop.
+
+    Without `CLUSTER_STORE`, the node is alone: it is the leader, holds all the leases, and the jobs are not used.
+
+    This class is only used as a class and should not be instantiated
+
+    Classmethods
+    ------------
+    enabled(): `bool`
+        Check if the clustered mode is enabled
+    start(): `coro`
+        Open the store and start following it
+    stop(): `coro`
+        Stop following the store and release the leases
+    is_leader(): `bool`
+        Check if this node is the leader
+    leader(): `Optional[str]`
+        Get the name of the leader node
+    claim(name: `str`): `coro`
+        Take a lease and keep renewing it
+    holds(name: `str`): `bool`
+        Check if this node holds a lease
+    publish(channel: `str`, payload: `dict`):
+        Send an event to the other nodes
+    subscribe(channel: `str`, handler: `Callable[[dict], None]`):
+        Handle the events of a channel
+    submit(kind: `str`, payload: `dict`):
+        Add a job for the leader
+    worker(kind: `str`, handler: `Callable[[dict], coro]`):
+        Handle the jobs of a kind, when leader
+    """
+
+    # Config params
+    poll_interval = 1  # In sec
+    lease_ttl = 15  # In sec
+    events_retention = 10 * 60  # In sec
+    jobs_batch = 50
+    job_max_attempts = 5
+
+    node: str = None  # Set by `start()`, once the environment is loaded
+
+    _path: str = None
+    _conn: sqlite3.Connection = None
+    _executor: ThreadPoolExecutor = None
+    _task: asyncio.Task = None
+    _last_event: int = 0
+    _leases: Set[str] = set()
+    _held: Set[str] = set()
+    _leader: Optional[str] = None
+    _handlers: Dict[str, List[Callable]] = {}
+    _workers: Dict[str, Callable] = {}
+    _handler_tasks: Set[asyncio.Task] = set()
+
+    def __init__(self) -> None:
+        raise ClusterInstantiationError
+
+    @classmethod
+    def enabled(cls) -> bool:
+        return bool(os.getenv("CLUSTER_STORE"))
+
+    @classmethod
+    def _open(cls) -> None:
+        """Open the store and create the tables if needed. This is blocking and is run in the thread of the store."""
+        if os.path.dirname(cls._path):
+            os.makedirs(os.path.dirname(cls._path), exist_ok=True)
+        cls._conn = sqlite3.connect(cls._path, isolation_level=None, check_same_thread=False)
+        cls._conn.execute("PRAGMA busy_timeout = 5000")
+        cls._conn.execute("PRAGMA journal_mode = WAL")  # Readers of the other nodes do not block the writers
+        cls._conn.execute(
+            """CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                node TEXT NOT NULL,
+                channel TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )"""
+        )
+        cls._conn.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL
+            )"""
+        )
+        cls._conn.execute(
+            """CREATE TABLE IF NOT EXISTS dead_jobs (
+                id INTEGER PRIMARY KEY,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                error TEXT NOT NULL,
+                failed_at REAL NOT NULL
+            )"""
+        )
+        cls._conn.execute(
+            """CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                node TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )"""
+        )
+        # Only the events published from now on are followed, the caches are loaded from the google sheet
+        cls._last_event = cls._conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+
+    @classmethod
+    def _close(cls) -> None:
+        """Release the leases and close the store, after the writes queued before."""
+        try:
+            cls._conn.execute("DELETE FROM leases WHERE node = ?", (cls.node,))
+        finally:
+            cls._conn.close()
+            cls._conn = None
+
+    @classmethod
+    async def _call(cls, func: Callable, *args) -> Any:
+        """Run a blocking function on the store in its thread, after the writes queued before."""
+        return await asyncio.get_running_loop().run_in_executor(cls._executor, func, *args)
+
+    @classmethod
+    def _execute(cls, sql: str, params: tuple) -> None:
+        """Queue a write to the store, run in order in its thread."""
+        if cls._executor is None:
+            logging.warning(f"[Cluster] Store closed, write dropped: {sql.split('(')[0].strip()}")
+            return
+        cls._executor.submit(cls._conn.execute, sql, params).add_done_callback(cls._write_done)
+
+    @staticmethod
+    def _write_done(future: Future) -> None:
+        ex = None if future.cancelled() else future.exception()
+        if ex is not None:
+            logging.error(f"[Cluster] Not able to write to the store: {type(ex).__name__}: {ex}")
+
+    @classmethod
+    async def start(cls) -> None:
+        """Open the store, claim the leader lease and start following the events, if `CLUSTER_STORE` is set."""
+        cls.node = os.getenv("CLUSTER_NODE") or f"{socket.gethostname()}:{os.getpid()}"
+        if not cls.enabled() or cls._task is not None:
+            return
+        cls._path = os.getenv("CLUSTER_STORE")
+        cls._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cluster-store")
+        await cls._call(cls._open)
+        await cls.claim("leader")
+        Metrics.gauge_callback("cluster_leader", lambda: int(cls.is_leader()))
+        Metrics.gauge_callback("cluster_leases_held", lambda: len(cls._held))
+        cls._task = asyncio.create_task(cls._run())
+        logging.info(f"[Cluster] Node {cls.node} following {cls._path} (leader: {cls._leader})")
+
+    @classmethod
+    async def stop(cls) -> None:
+        if cls._task is None:
+            return
+        cls._task.cancel()
+        cls._task = None
+        try:
+            await cls._call(cls._close)
+        finally:
+            cls._executor.shutdown(wait=False)
+            cls._executor = None
+            cls._held.clear()
+        logging.info(f"[Cluster] Node {cls.node} stopped, leases released")
+
+    @classmethod
+    def is_leader(cls) -> bool:
+        return not cls.enabled() or "leader" in cls._held
+
+    @classmethod
+    def leader(cls) -> Optional[str]:
+        return cls.node if not cls.enabled() else cls._leader
+
+    @classmethod
+    def holds(cls, name: str) -> bool:
+        return not cls.enabled() or name in cls._held
+
+    @classmethod
+    def _acquire(cls, name: str) -> str:
+        """Take or renew a lease if it is free, expired or already held by this node. Return the node holding it."""
+        now = time.time()
+        cls._conn.execute(
+            """INSERT INTO leases VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET node = excluded.node, expires_at = excluded.expires_at
+            WHERE leases.node = excluded.node OR leases.expires_at < ?""",
+            (name, cls.node, now + cls.lease_ttl, now),
+        )
+        return cls._conn.execute("SELECT node FROM leases WHERE name = ?", (name,)).fetchone()[0]
+
+    @classmethod
+    def _update_lease(cls, name: str, holder: str) -> None:
+        held = holder == cls.node
+        if held and name not in cls._held:
+            cls._held.add(name)
+            Metrics.incr("cluster_lease_changes", lease=name)
+            logging.info(f"[Cluster] Lease {name} taken by {cls.node}")
+        elif not held and name in cls._held:
+            cls._held.discard(name)
+            Metrics.incr("cluster_lease_changes", lease=name)
+            logging.warning(f"[Cluster] Lease {name} lost to {holder}")
+        if name == "leader":
+            cls._leader = holder
+
+    @classmethod
+    async def claim(cls, name: str) -> bool:
+        """Take a lease if it is free, and keep renewing it.
+
+        Parameters
+        ----------
+        name : `str`
+            The name of the lease
+
+        Returns
+        -------
+        `bool`
+            True if this node holds the lease
+        """
+        if cls._conn is None:
+            return True
+        cls._leases.add(name)
+        cls._update_lease(name, await cls._call(cls._acquire, name))
+        return name in cls._held
+
+    @classmethod
+    def publish(cls, channel: str, payload: dict) -> None:
+        """Send an event to the other nodes. Nothing is sent if the clustered mode is disabled.
+
+        Parameters
+        ----------
+        channel : `str`
+            The channel of the event
+        payload : `dict`
+            The content of the event, serializable to JSON
+        """
+        if cls._conn is None:
+            return
+        cls._execute(
+            "INSERT INTO events (node, channel, payload, created_at) VALUES (?, ?, ?, ?)",
+            (cls.node, channel, json.dumps(payload), time.time()),
+        )
+        Metrics.incr("cluster_events", channel=channel, direction="out")
+
+    @classmethod
+    def subscribe(cls, channel: str, handler: Callable[[dict], None]) -> None:
+        """Handle the events of a channel published by the other nodes.
+
+        Parameters
+        ----------
+        channel : `str`
+            The channel
+        handler : `Callable[[dict], None]`
+            Called with the payload of each event. A coroutine function is run as a task
+        """
+        handlers = cls._handlers.setdefault(channel, [])
+        if handler not in handlers:
+            handlers.append(handler)
+
+    @classmethod
+    def submit(cls, kind: str, payload: dict) -> None:
+        """Add a job, run in order by the leader.
+
+        Parameters
+        ----------
+        kind : `str`
+            The kind of job, see `worker()`
+        payload : `dict`
+            The content of the job, serializable to JSON
+        """
+        cls._execute(
+            "INSERT INTO jobs (kind, payload, created_at) VALUES (?, ?, ?)", (kind, json.dumps(payload), time.time())
+        )
+        Metrics.incr("cluster_jobs_submitted", kind=kind)
+
+    @classmethod
+    def worker(cls, kind: str, handler: Callable) -> None:
+        """Handle the jobs of a kind when this node is the leader.
+
+        Parameters
+        ----------
+        kind : `str`
+            The kind of job
+        handler : `Callable[[dict], coro]`
+            Coroutine function called with the payload of each job. The job is retried if it raises
+        """
+        cls._workers[kind] = handler
+
+    @classmethod
+    def _tick(cls) -> Tuple[Dict[str, str], List[Tuple[int, str, str]], List[Tuple[int, str, str, int]]]:
+        """Renew the leases and read the new events and, if leader, the next jobs. This is blocking and is run in a
+        thread of the store by `_run()`."""
+        holders = {name: cls._acquire(name) for name in list(cls._leases)}
+        events = cls._conn.execute(
+            "SELECT id, channel, payload FROM events WHERE id > ? AND node != ? ORDER BY id",
+            (cls._last_event, cls.node),
+        ).fetchall()
+        jobs = []
+        if holders.get("leader") == cls.node:
+            cls._conn.execute("DELETE FROM events WHERE created_at < ?", (time.time() - cls.events_retention,))
+            jobs = cls._conn.execute(
+                "SELECT id, kind, payload, attempts FROM jobs ORDER BY id LIMIT ?", (cls.jobs_batch,)
+            ).fetchall()
+            Metrics.gauge("cluster_jobs_pending", cls._conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0])
+        return holders, events, jobs
+
+    @classmethod
+    def _dispatch(cls, channel: str, payload: dict) -> None:
+        Metrics.incr("cluster_events", channel=channel, direction="in")
+        for handler in cls._handlers.get(channel, []):
+            try:
+                result = handler(payload)
+                if asyncio.iscoroutine(result):
+                    task = asyncio.create_task(result)
+                    cls._handler_tasks.add(task)
+                    task.add_done_callback(cls._handler_tasks.discard)
+            except Exception as ex:
+                logging.error(f"[Cluster] Not able to handle event on {channel}: {type(ex).__name__}: {ex}")
+
+    @classmethod
+    async def _work(cls, jobs: List[Tuple[int, str, str, int]]) -> None:
+        """Run the jobs in order, stopping at the first failure so the next ones are not run before it. A job failing
+        `job_max_attempts` times is moved to `dead_jobs` instead."""
+        for job_id, kind, payload, attempts in jobs:
+            if not cls.is_leader():
+                return
+            handler = cls._workers.get(kind)
+            if handler is None:
+                continue  # Not handled by this version of the bot, left for a leader that does
+            try:
+                await handler(json.loads(payload))
+            except CircuitOpenError:
+                return  # The backend is down, retried once the circuit lets a call through
+            except Exception as ex:
+                Metrics.incr("cluster_job_failures", kind=kind)
+                if attempts + 1 < cls.job_max_attempts:
+                    await cls._call(
+                        cls._conn.execute, "UPDATE jobs SET attempts = attempts + 1 WHERE id = ?", (job_id,)
+                    )
+                    logging.error(f"[Cluster] Job {kind}:{job_id} failed, retried later: {type(ex).__name__}: {ex}")
+                    return
+                await cls._call(
+                    cls._conn.execute,
+                    """INSERT INTO dead_jobs SELECT id, kind, payload, attempts + 1, created_at, ?, ? FROM jobs
+                    WHERE id = ?""",
+                    (f"{type(ex).__name__}: {ex}", time.time(), job_id),
+                )
+                await cls._call(cls._conn.execute, "DELETE FROM jobs WHERE id = ?", (job_id,))
+                Metrics.incr("cluster_jobs_dead", kind=kind)
+                logging.error(
+                    f"[Cluster] Job {kind}:{job_id} failed {attempts + 1} times, moved to dead_jobs: {payload}: "
+                    + f"{type(ex).__name__}: {ex}"
+                )
+                continue
+            await cls._call(cls._conn.execute, "DELETE FROM jobs WHERE id = ?", (job_id,))
+            Metrics.incr("cluster_jobs_done", kind=kind)
+
+    @classmethod
+    async def _run(cls) -> None:
+        while True:
+            try:
+                holders, events, jobs = await cls._call(cls._tick)
+                for name, holder in holders.items():
+                    cls._update_lease(name, holder)
+                for event_id, channel, payload in events:
+                    cls._last_event = event_id
+                    cls._dispatch(channel, json.loads(payload))
+                await cls._work(jobs)
+            except Exception as ex:
+                logging.error(f"[Cluster] Not able to sync with the store: {type(ex).__name__}: {ex}")
+            await asyncio.sleep(cls.poll_interval)
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import time
+import traceback
+from typing import Dict
+from typing import List
+
+import disnake
+
+from .metrics import Metrics
+
+
+class _ErrorGroup:
+    __slots__ = ("type", "message", "traceback", "count", "first_context", "last_context", "first_seen")
+
+    def __init__(self, error: Exception, tb: str, context: str) -> None:
+        self.type: str = type(error).__name__
+        self.message: str = str(error)
+        self.traceback: str = tb
+        self.count: int = 0
+        self.first_context: str = context
+        self.last_context: str = context
+        self.first_seen: float = time.time()
+
+
+class ErrorReporterInstantiationError(Exception):
+    """The Exception to be raise when the ErrorReporter class is instantiated."""
+
+    def __init__(self, *args: object) -> None:
+        super().__init__("The ErrorReporter class cannot be instantiated, but only used as a class.")
+
+
+class ErrorReporter:
+    """Represent the coalescing error report of the log channel.
+
+    The errors are fingerprinted by their type and the sites of their traceback, and the duplicates raised within
+    `window` seconds are sent as a single embed with their count. All the errors of a window are sent in one message,
+    with the full tracebacks as file attachments.
+
+    The reports have their own budget of `ERROR_REPORT_BUDGET` messages per hour (30 by default). When it is spent, the
+    errors keep being coalesced until the next message is allowed.
+
+    This class is only used as a class and should not be instantiated
+
+    Classmethods
+    ------------
+    report(error: `Exception`, tb: `str`, context: `str`):
+        Add an error to the next report
+    fingerprint(error: `Exception`): `str`
+        Get the fingerprint of an error
+    """
+
+    window: float = 60
+    max_embeds: int = 10  # Discord limit of embeds and files per message
+
+    channel: disnake.abc.Messageable = None
+    _groups: Dict[str, _ErrorGroup] = {}
+    _task: asyncio.Task = None
+    _tokens: float = None
+    _last_refill: float = 0.0
+
+    def __init__(self) -> None:
+        raise ErrorReporterInstantiationError
+
+    @classmethod
+    def _budget(cls) -> float:
+        return float(os.getenv("ERROR_REPORT_BUDGET") or 30)
+
+    @staticmethod
+    def fingerprint(error: Exception) -> str:
+        """Get the fingerprint of an error, from its type and the file, function and line of each frame of its
+        traceback. The message is left out, so the same failure with different values has the same fingerprint."""
+        frames = traceback.extract_tb(error.__traceback__) if error.__traceback__ else []
+        sites = "|".join(f"{os.path.basename(frame.filename)}:{frame.name}:{frame.lineno}" for frame in frames)
+        return hashlib.sha1(f"{type(error).__qualname__}|{sites}".encode()).hexdigest()[:12]
+
+    @classmethod
+    def report(cls, error: Exception, tb: str, context: str) -> None:
+        """Add an error to the next report, sent at the end of the current window.
+
+        Parameters
+        ----------
+        error : `Exception`
+            The error
+        tb : `str`
+            The formatted traceback of the error
+        context : `str`
+            Where the error was raised, shown in the report
+        """
+        error = getattr(error, "original", error)  # Unwrap the CommandInvokeError of disnake
+        fingerprint = cls.fingerprint(error)
+        group = cls._groups.get(fingerprint)
+        if group is None:
+            group = cls._groups[fingerprint] = _ErrorGroup(error, tb, context)
+        group.count += 1
+        group.last_context = context
+        Metrics.incr("errors", type=group.type)
+        if cls._task is None or cls._task.done():
+            cls._task = asyncio.create_task(cls._flush_later(cls.window))
+
+    @classmethod
+    def _take_token(cls) -> float:
+        """Take a token from the budget. Return 0 if taken, else the time to wait for the next token."""
+        budget = cls._budget()
+        now = time.monotonic()
+        if cls._tokens is None:
+            cls._tokens = budget
+        cls._tokens = min(budget, cls._tokens + (now - cls._last_refill) * budget / 3600)
+        cls._last_refill = now
+        if cls._tokens >= 1:
+            cls._tokens -= 1
+            return 0
+        return (1 - cls._tokens) * 3600 / budget
+
+    @classmethod
+    async def _flush_later(cls, delay: float) -> None:
+        while True:
+            await asyncio.sleep(delay)
+            delay = cls._take_token()
+            if delay == 0:
+                break
+            Metrics.incr("error_reports_deferred")
+        await cls._flush()
+        if cls._groups:  # More than max_embeds fingerprints, or raised while sending
+            cls._task = asyncio.create_task(cls._flush_later(cls.window))
+
+    @classmethod
+    def _embed(cls, fingerprint: str, group: _ErrorGroup) -> disnake.Embed:
+        embed = disnake.Embed(
+            title=f":x: __**{group.type}**__ ×{group.count}",
+            description=f"```{group.message[:1000]}```",
+            color=disnake.Colour.red(),
+        )
+        embed.add_field(name="Première occurrence :", value=group.first_context[:1024], inline=False)
+        if group.count > 1:
+            embed.add_field(name="Dernière occurrence :", value=group.last_context[:1024], inline=False)
+        embed.set_footer(text=f"Empreinte {fingerprint} • traceback-{fingerprint}.txt")
+        embed.timestamp = disnake.utils.utcnow()
+        return embed
+
+    @classmethod
+    async def _flush(cls) -> None:
+        fingerprints = list(cls._groups.keys())[: cls.max_embeds]
+        groups: List[_ErrorGroup] = [cls._groups.pop(fingerprint) for fingerprint in fingerprints]
+        if not groups:
+            return
+        if cls.channel is None:
+            logging.warning(f"[ErrorReporter] No log channel, {len(groups)} error reports dropped")
+            return
+        try:
+            await cls.channel.send(
+                embeds=[cls._embed(fingerprint, group) for fingerprint, group in zip(fingerprints, groups)],
+                files=[
+                    disnake.File(io.BytesIO(group.traceback.encode()), filename=f"traceback-{fingerprint}.txt")
+                    for fingerprint, group in zip(fingerprints, groups)
+                ],
+            )
+            Metrics.incr("error_reports_sent")
+        except disnake.HTTPException as ex:
+            logging.error(f"[ErrorReporter] Not able to send the error report: {ex}")
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+import collections
+import functools
+import time
+
+import disnake
+
+from .metrics import Metrics
+
+
+class Origin:
+    """Lazy description of where an interaction comes from, only formatted if the log record is emitted."""
+
+    __slots__ = ("_interaction",)
+
+    def __init__(self, interaction: disnake.Interaction) -> None:
+        self._interaction = interaction
+
+    def __str__(self) -> str:
+        inter = self._interaction
+        return inter.guild.name + "#" + inter.channel.name if inter.guild else "DM"
+
+
+class _InFlight:
+    __slots__ = ("kind", "command", "start", "acked")
+
+    def __init__(self, kind: str, command: str) -> None:
+        self.kind: str = kind
+        self.command: str = command
+        self.start: float = time.perf_counter()
+        self.acked: bool = False
+
+
+class CommandTrackerInstantiationError(Exception):
+    """The Exception to be raise when the CommandTracker class is instantiated."""
+
+    def __init__(self, *args: object) -> None:
+        super().__init__("The CommandTracker class cannot be instantiated, but only used as a class.")
+
+
+class CommandTracker:
+    """Represent the latency and outcome metrics of the application commands.
+
+    The commands in flight are kept by interaction id in insertion order, so the ones that never complete (unknown
+    command, crashed listener...) are dropped after `ttl` seconds, or when more than `max_in_flight` are tracked, and
+    counted as abandoned.
+
+    Recorded metrics, labelled by `kind` (slash, user, message) and `command`:
+    - `command_ack_seconds`: time to the first response (defer, message, modal or edit)
+    - `command_seconds`: time to the completion or the error
+    - `commands{outcome}`: count of ok, error and abandoned commands
+    - `commands_in_flight`: number of commands started but not finished
+
+    This class is only used as a class and should not be instantiated
+
+    Classmethods
+    ------------
+    install():
+        Hook the responses of the interactions to record the time to the first response
+    start(interaction: `disnake.ApplicationCommandInteraction`):
+        Record the start of a command
+    finish(interaction: `disnake.ApplicationCommandInteraction`, outcome: `str`):
+        Record the end of a command
+    """
+
+    ttl: float = 15 * 60  # Lifetime of an interaction token
+    max_in_flight: int = 1000
+
+    _in_flight: "collections.OrderedDict[int, _InFlight]" = collections.OrderedDict()
+    _commands: set = set()
+    _installed = False
+
+    def __init__(self) -> None:
+        raise CommandTrackerInstantiationError
+
+    @staticmethod
+    def kind(interaction: disnake.ApplicationCommandInteraction) -> str:
+        return {
+            disnake.ApplicationCommandType.chat_input: "slash",
+            disnake.ApplicationCommandType.user: "user",
+            disnake.ApplicationCommandType.message: "message",
+        }.get(interaction.data.type, "unknown")
+
+    @classmethod
+    def install(cls) -> None:
+        """Wrap the `InteractionResponse` methods acknowledging an interaction to record the time to the first response.
+
+        `InteractionResponse` uses `__slots__`, so the methods are wrapped on the class and not per instance.
+        """
+        if cls._installed:
+            return
+        for name in ("defer", "send_message", "send_modal", "edit_message"):
+            setattr(disnake.InteractionResponse, name, cls._wrap(getattr(disnake.InteractionResponse, name)))
+        cls._installed = True
+
+    @classmethod
+    def _wrap(cls, method):
+        @functools.wraps(method)
+        async def wrapper(response: disnake.InteractionResponse, *args, **kwargs):
+            result = await method(response, *args, **kwargs)
+            entry = cls._in_flight.get(response._parent.id)
+            if entry is not None and not entry.acked:
+                entry.acked = True
+                Metrics.observe(
+                    "command_ack_seconds", time.perf_counter() - entry.start, kind=entry.kind, command=entry.command
+                )
+            return result
+
+        return wrapper
+
+    @classmethod
+    def _expire(cls) -> None:
+        now = time.perf_counter()
+        while cls._in_flight:
+            entry = next(iter(cls._in_flight.values()))
+            if now - entry.start < cls.ttl and len(cls._in_flight) <= cls.max_in_flight:
+                break
+            cls._in_flight.popitem(last=False)
+            Metrics.incr("commands", kind=entry.kind, command=entry.command, outcome="abandoned")
+
+    @classmethod
+    def _in_flight_count(cls, command: str) -> int:
+        return sum(1 for entry in cls._in_flight.values() if entry.command == command)
+
+    @classmethod
+    def start(cls, interaction: disnake.ApplicationCommandInteraction) -> None:
+        entry = _InFlight(cls.kind(interaction), interaction.data.name)
+        cls._in_flight[interaction.id] = entry
+        if entry.command not in cls._commands:
+            cls._commands.add(entry.command)
+            Metrics.gauge_callback(
+                "commands_in_flight", functools.partial(cls._in_flight_count, entry.command), command=entry.command
+            )
+        cls._expire()
+
+    @classmethod
+    def finish(cls, interaction: disnake.ApplicationCommandInteraction, outcome: str) -> None:
+        entry = cls._in_flight.pop(interaction.id, None)
+        if entry is None:
+            return
+        Metrics.observe("command_seconds", time.perf_counter() - entry.start, kind=entry.kind, command=entry.command)
+        Metrics.incr("commands", kind=entry.kind, command=entry.command, outcome=outcome)
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+import importlib.util
+import os
+import sys
+from types import ModuleType
+
+
+def lazy_imports_enabled() -> bool:
+    return os.getenv("LAZY_IMPORTS", "").lower() in ("1", "true", "yes")
+
+
+def lazy_import(name: str) -> ModuleType:
+    """Import a module, deferring its execution to the first attribute access if `LAZY_IMPORTS` is enabled.
+
+    This is used for the heavy dependencies that are not needed to connect to discord (google sheet, email), so they
+    are loaded in the background of the startup instead of delaying it.
+
+    Parameters
+    ----------
+    name : `str`
+        The absolute name of the module
+
+    Returns
+    -------
+    `ModuleType`
+        The module, or a lazy module executed on first use
+    """
+    if name in sys.modules or not lazy_imports_enabled():
+        return importlib.import_module(name)
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import atexit
+import copy
+import json
+import logging.handlers
+import os
+import queue
+import random
+from typing import List
+
+from .metrics import Metrics
+
+
+class JsonFormatter(logging.Formatter):
+    """Format the log records as one JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "thread": record.threadName,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        elif record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+class TraceSampler(logging.Filter):
+    """Only keep a random fraction of the TRACE records.
+
+    Parameters
+    ----------
+    rate: `float`
+        The fraction of TRACE records kept, between 0 and 1
+    """
+
+    def __init__(self, rate: float) -> None:
+        super().__init__()
+        self.rate: float = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno != getattr(logging, "TRACE", logging.INFO - 5) or random.random() < self.rate:
+            return True
+        Metrics.incr("log_records_sampled_out")
+        return False
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """`QueueHandler` leaving the formatting of the message to the writer thread.
+
+    The default `prepare()` formats every record on the calling thread. Here only the exception is rendered (its
+    traceback would not survive), the message and its arguments are formatted by the handlers of the listener.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record = copy.copy(record)
+        record.exc_info = None
+        return record
+
+
+def setup_logging(handlers: List[logging.Handler]) -> logging.handlers.QueueListener:
+    """Send the records of the root logger through a queue to the given handlers, written by a dedicated thread.
+
+    The log calls on the event loop only filter and enqueue the records, the formatting and the file I/O are done by
+    the thread of the returned `QueueListener`, which is flushed at exit. The root logger is set to the lowest level
+    of the handlers, so the records no handler would write are not even created.
+
+    `LOG_JSON` switches all the handlers to one JSON object per line, and `LOG_TRACE_SAMPLE` (between 0 and 1) sets the
+    fraction of TRACE records kept.
+
+    Parameters
+    ----------
+    handlers : `List[logging.Handler]`
+        The handlers writing the records, with their level and formatter
+
+    Returns
+    -------
+    `logging.handlers.QueueListener`
+        The started listener
+    """
+    if os.getenv("LOG_JSON", "").lower() in ("1", "true", "yes"):
+        for handler in handlers:
+            handler.setFormatter(JsonFormatter())
+    queue_handler = LazyQueueHandler(queue.SimpleQueue())
+    queue_handler.setLevel(min(handler.level for handler in handlers))
+    sample = float(os.getenv("LOG_TRACE_SAMPLE") or 1)
+    if sample < 1:
+        queue_handler.addFilter(TraceSampler(sample))
+
+    root = logging.getLogger()
+    root.setLevel(queue_handler.level)
+    root.addHandler(queue_handler)
+    listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+import functools
+import time
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Represent an HDR-style latency histogram.
+
+    Values are recorded in microseconds into log-linear buckets, so the relative error of any percentile is bounded by
+    `1 / 2**precision_bits` whatever the range of the values, with a constant memory per used bucket.
+
+    Parameters
+    ----------
+    precision_bits: `int`
+        The number of bits of precision kept for each value, by default 5 (~3% relative error)
+    """
+
+    def __init__(self, precision_bits: int = 5) -> None:
+        self._bits: int = precision_bits
+        self.buckets: Dict[int, int] = {}
+        self.count: int = 0
+        self.sum: float = 0.0
+        self.max: float = 0.0
+
+    def _index(self, us: int) -> int:
+        if us < (1 << self._bits):
+            return us
+        shift = us.bit_length() - self._bits - 1
+        return ((shift + 1) << self._bits) + (us >> shift) - (1 << self._bits)
+
+    def _upper_bound(self, index: int) -> int:
+        if index < (1 << self._bits):
+            return index
+        shift = (index >> self._bits) - 1
+        mantissa = (index & ((1 << self._bits) - 1)) + (1 << self._bits)
+        return ((mantissa + 1) << shift) - 1
+
+    def record(self, seconds: float) -> None:
+        """Record a value.
+
+        Parameters
+        ----------
+        seconds : `float`
+            The value to record, in seconds
+        """
+        index = self._index(max(int(seconds * 1_000_000), 0))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p: float) -> float:
+        """Get the value at a given percentile.
+
+        Parameters
+        ----------
+        p : `float`
+            The percentile, between 0 and 100
+
+        Returns
+        -------
+        `float`
+            The upper bound of the bucket containing the percentile, in seconds
+        """
+        if self.count == 0:
+            return 0.0
+        rank = max(1, round(self.count * p / 100))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(self._upper_bound(index) / 1_000_000, self.max)
+        return self.max
+
+    def cumulative(self, bounds: List[float]) -> List[int]:
+        """Get the cumulative count of values lower or equal than each bound, as used by prometheus buckets."""
+        counts = [0] * len(bounds)
+        for index, count in self.buckets.items():
+            value = self._upper_bound(index) / 1_000_000
+            for i, bound in enumerate(bounds):
+                if value <= bound:
+                    counts[i] += count
+        return counts
+
+
+class MetricsInstantiationError(Exception):
+    """The Exception to be raise when the Metrics class is instantiated."""
+
+    def __init__(self, *args: object) -> None:
+        super().__init__("The Metrics class cannot be instantiated, but only used as a class.")
+
+
+class Metrics:
+    """Represent the in-process metrics registry.
+
+    This class is only used as a class and should not be instantiated
+
+    Classmethods
+    ------------
+    incr(name: `str`, value: `float`, **labels):
+        Increment a counter
+    gauge(name: `str`, value: `float`, **labels):
+        Set the value of a gauge
+    gauge_callback(name: `str`, callback: `Callable[[], float]`, **labels):
+        Register a gauge computed when the metrics are exported
+    observe(name: `str`, seconds: `float`, **labels):
+        Record a latency in a histogram
+    timed(name: `str`, **labels):
+        Decorator recording the duration of a coroutine in a histogram
+    render(): `str`
+        Export all the metrics in the OpenMetrics text format
+    summary(): `str`
+        Export all the metrics in a short human readable format
+    """
+
+    bucket_bounds = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 600]
+
+    _counters: Dict[str, Dict[Labels, float]] = {}
+    _gauges: Dict[str, Dict[Labels, float]] = {}
+    _gauge_callbacks: Dict[str, Dict[Labels, Callable[[], float]]] = {}
+    _histograms: Dict[str, Dict[Labels, Histogram]] = {}
+
+    def __init__(self) -> None:
+        raise MetricsInstantiationError
+
+    @staticmethod
+    def _labels(labels: Dict[str, object]) -> Labels:
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    @classmethod
+    def incr(cls, name: str, value: float = 1, **labels) -> None:
+        series = cls._counters.setdefault(name, {})
+        key = cls._labels(labels)
+        series[key] = series.get(key, 0) + value
+
+    @classmethod
+    def gauge(cls, name: str, value: float, **labels) -> None:
+        cls._gauges.setdefault(name, {})[cls._labels(labels)] = value
+
+    @classmethod
+    def gauge_callback(cls, name: str, callback: Callable[[], float], **labels) -> None:
+        cls._gauge_callbacks.setdefault(name, {})[cls._labels(labels)] = callback
+
+    @classmethod
+    def observe(cls, name: str, seconds: float, **labels) -> None:
+        series = cls._histograms.setdefault(name, {})
+        key = cls._labels(labels)
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram()
+        histogram.record(seconds)
+
+    @classmethod
+    def histogram(cls, name: str, **labels) -> Histogram:
+        return cls._histograms.get(name, {}).get(cls._labels(labels))
+
+    @classmethod
+    def counter(cls, name: str, **labels) -> float:
+        return cls._counters.get(name, {}).get(cls._labels(labels), 0)
+
+    @classmethod
+    def timed(cls, name: str, **labels):
+        """Decorator recording the duration of each call of a coroutine function in the histogram `name`."""
+
+        def decorator(coro):
+            @functools.wraps(coro)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await coro(*args, **kwargs)
+                finally:
+                    cls.observe(name, time.perf_counter() - start, **labels)
+
+            return wrapper
+
+        return decorator
+
+    @staticmethod
+    def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+        labels = labels + extra
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+    @classmethod
+    def _gauge_values(cls) -> Dict[str, Dict[Labels, float]]:
+        gauges = {name: dict(series) for name, series in cls._gauges.items()}
+        for name, series in cls._gauge_callbacks.items():
+            for labels, callback in series.items():
+                try:
+                    gauges.setdefault(name, {})[labels] = callback()
+                except Exception:
+                    continue
+        return gauges
+
+    @classmethod
+    def render(cls) -> str:
+        """Export all the metrics in the OpenMetrics text format.
+
+        Returns
+        -------
+        `str`
+            The metrics
+        """
+        lines: List[str] = []
+        for name, series in cls._counters.items():
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in series.items():
+                lines.append(f"{name}_total{cls._format_labels(labels)} {value}")
+        for name, series in cls._gauge_values().items():
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in series.items():
+                lines.append(f"{name}{cls._format_labels(labels)} {value}")
+        for name, series in cls._histograms.items():
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in series.items():
+                for bound, count in zip(cls.bucket_bounds, histogram.cumulative(cls.bucket_bounds)):
+                    lines.append(f"{name}_bucket{cls._format_labels(labels, (('le', str(bound)),))} {count}")
+                lines.append(f"{name}_bucket{cls._format_labels(labels, (('le', '+Inf'),))} {histogram.count}")
+                lines.append(f"{name}_count{cls._format_labels(labels)} {histogram.count}")
+                lines.append(f"{name}_sum{cls._format_labels(labels)} {histogram.sum}")
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    @classmethod
+    def summary(cls) -> str:
+        """Export all the metrics in a short human readable format, with the p50/p90/p99 of the histograms.
+
+        Returns
+        -------
+        `str`
+            The metrics
+        """
+        lines: List[str] = []
+        for name, series in cls._counters.items():
+            for labels, value in sorted(series.items()):
+                lines.append(f"{name}{cls._format_labels(labels)} = {value:g}")
+        for name, series in cls._gauge_values().items():
+            for labels, value in sorted(series.items()):
+                lines.append(f"{name}{cls._format_labels(labels)} = {value:g}")
+        for name, series in cls._histograms.items():
+            for labels, histogram in sorted(series.items()):
+                lines.append(
+                    f"{name}{cls._format_labels(labels)} n={histogram.count} "
+                    + " ".join(f"p{p}={histogram.percentile(p) * 1000:.1f}ms" for p in (50, 90, 99))
+                    + f" max={histogram.max * 1000:.1f}ms"
+                )
+        return "\n".join(lines)
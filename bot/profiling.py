@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+
+class MemoryProfilerInstantiationError(Exception):
+    """The Exception to be raise when the MemoryProfiler class is instantiated."""
+
+    def __init__(self, *args: object) -> None:
+        super().__init__("The MemoryProfiler class cannot be instantiated, but only used as a class.")
+
+
+class MemoryProfiler:
+    """Represent the opt-in tracemalloc memory profiler.
+
+    tracemalloc is off by default, because it slows down every allocation. It is started at boot if `TRACEMALLOC` is
+    set to a number of frames, or at runtime with `start()`.
+
+    This class is only used as a class and should not be instantiated
+
+    Classmethods
+    ------------
+    start(frames: `int`):
+        Start tracing the allocations and take the reference snapshot
+    snapshot(top: `int`): `Tuple[str, str]`
+        Diff a new snapshot against the previous one
+    stop():
+        Stop tracing the allocations and drop the snapshots
+    """
+
+    groups = [
+        ("Database", ("classes/database.py", "classes/bulkUsers.py")),
+        ("Registration", ("classes/registration.py", "classes/registrationStore.py")),
+        ("disnake member cache", ("disnake/state.py", "disnake/member.py", "disnake/user.py", "disnake/guild.py")),
+        ("disnake", ("disnake/",)),
+    ]
+
+    _previous: tracemalloc.Snapshot = None
+
+    def __init__(self) -> None:
+        raise MemoryProfilerInstantiationError
+
+    @classmethod
+    def start_from_env(cls) -> None:
+        frames = os.getenv("TRACEMALLOC")
+        if frames:
+            cls.start(int(frames))
+
+    @classmethod
+    def running(cls) -> bool:
+        return tracemalloc.is_tracing()
+
+    @classmethod
+    def start(cls, frames: int = 10) -> None:
+        """Start tracing the allocations and take the reference snapshot.
+
+        Parameters
+        ----------
+        frames : `int`
+            The number of frames kept for each allocation, used to find the group of an allocation, by default 10
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            logging.info(f"[MemoryProfiler] tracemalloc started with {frames} frames")
+        cls._previous = cls._take_snapshot()
+
+    @classmethod
+    def stop(cls) -> None:
+        tracemalloc.stop()
+        cls._previous = None
+        logging.info("[MemoryProfiler] tracemalloc stopped")
+
+    @staticmethod
+    def _take_snapshot() -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(
+            (
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                tracemalloc.Filter(False, "<unknown>"),
+            )
+        )
+
+    @classmethod
+    def _group(cls, traceback: tracemalloc.Traceback) -> str:
+        filenames = [frame.filename.replace("\\", "/") for frame in traceback]
+        for group, paths in cls.groups:
+            if any(path in filename for filename in filenames for path in paths):
+                return group
+        return os.path.basename(filenames[-1]) if filenames else "<unknown>"
+
+    @classmethod
+    def snapshot(cls, top: int = 25) -> Tuple[str, str]:
+        """Take a new snapshot and diff it against the previous one (or the reference snapshot).
+
+        Parameters
+        ----------
+        top : `int`
+            The number of allocation sites to include in the report, by default 25
+
+        Returns
+        -------
+        `Tuple[str, str]`
+            A short summary per group, and the full report with the top allocation sites of each group
+        """
+        snapshot = cls._take_snapshot()
+        stats = snapshot.compare_to(cls._previous, "traceback") if cls._previous else snapshot.statistics("traceback")
+        cls._previous = snapshot
+
+        groups: Dict[str, List[tracemalloc.StatisticDiff]] = {}
+        for stat in stats:
+            groups.setdefault(cls._group(stat.traceback), []).append(stat)
+        totals = {
+            group: (sum(getattr(s, "size_diff", s.size) for s in group_stats), sum(s.size for s in group_stats))
+            for group, group_stats in groups.items()
+        }
+        current, peak = tracemalloc.get_traced_memory()
+
+        summary = [f"{'traced':<22}{current / 1024:>10.0f} KiB (peak {peak / 1024:.0f} KiB)"]
+        for group, (diff, size) in sorted(totals.items(), key=lambda item: -item[1][1])[:10]:
+            summary.append(f"{group[:21]:<22}{size / 1024:>10.0f} KiB {diff / 1024:>+9.0f} KiB")
+
+        report = ["\n".join(summary), ""]
+        for group, (diff, size) in sorted(totals.items(), key=lambda item: -item[1][1]):
+            report.append(f"== {group}: {size / 1024:.1f} KiB ({diff / 1024:+.1f} KiB) ==")
+            for stat in sorted(groups[group], key=lambda s: -s.size)[:top]:
+                report.append(str(stat))
+                report.extend(f"    {line}" for line in stat.traceback.format(limit=3, most_recent_first=True))
+            report.append("")
+        return "\n".join(summary), "\n".join(report)
+
+
+class SamplingProfilerInstantiationError(Exception):
+    """The Exception to be raise when the SamplingProfiler class is instantiated."""
+
+    def __init__(self, *args: object) -> None:
+        super().__init__("The SamplingProfiler class cannot be instantiated, but only used as a class.")
+
+
+class SamplingProfiler:
+    """Represent the on-demand sampling profiler.
+
+    A thread samples the stacks of all the threads at a fixed interval with `sys._current_frames()`, so the profiled
+    code is not instrumented and the overhead only depends on the interval. The coroutine frames are part of the stack
+    of the event loop thread while they run, so the time is attributed to the coroutines and their handlers.
+
+    This class is only used as a class and should not be instantiated
+
+    Classmethods
+    ------------
+    profile(seconds: `float`, interval: `float`, top: `int`): `coro` -> `Tuple[str, str]`
+        Profile the process during the given time
+    running(): `bool`
+        Check if a profile is running
+    """
+
+    tracked = ["update_member", "_set_user_task", "send_token", "send_error_log"]
+    _idle = ("select", "poll", "epoll", "_worker")
+    _loop_internals = ("<module>", "run", "run_forever", "run_until_complete", "_run_once", "_run", "__step")
+    _running = False
+
+    def __init__(self) -> None:
+        raise SamplingProfilerInstantiationError
+
+    @classmethod
+    def running(cls) -> bool:
+        return cls._running
+
+    @staticmethod
+    def _label(frame) -> str:
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    @classmethod
+    def _sample(cls, seconds: float, interval: float) -> Tuple[Dict[Tuple[str, ...], int], int]:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        me = threading.get_ident()
+        stacks: Dict[Tuple[str, ...], int] = {}
+        nbr_samples = 0
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(cls._label(frame))
+                    frame = frame.f_back
+                if ident not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                stack.append(names.get(ident, str(ident)))
+                key = tuple(reversed(stack))
+                stacks[key] = stacks.get(key, 0) + 1
+            nbr_samples += 1
+            time.sleep(interval)
+        return stacks, nbr_samples
+
+    @classmethod
+    async def profile(cls, seconds: float, interval: float = 0.005, top: int = 15) -> Tuple[str, str]:
+        """Profile the process during the given time.
+
+        Parameters
+        ----------
+        seconds : `float`
+            The duration of the profile
+        interval : `float`
+            The time between two samples, in seconds, by default 0.005
+        top : `int`
+            The number of functions in the summary, by default 15
+
+        Returns
+        -------
+        `Tuple[str, str]`
+            A top-N summary of the event loop thread, and all the stacks in the collapsed format used by flamegraph.pl
+            and speedscope (`thread;outer;...;inner count`)
+
+        Raises
+        ------
+        `RuntimeError`
+            If a profile is already running
+        """
+        if cls._running:
+            raise RuntimeError("A profile is already running")
+        cls._running = True
+        try:
+            stacks, nbr_samples = await asyncio.to_thread(cls._sample, seconds, interval)
+        finally:
+            cls._running = False
+
+        loop_thread = threading.main_thread().name
+        own: Dict[str, int] = {}
+        total: Dict[str, int] = {}
+        tracked: Dict[str, int] = {name: 0 for name in cls.tracked}
+        busy = 0
+        for stack, count in stacks.items():
+            if stack[0] != loop_thread:
+                continue
+            leaf = stack[-1].split(" ", 1)[0]
+            if leaf in cls._idle:
+                continue
+            busy += count
+            own[stack[-1]] = own.get(stack[-1], 0) + count
+            for label in set(stack[1:]):
+                total[label] = total.get(label, 0) + count
+            for name in {label.split(" ", 1)[0] for label in stack[1:]} & tracked.keys():
+                tracked[name] += count
+
+        def percent(count: int) -> str:
+            return f"{count / max(nbr_samples, 1) * 100:5.1f}%"
+
+        summary = [f"{nbr_samples} samples, event loop busy {percent(busy)}", "", "Handlers (inclusive) :"]
+        summary.extend(f"  {percent(count)} {name}" for name, count in tracked.items())
+        summary.extend(["", "Top self :"])
+        summary.extend(f"  {percent(c)} {label}" for label, c in sorted(own.items(), key=lambda i: -i[1])[:top])
+        summary.extend(["", "Top inclusive :"])
+        inclusive = [
+            (label, c)
+            for label, c in sorted(total.items(), key=lambda i: -i[1])
+            if label.split(" ", 1)[0] not in cls._loop_internals
+        ]
+        summary.extend(f"  {percent(c)} {label}" for label, c in inclusive[:top])
+        collapsed = "\n".join(f"{';'.join(stack)} {count}" for stack, count in sorted(stacks.items()))
+        return "\n".join(summary), collapsed + "\n"
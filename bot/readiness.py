@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from .metrics import Metrics
+
+
+class Stage:
+    gateway = "gateway_ready"
+    storage = "storage_loaded"
+    registration = "registration_ready"
+    first_ulb = "first_ulb_served"
+    initial_sync = "initial_sync_done"
+
+    all = [gateway, storage, registration, first_ulb, initial_sync]
+    # Stages reached by each shard, the stage itself being reached once all the shards reached it
+    per_shard = [gateway, storage, initial_sync]
+
+
+class ReadinessInstantiationError(Exception):
+    """The Exception to be raise when the Readiness class is instantiated."""
+
+    def __init__(self, *args: object) -> None:
+        super().__init__("The Readiness class cannot be instantiated, but only used as a class.")
+
+
+class Readiness:
+    """Represent the readiness of the bot, as a set of named startup stages.
+
+    Each stage is backed by an `asyncio.Event`, so the coroutines waiting for it wake up as soon as it is reached.
+
+    The stages of `Stage.per_shard` are also tracked for each shard of the gateway, given with `shard`: such a stage
+    is reached once it is reached by all the `shards`. The `shard` is ignored for the other stages.
+
+    This class is only used as a class and should not be instantiated
+
+    Classmethods
+    ------------
+    set(stage: `str`, shard: `Optional[int]`):
+        Mark a stage as reached
+    clear(stage: `str`, shard: `Optional[int]`):
+        Mark a stage as not reached anymore
+    is_set(stage: `str`, shard: `Optional[int]`): `bool`
+        Check if a stage is reached
+    reached(stage: `str`, shard: `Optional[int]`): `Optional[float]`
+        Get the time a stage was first reached, since the start of the process
+    wait(stage: `str`, timeout: `Optional[float]`, shard: `Optional[int]`): `coro`
+        Wait until a stage is reached
+    timeline(): `str`
+        Get the startup timeline report
+    """
+
+    shards: List[int] = []  # The shard ids of the bot, set once connected to the gateway
+
+    _start: float = time.monotonic()
+    _events: Dict[str, asyncio.Event] = {}
+    _reached: Dict[str, float] = {}
+    _shard_reached: Dict[str, Dict[int, float]] = {}
+    _waiting: Dict[str, int] = {}
+    _waited: Dict[str, int] = {}
+    _timeouts: Dict[str, int] = {}
+
+    def __init__(self) -> None:
+        raise ReadinessInstantiationError
+
+    @staticmethod
+    def _labels(stage: str, shard: Optional[int]) -> Dict[str, str]:
+        if shard is None or stage not in Stage.per_shard:
+            return {"stage": stage}
+        return {"stage": stage, "shard": str(shard)}
+
+    @staticmethod
+    def _key(stage: str, shard: Optional[int]) -> str:
+        if shard is None or stage not in Stage.per_shard:
+            return stage
+        return f"{stage}[{shard}]"
+
+    @classmethod
+    def _event(cls, stage: str, shard: Optional[int] = None) -> asyncio.Event:
+        key = cls._key(stage, shard)
+        event = cls._events.get(key)
+        if event is None:
+            event = cls._events[key] = asyncio.Event()
+            Metrics.gauge_callback("readiness_waiters", lambda: cls._waiting.get(key, 0), **cls._labels(stage, shard))
+        return event
+
+    @classmethod
+    def set(cls, stage: str, shard: Optional[int] = None) -> None:
+        """Mark a stage as reached and wake up all its waiters.
+
+        Parameters
+        ----------
+        stage : `str`
+            The stage
+        shard : `Optional[int]`
+            The shard reaching the stage, by default None
+        """
+        key = cls._key(stage, shard)
+        if key not in cls._reached:
+            cls._reached[key] = time.monotonic() - cls._start
+            Metrics.gauge("readiness_stage_seconds", cls._reached[key], **cls._labels(stage, shard))
+            if key != stage:
+                cls._shard_reached.setdefault(stage, {})[shard] = cls._reached[key]
+        cls._event(stage, shard).set()
+        if key != stage and cls.shards and all(cls.is_set(stage, shard_id) for shard_id in cls.shards):
+            cls.set(stage)
+
+    @classmethod
+    def clear(cls, stage: str, shard: Optional[int] = None) -> None:
+        """Mark a stage as not reached anymore. The time it was first reached is kept in the timeline.
+
+        Parameters
+        ----------
+        stage : `str`
+            The stage
+        shard : `Optional[int]`
+            The shard not reaching the stage anymore, by default None. The stage is then not reached anymore either
+        """
+        cls._event(stage, shard).clear()
+        if cls._key(stage, shard) != stage:
+            cls._event(stage).clear()
+
+    @classmethod
+    def is_set(cls, stage: str, shard: Optional[int] = None) -> bool:
+        return cls._event(stage, shard).is_set()
+
+    @classmethod
+    def reached(cls, stage: str, shard: Optional[int] = None) -> Optional[float]:
+        return cls._reached.get(cls._key(stage, shard))
+
+    @classmethod
+    async def wait(cls, stage: str, timeout: float = None, shard: Optional[int] = None) -> bool:
+        """Wait until a stage is reached.
+
+        Parameters
+        ----------
+        stage : `str`
+            The stage
+        timeout : `Optional[float]`
+            The maximum time to wait, in seconds. `None` to wait forever
+        shard : `Optional[int]`
+            Only wait for this shard to reach the stage, by default None
+
+        Returns
+        -------
+        `bool`
+            True if the stage is reached, False if timeout
+        """
+        event = cls._event(stage, shard)
+        if event.is_set():
+            return True
+        key = cls._key(stage, shard)
+        labels = cls._labels(stage, shard)
+        cls._waiting[key] = cls._waiting.get(key, 0) + 1
+        cls._waited[key] = cls._waited.get(key, 0) + 1
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            cls._timeouts[key] = cls._timeouts.get(key, 0) + 1
+            Metrics.incr("readiness_wait_timeouts", **labels)
+            return False
+        finally:
+            cls._waiting[key] -= 1
+            Metrics.observe("readiness_wait_seconds", time.perf_counter() - start, **labels)
+
+    @classmethod
+    def timeline(cls) -> str:
+        """Get the startup timeline report.
+
+        Returns
+        -------
+        `str`
+            One line per stage, with the time it was reached since the start of the process and its waiters. With
+            several shards, the stages reached per shard have a second line with their first and last shard
+        """
+        lines: List[str] = []
+        stages = Stage.all + [stage for stage in cls._events if stage not in Stage.all and "[" not in stage]
+        for stage in stages:
+            reached = cls._reached.get(stage)
+            waited = cls._waited.get(stage, 0) + sum(cls._waited.get(cls._key(stage, s), 0) for s in cls.shards)
+            timeouts = cls._timeouts.get(stage, 0) + sum(cls._timeouts.get(cls._key(stage, s), 0) for s in cls.shards)
+            lines.append(
+                f"{stage:<20} "
+                + (f"+{reached:8.3f}s" if reached is not None else "  pending")
+                + f"  waiters={waited} timeouts={timeouts}"
+            )
+            shards = cls._shard_reached.get(stage, {})
+            if len(cls.shards) > 1 and shards:
+                first = min(shards, key=shards.get)
+                last = max(shards, key=shards.get)
+                lines.append(
+                    f"  {len(shards)}/{len(cls.shards)} shards, first {first} +{shards[first]:.3f}s, "
+                    + f"last {last} +{shards[last]:.3f}s"
+                )
+        return "\n".join(lines)
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import contextlib
+import contextvars
+import os
+import time
+from typing import AsyncIterator
+from typing import Dict
+from typing import Iterator
+from typing import List
+
+from .metrics import Metrics
+
+
+class Priority:
+    """The priority classes of the `Scheduler`, from the most to the least urgent.
+
+    - `interactive`: work a user is waiting for (commands, registration)
+    - `background`: work triggered by an event (member joined, welcome message, sheet writes)
+    - `bulk`: work on many members or rows (sweeps, guild updates, imports, yearly update, consistency check)
+    """
+
+    interactive = "interactive"
+    background = "background"
+    bulk = "bulk"
+    ranks = {interactive: 0, background: 1, bulk: 2}
+
+
+_priority: contextvars.ContextVar = contextvars.ContextVar("priority", default=Priority.background)
+
+
+class _Waiter:
+    __slots__ = ("priority", "future", "enqueued")
+
+    def __init__(self, priority: str, future: asyncio.Future) -> None:
+        self.priority: str = priority
+        self.future: asyncio.Future = future
+        self.enqueued: float = time.monotonic()
+
+
+class Scheduler:
+    """Represent a scheduler sharing the rate limits of a backend between the priority classes.
+
+    At most `capacity` calls run at the same time, and at most `caps[priority]` of each class. The background and bulk
+    calls together never take more than `capacity - 1` slots, so an interactive call always finds a free slot (unless
+    the capacity is 1). When a slot is free, it is given to the waiting call of
+    the most urgent class, the wait of a call raising its priority of one class every `SCHEDULER_AGING` seconds (10 by
+    default) so the bulk work is never starved.
+
+    The priority of a call is taken from the context, set with `Scheduler.use()`: the commands are interactive, and the
+    tasks inherit the priority of the code that created them. It is `background` by default.
+
+    The schedulers of the backends are `Scheduler.discord` (`SCHEDULER_DISCORD_SLOTS` slots, 4 by default) and
+    `Scheduler.sheets` (`SCHEDULER_SHEETS_SLOTS` slots, 2 by default).
+
+    Parameters
+    ----------
+    name: `str`
+        The name of the backend, for the metrics
+    env: `str`
+        The environment variable of the maximum number of concurrent calls
+    default: `int`
+        The maximum number of concurrent calls if the variable is not set
+    """
+
+    discord: "Scheduler" = None
+    sheets: "Scheduler" = None
+
+    def __init__(self, name: str, env: str, default: int) -> None:
+        self.name: str = name
+        self._env: str = env
+        self._default: int = default
+        self.capacity: int = None
+        self.caps: Dict[str, int] = {}
+        self.shared: int = None  # The slots the background and bulk calls can take together
+        self.aging: float = 10
+        self._running: Dict[str, int] = {priority: 0 for priority in Priority.ranks}
+        self._waiters: List[_Waiter] = []
+
+    def _setup(self) -> None:
+        """Read the config on first use, once the environment is loaded."""
+        self.capacity = int(os.getenv(self._env) or self._default)
+        self.caps = {
+            Priority.interactive: self.capacity,
+            Priority.background: max(1, self.capacity // 2),
+            Priority.bulk: max(1, self.capacity // 2),
+        }
+        self.shared = max(1, self.capacity - 1)
+        self.aging = float(os.getenv("SCHEDULER_AGING") or 10)
+        for priority in Priority.ranks:
+            Metrics.gauge_callback(
+                "scheduler_running",
+                lambda priority=priority: self._running[priority],
+                scheduler=self.name,
+                priority=priority,
+            )
+            Metrics.gauge_callback(
+                "scheduler_queued",
+                lambda priority=priority: sum(1 for waiter in self._waiters if waiter.priority == priority),
+                scheduler=self.name,
+                priority=priority,
+            )
+
+    @staticmethod
+    def current() -> str:
+        """Get the priority of the current context."""
+        return _priority.get()
+
+    @staticmethod
+    @contextlib.contextmanager
+    def use(priority: str) -> Iterator[None]:
+        """Set the priority of the calls made in the block, and of the tasks created in it.
+
+        Parameters
+        ----------
+        priority : `str`
+            The `Priority` class
+        """
+        token = _priority.set(priority)
+        try:
+            yield
+        finally:
+            _priority.reset(token)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority: str = None) -> AsyncIterator[None]:
+        """Wait for a slot to call the backend, kept until the end of the block.
+
+        Parameters
+        ----------
+        priority : `Optional[str]`
+            The `Priority` class, by default the one of the context
+        """
+        priority = priority or _priority.get()
+        await self._acquire(priority)
+        try:
+            yield
+        finally:
+            self._release(priority)
+
+    async def _acquire(self, priority: str) -> None:
+        if self.capacity is None:
+            self._setup()
+        waiter = _Waiter(priority, asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            else:  # The slot was given before the cancellation
+                self._release(priority)
+            raise
+        Metrics.observe(
+            "scheduler_wait_seconds", time.monotonic() - waiter.enqueued, scheduler=self.name, priority=priority
+        )
+
+    def _release(self, priority: str) -> None:
+        self._running[priority] -= 1
+        self._dispatch()
+
+    def _eligible(self, priority: str) -> bool:
+        if self._running[priority] >= self.caps[priority]:
+            return False
+        if priority == Priority.interactive:
+            return True
+        return self._running[Priority.background] + self._running[Priority.bulk] < self.shared
+
+    def _dispatch(self) -> None:
+        """Give the free slots to the waiting calls, by class aged by their wait, then by arrival."""
+        now = time.monotonic()
+        while self._waiters and sum(self._running.values()) < self.capacity:
+            eligible = [waiter for waiter in self._waiters if self._eligible(waiter.priority)]
+            if not eligible:
+                return
+            waiter = min(
+                eligible,
+                key=lambda waiter: (
+                    Priority.ranks[waiter.priority] - (now - waiter.enqueued) / self.aging,
+                    waiter.enqueued,
+                ),
+            )
+            self._waiters.remove(waiter)
+            self._running[waiter.priority] += 1
+            waiter.future.set_result(None)
+
+
+Scheduler.discord = Scheduler("discord", "SCHEDULER_DISCORD_SLOTS", 4)
+Scheduler.sheets = Scheduler("sheets", "SCHEDULER_SHEETS_SLOTS", 2)
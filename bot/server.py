@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+import logging
+import math
+import os
+from typing import List
+from typing import Tuple
+
+from aiohttp import web
+
+from .metrics import Metrics
+from .readiness import Readiness
+from .readiness import Stage
+from .tasks import TaskRegistry
+
+
+class StatusServerInstantiationError(Exception):
+    """The Exception to be raise when the StatusServer class is instantiated."""
+
+    def __init__(self, *args: object) -> None:
+        super().__init__("The StatusServer class cannot be instantiated, but only used as a class.")
+
+
+class StatusServer:
+    """Represent the optional local HTTP server exposing the metrics and the health of the bot.
+
+    It runs on the event loop of the bot, so a blocked loop also makes the probes time out. It is only started if
+    `HTTP_PORT` is set, and listens on `HTTP_HOST` (127.0.0.1 by default).
+
+    Routes
+    ------
+    /metrics:
+        All the metrics in the OpenMetrics text format
+    /healthz:
+        200 while the bot is running and each shard is connected to the gateway once it has been ready, 503 otherwise
+    /readyz:
+        200 once the data is loaded and the registration is ready, 503 with the startup timeline otherwise, or while
+        shutting down
+
+    This class is only used as a class and should not be instantiated
+
+    Classmethods
+    ------------
+    start(bot: `Bot`): `coro`
+        Start the server if `HTTP_PORT` is set
+    stop(): `coro`
+        Stop the server
+    """
+
+    ready_stages = [Stage.storage, Stage.registration]
+
+    _bot = None
+    _runner: web.AppRunner = None
+
+    def __init__(self) -> None:
+        raise StatusServerInstantiationError
+
+    @classmethod
+    async def start(cls, bot) -> None:
+        port = os.getenv("HTTP_PORT")
+        if not port or cls._runner is not None:
+            return
+        cls._bot = bot
+        app = web.Application()
+        app.add_routes(
+            [web.get("/metrics", cls._metrics), web.get("/healthz", cls._healthz), web.get("/readyz", cls._readyz)]
+        )
+        cls._runner = web.AppRunner(app, access_log=None)
+        await cls._runner.setup()
+        host = os.getenv("HTTP_HOST") or "127.0.0.1"
+        await web.TCPSite(cls._runner, host, int(port)).start()
+        logging.info(f"[StatusServer] Listening on http://{host}:{port}")
+
+    @classmethod
+    async def stop(cls) -> None:
+        if cls._runner is not None:
+            await cls._runner.cleanup()
+            cls._runner = None
+
+    @classmethod
+    def _latencies(cls) -> List[Tuple[int, float]]:
+        return cls._bot.latencies if cls._bot.sharded else [(0, cls._bot.latency)]
+
+    @classmethod
+    async def _metrics(cls, request: web.Request) -> web.Response:
+        for shard_id, latency in cls._latencies():
+            Metrics.gauge("discord_gateway_latency_seconds", latency if math.isfinite(latency) else -1, shard=shard_id)
+        return web.Response(
+            body=Metrics.render().encode(),
+            headers={"Content-Type": "application/openmetrics-text; version=1.0.0; charset=utf-8"},
+        )
+
+    @classmethod
+    async def _healthz(cls, request: web.Request) -> web.Response:
+        if cls._bot.is_closed():
+            return web.Response(status=503, text="closed\n")
+        for shard_id, latency in cls._latencies():
+            if Readiness.reached(Stage.gateway, shard=shard_id) is not None and not math.isfinite(latency):
+                return web.Response(status=503, text=f"gateway disconnected (shard {shard_id})\n")
+        return web.Response(text="ok\n")
+
+    @classmethod
+    async def _readyz(cls, request: web.Request) -> web.Response:
+        if TaskRegistry.closing:
+            return web.Response(status=503, text="shutting down\n")
+        if all(Readiness.is_set(stage) for stage in cls.ready_stages):
+            return web.Response(text="ready\n")
+        return web.Response(status=503, text=Readiness.timeline() + "\n")
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import heapq
+import itertools
+import logging
+import sys
+import time
+from collections import OrderedDict
+from typing import Any
+from typing import Callable
+from typing import Hashable
+from typing import Iterator
+from typing import List
+from typing import Tuple
+
+from .metrics import Metrics
+
+
+class SessionTableFullError(Exception):
+    """The Exception to be raise when a session table is full of entries that can not be evicted."""
+
+    def __init__(self, table: "SessionTable") -> None:
+        super().__init__(f"The {table.name} table is full ({table.max_size} entries that can not be evicted).")
+
+
+class _Session:
+    __slots__ = ("value", "expires", "size")
+
+    def __init__(self, value: Any, expires: float, size: int) -> None:
+        self.value: Any = value
+        self.expires: float = expires
+        self.size: int = size
+
+
+class SessionTable:
+    """Represent a table of sessions bounded in size and in time.
+
+    Each entry expires `ttl` seconds after it was set or last touched with `touch()`, and an expired entry is never
+    returned. When the table is full, the least recently used entry is evicted to make room for a new one. The entries
+    are kept in their order of use (for the LRU eviction) and in a heap of their expiry (for the expiry), so that both
+    evictions never scan the whole table. Only the entries for which `evictable(value)` is True are evicted to make room,
+    if there is none a new entry is refused with `SessionTableFullError`.
+
+    While the table is not empty, a sweeper task evicts the expired entries every `sweep_interval` seconds, so the
+    abandoned sessions are reclaimed even if the table is never used again. The evicted entries are given to
+    `on_evict(key, value, reason)` (with `reason` being `expired` or `capacity`), to release what they hold.
+
+    The gauges `sessions_live` and `sessions_bytes` (the estimated size of the entries, from `sizeof`) and the counter
+    `sessions_evicted` are exported with the name of the table.
+
+    Parameters
+    ----------
+    name: `str`
+        The name of the table, for the logs and the metrics
+    max_size: `int`
+        The maximum number of entries
+    ttl: `float`
+        The time (in sec) an entry is kept without being touched
+    on_evict: `Optional[Callable[[Hashable, Any, str], None]]`
+        Called with each entry evicted, by default nothing
+    sizeof: `Callable[[Any], int]`
+        Estimate the size (in bytes) of a value, by default `sys.getsizeof`
+    sweep_interval: `float`
+        The time (in sec) between two sweeps of the expired entries, by default 60
+    evictable: `Callable[[Any], bool]`
+        Check if a value can be evicted to make room for a new entry, by default all the values
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_size: int,
+        ttl: float,
+        on_evict: Callable[[Hashable, Any, str], None] = None,
+        sizeof: Callable[[Any], int] = sys.getsizeof,
+        sweep_interval: float = 60,
+        evictable: Callable[[Any], bool] = None,
+    ) -> None:
+        self.name: str = name
+        self.max_size: int = max_size
+        self.ttl: float = ttl
+        self.on_evict: Callable[[Hashable, Any, str], None] = on_evict
+        self.sizeof: Callable[[Any], int] = sizeof
+        self.sweep_interval: float = sweep_interval
+        self.evictable: Callable[[Any], bool] = evictable
+        self.bytes: int = 0
+        self._entries: "OrderedDict[Hashable, _Session]" = OrderedDict()
+        self._expiries: List[Tuple[float, int, Hashable]] = []
+        self._counter = itertools.count()
+        self._sweeper: asyncio.Task = None
+        Metrics.gauge_callback("sessions_live", lambda: len(self._entries), table=name)
+        Metrics.gauge_callback("sessions_bytes", lambda: self.bytes, table=name)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self._live(key) is not None
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(list(self._entries))
+
+    def keys(self) -> List[Hashable]:
+        return list(self._entries)
+
+    def values(self) -> List[Any]:
+        return [entry.value for entry in self._entries.values()]
+
+    def items(self) -> List[Tuple[Hashable, Any]]:
+        return [(key, entry.value) for key, entry in self._entries.items()]
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        self.set(key, value)
+
+    def _live(self, key: Hashable) -> _Session:
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires <= time.monotonic():
+            self._evict(key, "expired")
+            return None
+        return entry
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get the value of an entry not expired, and mark it as recently used.
+
+        Parameters
+        ----------
+        key : `Hashable`
+            The key of the entry
+        default : `Any`
+            The value returned if there is no such entry, by default None
+        """
+        entry = self._live(key)
+        if entry is None:
+            return default
+        self._entries.move_to_end(key)
+        return entry.value
+
+    def set(self, key: Hashable, value: Any, ttl: float = None) -> None:
+        """Add or replace an entry, evicting the least recently used evictable one if the table is full.
+
+        Parameters
+        ----------
+        key : `Hashable`
+            The key of the entry
+        value : `Any`
+            The value of the entry
+        ttl : `Optional[float]`
+            The time (in sec) before the entry expires, by default the `ttl` of the table
+
+        Raises
+        ------
+        `SessionTableFullError`
+            Raise if the table is full and none of its entries can be evicted.
+        """
+        if key not in self._entries and len(self._entries) >= self.max_size:
+            self.sweep()
+            if len(self._entries) >= self.max_size:
+                victim = next(
+                    (k for k, e in self._entries.items() if self.evictable is None or self.evictable(e.value)), None
+                )
+                if victim is None:
+                    raise SessionTableFullError(self)
+                self._evict(victim, "capacity")
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.bytes -= old.size
+        entry = _Session(value, time.monotonic() + (self.ttl if ttl is None else ttl), self.sizeof(value))
+        self._entries[key] = entry
+        self.bytes += entry.size
+        self._index(key, entry)
+
+    def touch(self, key: Hashable) -> None:
+        """Postpone the expiry of an entry by the `ttl` of the table, mark it as recently used and update its size.
+
+        Parameters
+        ----------
+        key : `Hashable`
+            The key of the entry
+        """
+        entry = self._live(key)
+        if entry is None:
+            return
+        self._entries.move_to_end(key)
+        entry.expires = time.monotonic() + self.ttl
+        size = self.sizeof(entry.value)
+        self.bytes += size - entry.size
+        entry.size = size
+        self._index(key, entry)
+
+    def remaining(self, key: Hashable) -> float:
+        """Get the time (in sec) before an entry expires, or None if there is no such entry."""
+        entry = self._live(key)
+        return None if entry is None else entry.expires - time.monotonic()
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove an entry without evicting it, and get its value.
+
+        Parameters
+        ----------
+        key : `Hashable`
+            The key of the entry
+        default : `Any`
+            The value returned if there is no such entry, by default None
+        """
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return default
+        self.bytes -= entry.size
+        return entry.value
+
+    def sweep(self) -> int:
+        """Evict the expired entries.
+
+        Returns
+        -------
+        `int`
+            The number of entries evicted
+        """
+        now = time.monotonic()
+        evicted = 0
+        while self._expiries and self._expiries[0][0] <= now:
+            expires, _, key = heapq.heappop(self._expiries)
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires == expires:
+                self._evict(key, "expired")
+                evicted += 1
+        if len(self._expiries) > 2 * len(self._entries) + 64:  # Drop the index entries of the touched and removed keys
+            self._expiries = [(entry.expires, next(self._counter), key) for key, entry in self._entries.items()]
+            heapq.heapify(self._expiries)
+        return evicted
+
+    def _index(self, key: Hashable, entry: _Session) -> None:
+        heapq.heappush(self._expiries, (entry.expires, next(self._counter), key))
+        if self._sweeper is None or self._sweeper.done():
+            try:
+                self._sweeper = asyncio.get_running_loop().create_task(self._sweep_loop())
+            except RuntimeError:  # No running loop, the entries expire on access
+                pass
+
+    def _evict(self, key: Hashable, reason: str) -> None:
+        entry = self._entries.pop(key)
+        self.bytes -= entry.size
+        Metrics.incr("sessions_evicted", table=self.name, reason=reason)
+        if self.on_evict is not None:
+            try:
+                self.on_evict(key, entry.value, reason)
+            except Exception as ex:
+                logging.error(f"[SessionTable] Eviction of {key} from {self.name} failed: {type(ex).__name__}: {ex}")
+
+    async def _sweep_loop(self) -> None:
+        while self._entries:
+            await asyncio.sleep(self.sweep_interval)
+            self.sweep()
+        self._expiries.clear()
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import time
+from typing import Callable
+from typing import Coroutine
+from typing import Dict
+from typing import List
+from typing import Set
+
+from .metrics import Metrics
+
+
+class ShutdownReport:
+    """What was drained, abandoned and checkpointed by `TaskRegistry.shutdown()`."""
+
+    __slots__ = ("drained", "abandoned", "checkpoints", "duration")
+
+    def __init__(self) -> None:
+        self.drained: Dict[str, int] = {}
+        self.abandoned: Dict[str, int] = {}
+        self.checkpoints: List[str] = []
+        self.duration: float = 0.0
+
+    def __str__(self) -> str:
+        kinds = sorted(set(self.drained) | set(self.abandoned))
+        lines = [
+            f"{kind}: {self.drained.get(kind, 0)} drained, {self.abandoned.get(kind, 0)} abandoned" for kind in kinds
+        ] or ["no pending task"]
+        return "\n".join(lines + self.checkpoints)
+
+
+class TaskRegistryInstantiationError(Exception):
+    """The Exception to be raise when the TaskRegistry class is instantiated."""
+
+    def __init__(self, *args: object) -> None:
+        super().__init__("The TaskRegistry class cannot be instantiated, but only used as a class.")
+
+
+class TaskRegistry:
+    """Represent the registry of the background tasks, drained on shutdown.
+
+    The tasks are grouped by kind (`database`, `email`, `member`...). On shutdown, the registered checkpoints stop the
+    long jobs and describe where they stopped, then the pending tasks are awaited until the deadline, and the ones still
+    running are cancelled. A task spawned while draining (a write at the end of an email sending for example) is
+    drained too.
+
+    This class is only used as a class and should not be instantiated
+
+    Classmethods
+    ------------
+    spawn(coro: `Coroutine`, kind: `str`): `asyncio.Task`
+        Run a coroutine in background, tracked until it is done
+    pending(kind: `str`): `int`
+        Get the number of tasks of a kind not done yet
+    checkpoint(callback: `Callable[[], str]`):
+        Add a callback stopping a long job on shutdown
+    shutdown(timeout: `float`): `coro`
+        Drain the pending tasks and stop the long jobs
+    """
+
+    closing: bool = False
+    _tasks: Dict[str, Set[asyncio.Task]] = {}
+    _checkpoints: List[Callable[[], str]] = []
+
+    def __init__(self) -> None:
+        raise TaskRegistryInstantiationError
+
+    @classmethod
+    def spawn(cls, coro: Coroutine, kind: str) -> asyncio.Task:
+        """Run a coroutine in background, keeping a reference to its task until it is done.
+
+        Parameters
+        ----------
+        coro : `Coroutine`
+            The coroutine to run
+        kind : `str`
+            The kind of task, for the metrics and the shutdown report
+
+        Returns
+        -------
+        `asyncio.Task`
+            The task
+        """
+        if kind not in cls._tasks:
+            cls._tasks[kind] = set()
+            Metrics.gauge_callback("tasks_pending", lambda: len(cls._tasks[kind]), kind=kind)
+        task = asyncio.create_task(coro)
+        cls._tasks[kind].add(task)
+        task.add_done_callback(cls._tasks[kind].discard)
+        Metrics.incr("tasks_spawned", kind=kind)
+        return task
+
+    @classmethod
+    def pending(cls, kind: str) -> int:
+        return len(cls._tasks.get(kind, ()))
+
+    @classmethod
+    def checkpoint(cls, callback: Callable[[], str]) -> None:
+        """Add a callback called on shutdown, before draining. It should stop a long job and return where it stopped,
+        for the shutdown report.
+
+        Parameters
+        ----------
+        callback : `Callable[[], str]`
+            The callback
+        """
+        if callback not in cls._checkpoints:
+            cls._checkpoints.append(callback)
+
+    @classmethod
+    def _all_pending(cls) -> Dict[asyncio.Task, str]:
+        return {task: kind for kind, tasks in cls._tasks.items() for task in tasks}
+
+    @classmethod
+    async def shutdown(cls, timeout: float) -> ShutdownReport:
+        """Stop the long jobs, then wait for the pending tasks until the deadline and cancel the others.
+
+        Parameters
+        ----------
+        timeout : `float`
+            The time (in sec) given to the pending tasks to finish
+
+        Returns
+        -------
+        `ShutdownReport`
+            What was drained, abandoned and checkpointed
+        """
+        cls.closing = True
+        report = ShutdownReport()
+        start = time.perf_counter()
+        for callback in cls._checkpoints:
+            try:
+                report.checkpoints.append(callback())
+            except Exception as ex:
+                logging.error(f"[TaskRegistry] Checkpoint {callback.__qualname__} failed: {ex}")
+
+        deadline = time.monotonic() + timeout
+        pending = cls._all_pending()
+        while pending and time.monotonic() < deadline:
+            done, _ = await asyncio.wait(
+                pending.keys(), timeout=deadline - time.monotonic(), return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                report.drained[pending[task]] = report.drained.get(pending[task], 0) + 1
+            pending = cls._all_pending()
+
+        for task, kind in pending.items():
+            task.cancel()
+            report.abandoned[kind] = report.abandoned.get(kind, 0) + 1
+        if pending:
+            await asyncio.wait(pending.keys(), timeout=1)
+        report.duration = time.perf_counter() - start
+        for kind, count in report.drained.items():
+            Metrics.incr("shutdown_tasks", count, kind=kind, outcome="drained")
+        for kind, count in report.abandoned.items():
+            Metrics.incr("shutdown_tasks", count, kind=kind, outcome="abandoned")
+        return report
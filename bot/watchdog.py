@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Deque
+from typing import Tuple
+
+from .metrics import Metrics
+
+
+class LoopWatchdogInstantiationError(Exception):
+    """The Exception to be raise when the LoopWatchdog class is instantiated."""
+
+    def __init__(self, *args: object) -> None:
+        super().__init__("The LoopWatchdog class cannot be instantiated, but only used as a class.")
+
+
+class LoopWatchdog:
+    """Represent the event loop lag monitor.
+
+    A coroutine sleeps for `interval` in a loop and records how late it wakes up in the `event_loop_lag_seconds`
+    histogram. A thread checks that this coroutine keeps beating: if the loop is blocked for more than `threshold`, it
+    captures the stack of the event loop thread while it is still blocked, attributes the stall to the innermost frame
+    of the bot code and counts it in `event_loop_stalls{site}`.
+
+    The threshold is read from `LOOP_STALL_THRESHOLD` (in seconds, 0.5 by default, 0 to disable the monitor).
+
+    This class is only used as a class and should not be instantiated
+
+    Classmethods
+    ------------
+    start():
+        Start the monitor on the running loop
+    stalls(): `str`
+        Get the captured stacks of the last stalls
+    """
+
+    interval: float = 0.1
+    max_stalls: int = 20
+
+    _root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    _task: asyncio.Task = None
+    _thread: threading.Thread = None
+    _loop_thread_id: int = None
+    _beat: float = 0.0
+    _threshold: float = 0.5
+    _stalls: Deque[Tuple[float, str, str]] = collections.deque(maxlen=max_stalls)
+
+    def __init__(self) -> None:
+        raise LoopWatchdogInstantiationError
+
+    @classmethod
+    def start(cls) -> None:
+        """Start the monitor on the running loop. Does nothing if already started or disabled."""
+        if cls._task is not None and not cls._task.done():
+            return
+        cls._threshold = float(os.getenv("LOOP_STALL_THRESHOLD") or 0.5)
+        if cls._threshold <= 0:
+            return
+        cls._loop_thread_id = threading.get_ident()
+        cls._beat = time.monotonic()
+        cls._task = asyncio.create_task(cls._monitor())
+        if cls._thread is None:
+            cls._thread = threading.Thread(target=cls._watch, name="LoopWatchdog", daemon=True)
+            cls._thread.start()
+        logging.info(f"[LoopWatchdog] Started with a stall threshold of {cls._threshold}s")
+
+    @classmethod
+    async def _monitor(cls) -> None:
+        while True:
+            start = time.perf_counter()
+            cls._beat = time.monotonic()
+            await asyncio.sleep(cls.interval)
+            Metrics.observe("event_loop_lag_seconds", max(0.0, time.perf_counter() - start - cls.interval))
+
+    @classmethod
+    def _site(cls, stack: traceback.StackSummary) -> str:
+        for frame in reversed(stack):
+            filename = os.path.abspath(frame.filename)
+            if filename.startswith(cls._root) and "site-packages" not in filename:
+                return f"{os.path.relpath(filename, cls._root)}:{frame.lineno} {frame.name}"
+        return f"{os.path.basename(stack[-1].filename)}:{stack[-1].lineno} {stack[-1].name}" if stack else "<unknown>"
+
+    @classmethod
+    def _watch(cls) -> None:
+        stalled_beat = None
+        while True:
+            time.sleep(cls._threshold / 4)
+            beat = cls._beat
+            if time.monotonic() - beat < cls.interval + cls._threshold or beat == stalled_beat:
+                continue
+            stalled_beat = beat  # Only capture once per stall
+            frame = sys._current_frames().get(cls._loop_thread_id)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame)
+            site = cls._site(stack)
+            Metrics.incr("event_loop_stalls", site=site)
+            cls._stalls.append((time.time(), site, "".join(stack.format())))
+            logging.warning(
+                f"[LoopWatchdog] Event loop blocked for more than {cls._threshold}s at {site}\n{''.join(stack.format())}"
+            )
+
+    @classmethod
+    def stalls(cls) -> str:
+        """Get the captured stacks of the last stalls, most recent first.
+
+        Returns
+        -------
+        `str`
+            The stalls, empty if there was no stall
+        """
+        return "\n".join(
+            f"== {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(at))} {site} ==\n{stack}"
+            for at, site, stack in reversed(cls._stalls)
+        )
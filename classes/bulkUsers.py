@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+import csv
+import gzip
+import json
+from typing import BinaryIO
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import disnake
+
+from .database import Database
+
+
+class ImportReport:
+    """Represent the result of a bulk import
+
+    Parameters
+    ----------
+    users: `List[Tuple[disnake.User, str, str]]`
+        The valid (user, name, email) rows
+    errors: `List[Tuple[int, str]]`
+        The (line number, reason) of the rejected rows
+    """
+
+    def __init__(self) -> None:
+        self.users: List[Tuple[disnake.User, str, str]] = []
+        self.errors: List[Tuple[int, str]] = []
+        self.new: int = 0
+        self.updated: int = 0
+
+
+def read_users_csv(
+    lines: Iterable[str], get_user: Callable[[int], Optional[disnake.User]], email_default_value: str = "N/A"
+) -> ImportReport:
+    """Validate the rows of a `user_id,name,email` CSV in a single streaming pass. The email column is optional.
+
+    A row is rejected if its user id is not a known discord user, if its name is empty, if its email is not valid or
+    already used by another user, or if the user or the email appears twice in the file.
+
+    Parameters
+    ----------
+    lines : `Iterable[str]`
+        The lines of the CSV, with a header
+    get_user : `Callable[[int], Optional[disnake.User]]`
+        The function used to get a discord user from its id
+    email_default_value : `str`
+        The email used for the rows without email, by default "N/A"
+
+    Returns
+    -------
+    `ImportReport`
+        The valid rows and the errors
+    """
+    report = ImportReport()
+    emails: Dict[str, disnake.User] = {
+        user_data.email: user
+        for user, user_data in Database.ulb_users.items()
+        if user_data.email != email_default_value
+    }
+    seen_users = set()
+    reader: Iterator[Dict[str, str]] = csv.DictReader(lines)
+    if not reader.fieldnames or not {"user_id", "name"}.issubset(reader.fieldnames):
+        report.errors.append((1, "L'entête doit contenir les colonnes user_id et name (et email, optionnelle)."))
+        return report
+    for row in reader:
+        line = reader.line_num
+        user_id = (row.get("user_id") or "").strip()
+        name = (row.get("name") or "").strip()
+        email = (row.get("email") or "").strip() or email_default_value
+        if not user_id.isdigit():
+            report.errors.append((line, f"user_id invalide : `{user_id}`"))
+            continue
+        user = get_user(int(user_id))
+        if user is None:
+            report.errors.append((line, f"Pas d'utilisateur.rice discord avec l'ID `{user_id}`"))
+            continue
+        if user in seen_users:
+            report.errors.append((line, f"L'utilisateur.rice `{user_id}` apparaît plusieurs fois"))
+            continue
+        if not name:
+            report.errors.append((line, "Nom manquant"))
+            continue
+        if email != email_default_value:
+            if email.count("@") != 1:
+                report.errors.append((line, f"Adresse email invalide : `{email}`"))
+                continue
+            if emails.get(email, user) != user:
+                report.errors.append((line, f"L'adresse email `{email}` est déjà utilisée"))
+                continue
+            emails[email] = user
+        seen_users.add(user)
+        if user in Database.ulb_users:
+            report.updated += 1
+        else:
+            report.new += 1
+        report.users.append((user, name, email))
+    return report
+
+
+class ExportFormat:
+    csv = "csv"
+    jsonl = "jsonl"
+
+
+export_fields = ["user_id", "name", "email", "username"]
+_chunk_size = 64 * 1024
+
+
+def iter_users(guild: disnake.Guild = None) -> Iterator[Dict[str, str]]:
+    """Iterate over the registered users, as rows with the `export_fields` keys.
+
+    Parameters
+    ----------
+    guild : `Optional[disnake.Guild]`
+        If provided, only the members of this guild are yielded
+
+    Yields
+    ------
+    `Dict[str, str]`
+        The rows
+    """
+    # Copied first, as the rows can be consumed in a thread while the event loop registers users
+    for user, user_data in list(Database.ulb_users.items()):
+        if guild is not None and guild.get_member(user.id) is None:
+            continue
+        yield {"user_id": str(user.id), "name": user_data.name, "email": user_data.email, "username": user.name}
+
+
+class _LineWriter:
+    """File-like object keeping only the last line written by a `csv.writer`."""
+
+    line: str = ""
+
+    def write(self, line: str) -> None:
+        self.line = line
+
+
+def _iter_csv_lines(rows: Iterator[Dict[str, str]]) -> Iterator[str]:
+    buffer = _LineWriter()
+    writer = csv.DictWriter(buffer, fieldnames=export_fields)
+    writer.writeheader()
+    yield buffer.line
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.line
+
+
+def _iter_jsonl_lines(rows: Iterator[Dict[str, str]]) -> Iterator[str]:
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + "\n"
+
+
+def write_users(rows: Iterator[Dict[str, str]], format: str, file: BinaryIO) -> int:
+    """Stream rows into a gzip compressed CSV or JSONL file.
+
+    The rows are consumed one at a time and written through the gzip stream, so the memory used does not depend on
+    the number of users.
+
+    Parameters
+    ----------
+    rows : `Iterator[Dict[str, str]]`
+        The rows to write, as yielded by `iter_users()`
+    format : `ExportFormat`
+        The format of the file
+    file : `BinaryIO`
+        The binary file to write the compressed data to
+
+    Returns
+    -------
+    `int`
+        The number of rows written
+    """
+    count = 0
+
+    def counted(rows: Iterator[Dict[str, str]]) -> Iterator[Dict[str, str]]:
+        nonlocal count
+        for row in rows:
+            count += 1
+            yield row
+
+    lines = _iter_csv_lines(counted(rows)) if format == ExportFormat.csv else _iter_jsonl_lines(counted(rows))
+    with gzip.GzipFile(fileobj=file, mode="wb") as gz:
+        chunk: List[str] = []
+        size = 0
+        for line in lines:
+            chunk.append(line)
+            size += len(line)
+            if size >= _chunk_size:
+                gz.write("".join(chunk).encode())
+                chunk.clear()
+                size = 0
+        gz.write("".join(chunk).encode())
+    return count
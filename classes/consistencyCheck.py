@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+from .database import Database
+from bot import Cluster
+from bot import Metrics
+from bot import Priority
+from bot import Scheduler
+
+Row = Tuple[str, ...]
+
+
+def _cell(value) -> str:
+    """Normalize an unformatted cell, as the values written by the bot are strings, booleans or numbers."""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def _row_hash(row: Row) -> str:
+    return hashlib.blake2b("\x1f".join(row).encode(), digest_size=8).hexdigest()
+
+
+class TableReport:
+    """The divergences between the cache and a worksheet.
+
+    Parameters
+    ----------
+    name: `str`
+        The name of the worksheet
+    """
+
+    __slots__ = ("name", "rows", "missing", "extra", "duplicates", "stale", "requests", "repaired", "deferred")
+
+    def __init__(self, name: str) -> None:
+        self.name: str = name
+        self.rows: int = 0
+        self.missing: List[str] = []  # In the cache, not in the sheet
+        self.extra: List[str] = []  # In the sheet, not in the cache
+        self.duplicates: Dict[str, List[int]] = {}  # Id -> numbers of the rows not kept
+        self.stale: Dict[str, int] = {}  # Id -> number of the row different in the sheet
+        self.requests: List[dict] = []
+        self.repaired: int = 0
+        self.deferred: int = 0
+
+    @property
+    def divergences(self) -> int:
+        return len(self.missing) + len(self.extra) + len(self.duplicates) + len(self.stale)
+
+    def __str__(self) -> str:
+        def ids(values: List[str]) -> str:
+            return ", ".join(values[:10]) + (f" (+{len(values) - 10})" if len(values) > 10 else "")
+
+        lines = [f"{self.name}: {self.rows} rows, {self.divergences} divergences"]
+        for kind, values in (
+            ("missing", self.missing),
+            ("extra", self.extra),
+            ("duplicated", list(self.duplicates)),
+            ("stale", list(self.stale)),
+        ):
+            if values:
+                lines.append(f"  {kind}: {ids(values)}")
+        if self.repaired or self.deferred:
+            lines.append(f"  {self.repaired} rows repaired, {self.deferred} left for the next check")
+        return "\n".join(lines)
+
+
+class ConsistencyReport:
+    """The result of a consistency check."""
+
+    __slots__ = ("tables", "skipped", "duration")
+
+    def __init__(self) -> None:
+        self.tables: List[TableReport] = []
+        self.skipped: Optional[str] = None
+        self.duration: float = 0.0
+
+    @property
+    def divergences(self) -> int:
+        return sum(table.divergences for table in self.tables)
+
+    def __str__(self) -> str:
+        if self.skipped:
+            return f"Check skipped: {self.skipped}"
+        return "\n".join(str(table) for table in self.tables)
+
+
+class ConsistencyCheckInstantiationError(Exception):
+    """The Exception to be raise when the ConsistencyCheck class is instantiated."""
+
+    def __init__(self, *args: object) -> None:
+        super().__init__("The ConsistencyCheck class cannot be instantiated, but only used as a class.")
+
+
+class ConsistencyCheck:
+    """Represent the background check of the cache of the `Database` against the google sheet.
+
+    Every `CONSISTENCY_CHECK_PERIOD` seconds (1 hour by default, 0 to disable), the worksheets are read with a single
+    request and the hash of each row is compared to the hash of the same entry in the cache, to find:
+    - the missing rows: in the cache but not in the sheet (a write that failed)
+    - the extra rows: in the sheet but not in the cache (a row added by hand, or a deletion that failed)
+    - the duplicated ids
+    - the stale rows: with values different from the cache (a row edited by hand, or an update that failed)
+
+    With `CONSISTENCY_REPAIR`, the sheet is made to match the cache with a single batched write: the missing rows are
+    appended, the stale ones are overwritten and the duplicates of the cached entries are deleted. At most
+    `CONSISTENCY_CHECK_BUDGET` rows (50 by default) are changed by a check, the others are left for the next one. The
+    extra rows are only reported, as a row added by hand cannot be told from a deletion that failed: `/update` loads
+    them in the cache.
+
+    The check is skipped while writes are queued, as the sheet is then expected to lag behind the cache, and the repair
+    is not sent if a write was queued since the read, as it may have moved the rows. In clustered mode, only the leader
+    checks the sheet.
+
+    This class is only used as a class and should not be instantiated
+
+    Classmethods
+    ------------
+    start(): `asyncio.Task`
+        Start the periodic check in background
+    run(repair: `bool`): `coro`
+        Check the sheet now
+    """
+
+    _task: asyncio.Task = None
+    last: ConsistencyReport = None
+
+    def __init__(self) -> None:
+        raise ConsistencyCheckInstantiationError
+
+    @staticmethod
+    def period() -> float:
+        return float(os.getenv("CONSISTENCY_CHECK_PERIOD") or 3600)
+
+    @staticmethod
+    def budget() -> int:
+        return int(os.getenv("CONSISTENCY_CHECK_BUDGET") or 50)
+
+    @staticmethod
+    def repair_enabled() -> bool:
+        return os.getenv("CONSISTENCY_REPAIR", "").lower() in ("1", "true", "yes")
+
+    @classmethod
+    def start(cls) -> Optional[asyncio.Task]:
+        if cls.period() <= 0 or (cls._task is not None and not cls._task.done()):
+            return cls._task
+        cls._task = asyncio.create_task(cls._loop())
+        return cls._task
+
+    @classmethod
+    async def _loop(cls) -> None:
+        while True:
+            await asyncio.sleep(cls.period())
+            if not Cluster.is_leader():
+                continue
+            try:
+                with Scheduler.use(Priority.bulk):
+                    await cls.run(cls.repair_enabled())
+            except Exception as ex:
+                Metrics.incr("consistency_checks", outcome="error")
+                logging.error(f"[ConsistencyCheck] Check failed: {type(ex).__name__}: {ex}")
+
+    @classmethod
+    def _expected(cls) -> Dict[str, Tuple[Dict[str, Row], Set[str]]]:
+        """Get the rows expected in each worksheet from the cache, and the ids of all the loaded entries, resolved or
+        not."""
+        users = {str(user.id): (str(user.id), data.name, data.email) for user, data in Database.ulb_users.items()}
+        guilds = {
+            str(guild.id): (str(guild.id), str(data.role.id), "TRUE" if data.rename else "FALSE")
+            for guild, data in Database.ulb_guilds.items()
+        }
+        return {
+            "users": (users, {str(user_id) for user_id in Database.user_ids()}),
+            "guilds": (guilds, {str(guild_id) for guild_id in Database.guild_ids()}),
+        }
+
+    @staticmethod
+    def _values(row: Row) -> List[dict]:
+        values = []
+        for value in row:
+            if value in ("TRUE", "FALSE"):
+                values.append({"userEnteredValue": {"boolValue": value == "TRUE"}})
+            else:
+                values.append({"userEnteredValue": {"stringValue": value}})
+        return values
+
+    @classmethod
+    def _compare(cls, report: TableReport, rows: List[list], expected: Dict[str, Row], loaded: Set[str]) -> None:
+        width = len(next(iter(expected.values()), ())) or 3
+        sheet: Dict[str, List[Tuple[int, Row]]] = {}
+        for number, raw in enumerate(rows[1:], start=2):  # The first row is the header
+            row = tuple(_cell(value) for value in raw[:width]) + ("",) * (width - len(raw))
+            if row[0]:
+                sheet.setdefault(row[0], []).append((number, row))
+        report.rows = sum(len(entries) for entries in sheet.values())
+
+        report.missing = [id for id in expected if id not in sheet]
+        report.extra = [id for id in sheet if id not in loaded]
+        for id, entries in sheet.items():
+            if id not in expected:
+                if len(entries) > 1:
+                    report.duplicates[id] = [number for number, _ in entries[1:]]
+                continue
+            expected_hash = _row_hash(expected[id])
+            kept = next((entry for entry in entries if _row_hash(entry[1]) == expected_hash), entries[0])
+            if len(entries) > 1:
+                report.duplicates[id] = [number for number, _ in entries if number != kept[0]]
+            if _row_hash(kept[1]) != expected_hash:
+                report.stale[id] = kept[0]
+
+    @classmethod
+    def _plan(cls, report: TableReport, sheet_id: int, expected: Dict[str, Row], budget: int) -> int:
+        """Add to the report the requests repairing the worksheet, within the budget of rows. Return the budget left."""
+        updates, appends, deletes = [], [], []
+        for id, number in report.stale.items():
+            if budget == 0:
+                break
+            updates.append(
+                {
+                    "updateCells": {
+                        "range": {"sheetId": sheet_id, "startRowIndex": number - 1, "endRowIndex": number},
+                        "rows": [{"values": cls._values(expected[id])}],
+                        "fields": "userEnteredValue",
+                    }
+                }
+            )
+            budget -= 1
+        for id in report.missing:
+            if budget == 0:
+                break
+            appends.append({"values": cls._values(expected[id])})
+            budget -= 1
+        for id in expected:
+            for number in report.duplicates.get(id, ()):
+                if budget == 0:
+                    break
+                deletes.append(number)
+                budget -= 1
+        report.requests = list(updates)
+        if appends:
+            report.requests.append(
+                {"appendCells": {"sheetId": sheet_id, "rows": appends, "fields": "userEnteredValue"}}
+            )
+        for number in sorted(deletes, reverse=True):  # From the bottom, so the numbers of the next rows do not change
+            report.requests.append(
+                {
+                    "deleteDimension": {
+                        "range": {
+                            "sheetId": sheet_id,
+                            "dimension": "ROWS",
+                            "startIndex": number - 1,
+                            "endIndex": number,
+                        }
+                    }
+                }
+            )
+        report.repaired = len(updates) + len(appends) + len(deletes)
+        repairable = (
+            len(report.stale)
+            + len(report.missing)
+            + sum(len(report.duplicates[id]) for id in report.duplicates if id in expected)
+        )
+        report.deferred = repairable - report.repaired
+        return budget
+
+    @classmethod
+    def _skip(cls, report: ConsistencyReport) -> ConsistencyReport:
+        Metrics.incr("consistency_checks", outcome="skipped")
+        logging.info(f"[ConsistencyCheck] {report}")
+        cls.last = report
+        return report
+
+    @classmethod
+    async def run(cls, repair: bool = False) -> ConsistencyReport:
+        """Check the google sheet against the cache now.
+
+        Parameters
+        ----------
+        repair : `bool`
+            Make the sheet match the cache, within the budget, by default False
+
+        Returns
+        -------
+        `ConsistencyReport`
+            The divergences found
+        """
+        report = ConsistencyReport()
+        start = time.perf_counter()
+        writes = Database.writes
+        if Database.writes_pending():
+            report.skipped = f"{Database.writes_pending()} writes queued"
+        else:
+            sheets = await Database.read_sheet()
+            if Database.writes != writes:
+                report.skipped = "the cache changed during the read"
+        if report.skipped:
+            return cls._skip(report)
+
+        budget = cls.budget()
+        sheet_ids = Database.worksheet_ids()
+        for name, (expected, loaded) in cls._expected().items():
+            table = TableReport(name)
+            cls._compare(table, sheets.get(name, []), expected, loaded)
+            if repair:
+                budget = cls._plan(table, sheet_ids[name], expected, budget)
+            report.tables.append(table)
+            Metrics.gauge("consistency_divergences", table.divergences, table=name)
+
+        requests = [request for table in report.tables for request in table.requests]
+        if requests:
+            # Checked again in the slot of the sheet, right before the batch: a write run since the read may have moved
+            # the rows targeted by the requests
+            if not await Database.batch_write(requests, writes=writes):
+                report.skipped = "the cache changed before the repair"
+                return cls._skip(report)
+            Metrics.incr("consistency_repaired", sum(table.repaired for table in report.tables))
+        report.duration = time.perf_counter() - start
+        Metrics.observe("consistency_check_seconds", report.duration)
+        Metrics.incr("consistency_checks", outcome="diverged" if report.divergences else "consistent")
+        log = logging.warning if report.divergences else logging.info
+        log(f"[ConsistencyCheck] Checked in {report.duration:.1f}s:\n{report}")
+        cls.last = report
+        return report
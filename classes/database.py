@@ -1,15 +1,35 @@
 # -*- coding: utf-8 -*-
 import asyncio
+import collections
 import logging
 import os
+import time
+from typing import Any
+from typing import Callable
+from typing import Coroutine
+from typing import Deque
 from typing import Dict
+from typing import List
 from typing import Optional
+from typing import Set
+from typing import Tuple
 
 import disnake
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 
 from bot import Bot
+from bot import CircuitBreaker
+from bot import CircuitOpenError
+from bot import Cluster
+from bot import lazy_import
+from bot import Metrics
+from bot import Priority
+from bot import Readiness
+from bot import Scheduler
+from bot import Stage
+from bot import TaskRegistry
+
+gspread = lazy_import("gspread")
+service_account = lazy_import("oauth2client.service_account")
 
 
 class UlbUser:
@@ -58,9 +78,21 @@ class DatabaseInstantiationError(Exception):
         super().__init__("The DataBase class cannot be instantiated, but only used as a class.")
 
 
+def _is_sheet_outage(ex: Exception) -> bool:
+    """The google sheet is considered down on network errors, rate limits and server errors."""
+    if isinstance(ex, gspread.exceptions.APIError):
+        return ex.response.status_code == 429 or ex.response.status_code >= 500
+    return isinstance(ex, (OSError, asyncio.TimeoutError))
+
+
 class Database:
     """Represent the DataBase.
 
+    The reads are served from the cache loaded by `load()`, and the writes are queued and sent to the google sheet in
+    order, in background. The google sheet is called through a circuit breaker: while it is down, the writes stay queued
+    and a reload keeps the cache, until a probe succeeds. The requests run in a thread and time out after
+    `request_timeout` seconds, so a slow google sheet never blocks the event loop.
+
     This class is only used as a class and should not be instantiated
 
     Properties
@@ -70,21 +102,35 @@ class Database:
 
     Classmethods
     ------------
-    load(bot: Bot):
+    load(bot: Bot): `coro`
         Load the GoogleSheet data. This need to be called before using the other methods
+    resolve(bot: Bot, shard_id: `int`):
+        Resolve the guilds and users of a shard once it is ready
     set_user(user_id: `int`, name: `str`, email: `str`):
         Add or update an user to the database
+    set_users(users: `List[Tuple[disnake.User, str, str]]`):
+        Add or update several users to the database with a single batched write
     set_guild(guild_id: `int`, role_id: `int`):
         Add or update an guild to the database
     """
 
+    # Config params
+    request_timeout = 30  # In sec
+
     _scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    _sheet: gspread.Spreadsheet = None
-    _users_ws: gspread.Worksheet = None
-    _guilds_ws: gspread.Worksheet = None
+    _sheet: "gspread.Spreadsheet" = None
+    _users_ws: "gspread.Worksheet" = None
+    _guilds_ws: "gspread.Worksheet" = None
     ulb_guilds: Dict[disnake.Guild, UlbGuild] = None
     ulb_users: Dict[disnake.User, UlbUser] = None
+    _pending_guilds: Dict[int, dict] = {}
+    _pending_users: Dict[int, dict] = {}
+    _bot: Bot = None
     _loaded = False
+    _breaker = CircuitBreaker("sheets", is_failure=_is_sheet_outage)
+    _outbox: Deque[Tuple[str, tuple]] = collections.deque()
+    _flush_task: asyncio.Task = None
+    writes: int = 0  # Number of writes since startup
 
     def __init__(self) -> None:
         raise DatabaseInstantiationError
@@ -94,78 +140,323 @@ class Database:
         return cls._loaded
 
     @classmethod
-    def load(cls, bot: Bot) -> None:
-        """Load the data from the google sheet.
+    def _open_sheet(cls) -> None:
+        """Load the credentials and open the google sheet. This is blocking and is run in a thread by `load()`."""
+        cred_dict = {}
+        cred_dict["type"] = os.getenv("GS_TYPE")
+        cred_dict["project_id"] = os.getenv("GS_PROJECT_ID")
+        cred_dict["auth_uri"] = os.getenv("GS_AUTHOR_URI")
+        cred_dict["token_uri"] = os.getenv("GS_TOKEN_URI")
+        cred_dict["auth_provider_x509_cert_url"] = os.getenv("GS_AUTH_PROV")
+        cred_dict["client_x509_cert_url"] = os.getenv("GS_CLIENT_CERT_URL")
+        cred_dict["private_key"] = os.getenv("GS_PRIVATE_KEY").replace(
+            "\\n", "\n"
+        )  # Python add a '\' before any '\n' when loading a str
+        cred_dict["private_key_id"] = os.getenv("GS_PRIVATE_KEY_ID")
+        cred_dict["client_email"] = os.getenv("GS_CLIENT_EMAIL")
+        cred_dict["client_id"] = int(os.getenv("GS_CLIENT_ID"))
+        creds = service_account.ServiceAccountCredentials.from_json_keyfile_dict(cred_dict, cls._scope)
+        cls._client = gspread.authorize(creds)
+        logging.info("[Database] Google sheet credentials loaded.")
+
+        # Open google sheet
+        cls._sheet = cls._client.open_by_url(os.getenv("GOOGLE_SHEET_URL"))
+        cls._users_ws = cls._sheet.worksheet("users")
+        cls._guilds_ws = cls._sheet.worksheet("guilds")
+
+        logging.info("[Database] Spreadsheed loaded")
 
-        Returns
-        -------
-        `Tuple[Dict[disnake.Guild, disnake.Role], Dict[disnake.User, UlbUser]]`
-            Tuple of (Guilds,Users) with:
-            - Guild: `Dict[disnake.Guild, disnake.Role]`
-            - Users: `Dict[disnake.User, UlbUser]]`
-        """
+    @classmethod
+    async def _fetch(cls) -> Tuple[List[dict], List[dict]]:
         # First time this is call, we need to load the credentials and the sheet
         if not cls._sheet:
-            cred_dict = {}
-            cred_dict["type"] = os.getenv("GS_TYPE")
-            cred_dict["project_id"] = os.getenv("GS_PROJECT_ID")
-            cred_dict["auth_uri"] = os.getenv("GS_AUTHOR_URI")
-            cred_dict["token_uri"] = os.getenv("GS_TOKEN_URI")
-            cred_dict["auth_provider_x509_cert_url"] = os.getenv("GS_AUTH_PROV")
-            cred_dict["client_x509_cert_url"] = os.getenv("GS_CLIENT_CERT_URL")
-            cred_dict["private_key"] = os.getenv("GS_PRIVATE_KEY").replace(
-                "\\n", "\n"
-            )  # Python add a '\' before any '\n' when loading a str
-            cred_dict["private_key_id"] = os.getenv("GS_PRIVATE_KEY_ID")
-            cred_dict["client_email"] = os.getenv("GS_CLIENT_EMAIL")
-            cred_dict["client_id"] = int(os.getenv("GS_CLIENT_ID"))
-            creds = ServiceAccountCredentials.from_json_keyfile_dict(cred_dict, cls._scope)
-            cls._client = gspread.authorize(creds)
-            logging.info("[Database] Google sheet credentials loaded.")
-
-            # Open google sheet
-            cls._sheet = cls._client.open_by_url(os.getenv("GOOGLE_SHEET_URL"))
-            cls._users_ws = cls._sheet.worksheet("users")
-            cls._guilds_ws = cls._sheet.worksheet("guilds")
-
-            logging.info("[Database] Spreadsheed loaded")
+            await asyncio.to_thread(cls._open_sheet)
 
         logging.info("[Database] Loading data...")
+        return await asyncio.gather(
+            cls._request(cls._guilds_ws.get_all_records), cls._request(cls._users_ws.get_all_records)
+        )
 
-        # Load guilds
-        cls.ulb_guilds = {}
-        for guild_data in cls._guilds_ws.get_all_records():
-            guild: disnake.Guild = bot.get_guild(guild_data.get("guild_id", int))
-            if guild:
-                role: disnake.Role = guild.get_role(guild_data.get("role_id", int))
-                rename: bool = True if guild_data.get("rename", str) == "TRUE" else False
-                if role:
-                    cls.ulb_guilds.setdefault(guild, UlbGuild(role, rename))
-                    logging.trace(
-                        f"[Database] Role {role.name}:{role.id} loaded from guild {guild.name}:{guild.id} with {rename=}"
-                    )
-                else:
-                    logging.warning(
-                        f"[Database] Not able to find role from id={guild_data.get('role_id', int)} in guild {guild.name}:{guild.id}."
-                    )
-            else:
-                logging.warning(f"[GoogleSheet] Not able to find guild from id={guild_data.get('guild_id', int)}.")
-        logging.info(f"[Database] Found {len(cls.ulb_guilds)} guilds.")
+    @classmethod
+    async def load(cls, bot: Bot) -> None:
+        """Load the data from the google sheet.
+
+        The google sheet requests are run in threads so the event loop is not blocked, and both worksheets are
+        downloaded concurrently. The guilds and users already in the cache of the bot are resolved, the others are kept
+        until their shard is ready (see `resolve()`).
+
+        Once loaded, the cache is kept if the google sheet is down or if writes are still queued.
 
-        # Load users
+        Parameters
+        ----------
+        bot : `Bot`
+            The bot, used to get the guilds and the users from their ids
+        """
+        start = time.perf_counter()
+        if cls._loaded and cls._outbox:
+            logging.warning(
+                f"[Database] {len(cls._outbox)} writes still queued, the cache is kept instead of reloading."
+            )
+            return
+        try:
+            async with Scheduler.sheets.slot():
+                guilds_records, users_records = await cls._breaker.call(cls._fetch)
+        except Exception as ex:
+            if not cls._loaded or not (isinstance(ex, CircuitOpenError) or _is_sheet_outage(ex)):
+                raise
+            logging.warning(f"[Database] Google sheet unavailable, the cache is kept: {type(ex).__name__}: {ex}")
+            return
+
+        cls.ulb_guilds = {}
         cls.ulb_users = {}
-        for user_data in cls._users_ws.get_all_records():
-            user = bot.get_user(user_data.get("user_id", int))
-            if user:
-                cls.ulb_users.setdefault(user, UlbUser(user_data.get("name", str), user_data.get("email", str)))
+        cls._pending_guilds = {guild_data.get("guild_id", int): guild_data for guild_data in guilds_records}
+        cls._pending_users = {user_data.get("user_id", int): user_data for user_data in users_records}
+        logging.info(f"[Database] Found {len(guilds_records)} guilds and {len(users_records)} users.")
+        cls._resolve(bot)
+        if Readiness.is_set(Stage.storage):
+            cls._drop_unresolved()
+
+        cls._bot = bot
+        cls._loaded = True
+        Cluster.worker("sheet", cls._run_write)
+        Cluster.subscribe("database", cls._on_event)
+        Metrics.observe("database_load_seconds", time.perf_counter() - start)
+        Metrics.gauge_callback("database_users", lambda: len(cls.ulb_users))
+        Metrics.gauge_callback("database_guilds", lambda: len(cls.ulb_guilds))
+        Metrics.gauge_callback("database_pending_writes", lambda: len(cls._outbox))
+        Metrics.gauge_callback("database_unresolved", lambda: len(cls._pending_guilds) + len(cls._pending_users))
+
+    @classmethod
+    def resolve(cls, bot: Bot, shard_id: int) -> None:
+        """Resolve the loaded guilds and users now in the cache of the bot, once a shard is ready.
+
+        The members of a guild are only cached once the guild has been chunked by its shard, so with several shards the
+        users are resolved as their shards get ready. The storage is then ready for this shard.
+
+        Parameters
+        ----------
+        bot : `Bot`
+            The bot, used to get the guilds and the users from their ids
+        shard_id : `int`
+            The shard that is ready
+        """
+        if not cls._loaded:
+            raise DatabaseNotLoadedError
+        cls._resolve(bot)
+        Readiness.set(Stage.storage, shard=shard_id)
+        if Readiness.is_set(Stage.storage):
+            cls._drop_unresolved()
+
+    @classmethod
+    def _resolve(cls, bot: Bot) -> None:
+        guilds = len(cls.ulb_guilds)
+        for guild_id, guild_data in list(cls._pending_guilds.items()):
+            guild: disnake.Guild = bot.get_guild(guild_id)
+            if not guild:
+                continue
+            del cls._pending_guilds[guild_id]
+            role: disnake.Role = guild.get_role(guild_data.get("role_id", int))
+            rename: bool = True if guild_data.get("rename", str) == "TRUE" else False
+            if role:
+                cls.ulb_guilds.setdefault(guild, UlbGuild(role, rename))
                 logging.trace(
-                    f"[Database] User {user.name}:{user.id} loaded with name={user_data.get('name')} and email={user_data.get('email')}"
+                    "[Database] Role %s:%s loaded from guild %s:%s with rename=%r",
+                    role.name,
+                    role.id,
+                    guild.name,
+                    guild.id,
+                    rename,
                 )
             else:
-                logging.warning(f"[Database] Not able to find user from id={user_data.get('user_id',int)}.")
-        logging.info(f"[Database] Found {len(cls.ulb_users)} users.")
+                logging.warning(
+                    f"[Database] Not able to find role from id={guild_data.get('role_id', int)} in guild {guild.name}:{guild.id}."
+                )
 
-        cls._loaded = True
+        users = len(cls.ulb_users)
+        for user_id, user_data in list(cls._pending_users.items()):
+            user = bot.get_user(user_id)
+            if not user:
+                continue
+            del cls._pending_users[user_id]
+            cls.ulb_users.setdefault(user, UlbUser(user_data.get("name", str), user_data.get("email", str)))
+            logging.trace(
+                "[Database] User %s:%s loaded with name=%s and email=%s",
+                user.name,
+                user.id,
+                user_data.get("name"),
+                user_data.get("email"),
+            )
+        logging.info(
+            f"[Database] {len(cls.ulb_guilds) - guilds} guilds and {len(cls.ulb_users) - users} users resolved "
+            + f"({len(cls._pending_guilds)} guilds and {len(cls._pending_users)} users pending)."
+        )
+
+    @classmethod
+    def _drop_unresolved(cls) -> None:
+        """Once the storage of all the shards is ready, what is not in the cache is not reachable by the bot."""
+        for guild_id in cls._pending_guilds:
+            logging.warning(f"[GoogleSheet] Not able to find guild from id={guild_id}.")
+        for user_id in cls._pending_users:
+            logging.warning(f"[Database] Not able to find user from id={user_id}.")
+        cls._pending_guilds = {}
+        cls._pending_users = {}
+
+    @classmethod
+    def guild_ids(cls) -> Set[int]:
+        """Get the ids of all the loaded guilds, resolved or not."""
+        return set(cls._pending_guilds.keys()) | {guild.id for guild in cls.ulb_guilds or ()}
+
+    @classmethod
+    def user_ids(cls) -> Set[int]:
+        """Get the ids of all the loaded users, resolved or not."""
+        return set(cls._pending_users.keys()) | {user.id for user in cls.ulb_users or ()}
+
+    @classmethod
+    def _write(cls, op: str, *args) -> None:
+        """Write to the google sheet in background with the `_<op>_task()` coroutine, after the writes already queued.
+
+        In clustered mode, the write is a job run by the leader, so the sheet has a single writer, and the other nodes
+        are told to apply it to their cache.
+        """
+        cls.writes += 1
+        if Cluster.enabled():
+            Cluster.submit("sheet", {"op": op, "args": args})
+            Cluster.publish("database", {"op": op, "args": args})
+        else:
+            cls._outbox.append((op, args))
+            if cls._flush_task is None or cls._flush_task.done():
+                cls._flush_task = cls._schedule(cls._flush())
+
+    @classmethod
+    async def _flush(cls) -> None:
+        """Send the queued writes in order. A write failing because the google sheet is down stays at the head of the
+        queue until a probe of the circuit breaker succeeds, the others are dropped. On shutdown, the writes that could
+        not be sent are logged."""
+        try:
+            while cls._outbox:
+                if cls._breaker.retry_in() > 0:
+                    if TaskRegistry.closing:
+                        break
+                    await asyncio.sleep(1)
+                    continue
+                op, args = cls._outbox[0]
+                try:
+                    async with Scheduler.sheets.slot(Priority.background):
+                        await cls._breaker.call(lambda: getattr(cls, f"_{op}_task")(*args))
+                except CircuitOpenError:
+                    await asyncio.sleep(1)
+                    continue
+                except Exception as ex:
+                    if _is_sheet_outage(ex):
+                        logging.warning(f"[Database] Write {op} failed, kept in the queue: {type(ex).__name__}: {ex}")
+                        await asyncio.sleep(1)
+                        continue
+                    logging.error(f"[Database] Write {op}{args} failed and dropped: {type(ex).__name__}: {ex}")
+                cls._outbox.popleft()
+        finally:
+            if cls._outbox and TaskRegistry.closing:
+                logging.warning(
+                    f"[Database] {len(cls._outbox)} writes not sent to the google sheet: "
+                    + ", ".join(f"{op}{args}" for op, args in cls._outbox)
+                )
+
+    @classmethod
+    def writes_pending(cls) -> int:
+        """Get the number of writes not sent to the google sheet yet."""
+        return len(cls._outbox)
+
+    @classmethod
+    async def read_sheet(cls) -> Dict[str, List[list]]:
+        """Read the unformatted rows of all the worksheets with a single request, through the circuit breaker.
+
+        Returns
+        -------
+        `Dict[str, List[list]]`
+            The rows of each worksheet, header included
+        """
+        names = [cls._users_ws.title, cls._guilds_ws.title]
+
+        def read() -> Dict[str, List[list]]:
+            ranges = cls._sheet.values_batch_get(names, params={"valueRenderOption": "UNFORMATTED_VALUE"})
+            return {name: value_range.get("values", []) for name, value_range in zip(names, ranges["valueRanges"])}
+
+        async with Scheduler.sheets.slot():
+            return await cls._breaker.call(lambda: cls._request(read))
+
+    @classmethod
+    async def batch_write(cls, requests: List[dict], writes: int = None) -> bool:
+        """Send several changes to the google sheet with a single request, through the circuit breaker.
+
+        Parameters
+        ----------
+        requests : `List[dict]`
+            The requests of the `batchUpdate` of the google sheet API, applied in order
+        writes : `Optional[int]`
+            The number of `writes` the requests were built on. If other writes were queued since, the rows may have
+            moved and the requests are not sent. By default None (always sent).
+
+        Returns
+        -------
+        `bool`
+            True if the requests were sent
+        """
+        async with Scheduler.sheets.slot():
+            if writes is not None and cls.writes != writes:
+                return False
+            await cls._breaker.call(lambda: cls._request(cls._sheet.batch_update, {"requests": requests}))
+        return True
+
+    @classmethod
+    def worksheet_ids(cls) -> Dict[str, int]:
+        """Get the ids of the worksheets, used by the requests of `batch_write()`."""
+        return {cls._users_ws.title: cls._users_ws.id, cls._guilds_ws.title: cls._guilds_ws.id}
+
+    @classmethod
+    async def _run_write(cls, job: dict) -> None:
+        async with Scheduler.sheets.slot(Priority.background):
+            await cls._breaker.call(lambda: getattr(cls, f"_{job['op']}_task")(*job["args"]))
+
+    @classmethod
+    async def _on_event(cls, event: dict) -> None:
+        """Apply to the cache a change made by another node of the cluster."""
+        op = event["op"]
+        if op == "reload":
+            await cls.load(cls._bot)
+            return
+        if not cls._loaded:
+            return
+        if op in ("set_user", "set_users"):
+            for user_id, name, email in [event["args"]] if op == "set_user" else event["args"][0]:
+                user = cls._bot.get_user(user_id)
+                if user:
+                    cls._pending_users.pop(user_id, None)
+                    cls.ulb_users[user] = UlbUser(name, email)
+        elif op == "delete_user":
+            user = cls._bot.get_user(event["args"][0])
+            if user:
+                cls.ulb_users.pop(user, None)
+        elif op == "set_guild":
+            guild_id, role_id, rename = event["args"]
+            guild = cls._bot.get_guild(guild_id)
+            role = guild.get_role(role_id) if guild else None
+            if role:
+                cls._pending_guilds.pop(guild_id, None)
+                cls.ulb_guilds[guild] = UlbGuild(role, rename)
+        elif op == "delete_guild":
+            guild = cls._bot.get_guild(event["args"][0])
+            if guild:
+                cls.ulb_guilds.pop(guild, None)
+        logging.trace("[Database] %s applied from another node", op)
+
+    @classmethod
+    async def _request(cls, func: Callable, *args, **kwargs) -> Any:
+        """Call the google sheet API in a thread, timing out after `request_timeout` seconds."""
+        return await asyncio.wait_for(asyncio.to_thread(func, *args, **kwargs), timeout=cls.request_timeout)
+
+    @classmethod
+    def _schedule(cls, coro: Coroutine) -> asyncio.Task:
+        """Run a write to the google sheet in background, drained on shutdown."""
+        return TaskRegistry.spawn(coro, "database")
 
     @classmethod
     async def _set_user_task(cls, user_id: int, name: str, email: str):
@@ -180,17 +471,17 @@ class Database:
         email : `str`
             The email address
         """
-        user_cell: gspread.cell.Cell = cls._users_ws.find(str(user_id), in_column=1)
+        user_cell: gspread.cell.Cell = await cls._request(cls._users_ws.find, str(user_id), in_column=1)
         await asyncio.sleep(0.1)
         if user_cell:
-            logging.debug(f"[Database] {user_id=} found")
-            cls._users_ws.update_cell(user_cell.row, 2, name)
+            logging.debug("[Database] user_id=%r found", user_id)
+            await cls._request(cls._users_ws.update_cell, user_cell.row, 2, name)
             await asyncio.sleep(0.1)
-            cls._users_ws.update_cell(user_cell.row, 3, email)
+            await cls._request(cls._users_ws.update_cell, user_cell.row, 3, email)
             logging.info(f"[Database] {user_id=} updated with {name=} and {email=}")
         else:
-            logging.debug(f"[Database] {user_id=} not found")
-            cls._users_ws.append_row(values=[str(user_id), name, email])
+            logging.debug("[Database] user_id=%r not found", user_id)
+            await cls._request(cls._users_ws.append_row, [str(user_id), name, email])
             logging.info(f"[Database] {user_id=} added with {name=} and {email=}")
 
     @classmethod
@@ -210,8 +501,57 @@ class Database:
         """
         if not cls._loaded:
             raise DatabaseNotLoadedError
+        cls._pending_users.pop(user.id, None)
         cls.ulb_users[user] = UlbUser(name, email)
-        asyncio.create_task(cls._set_user_task(user.id, name, email))
+        cls._write("set_user", user.id, name, email)
+
+    @classmethod
+    async def _set_users_task(cls, users: List[Tuple[int, str, str]]):
+        """Coroutine task called by `set_users()` to add or update several ulb users on the google sheet.
+
+        The user ids column is read once, then the existing rows are updated with one batch update and the new ones are
+        appended with one call.
+
+        Parameters
+        ----------
+        users : `List[Tuple[int, str, str]]`
+            The (user id, name, email) to write
+        """
+        user_ids = await cls._request(cls._users_ws.col_values, 1)
+        rows: Dict[str, int] = {user_id: row for row, user_id in enumerate(user_ids, start=1)}
+        updates = []
+        appends = []
+        for user_id, name, email in users:
+            row = rows.get(str(user_id))
+            if row:
+                updates.append({"range": f"B{row}:C{row}", "values": [[name, email]]})
+            else:
+                appends.append([str(user_id), name, email])
+        if updates:
+            await asyncio.sleep(0.1)
+            await cls._request(cls._users_ws.batch_update, updates)
+        if appends:
+            await asyncio.sleep(0.1)
+            await cls._request(cls._users_ws.append_rows, appends)
+        logging.info(f"[Database] {len(updates)} users updated and {len(appends)} users added.")
+
+    @classmethod
+    def set_users(cls, users: List[Tuple[disnake.User, str, str]]):
+        """Add or update several ulb users on the google sheet with a single batched write.
+
+        It create a task without waiting for it to end, in order to not decrease the global performance of the Bot.
+
+        Parameters
+        ----------
+        users : `List[Tuple[disnake.User, str, str]]`
+            The (user, name, email) to add or update
+        """
+        if not cls._loaded:
+            raise DatabaseNotLoadedError
+        for user, name, email in users:
+            cls._pending_users.pop(user.id, None)
+            cls.ulb_users[user] = UlbUser(name, email)
+        cls._write("set_users", [(user.id, name, email) for user, name, email in users])
 
     @classmethod
     async def _delete_user_task(cls, user_id: int):
@@ -222,10 +562,10 @@ class Database:
         user_id : `int`
             The user id
         """
-        user_cell: gspread.cell.Cell = cls._users_ws.find(str(user_id), in_column=1)
+        user_cell: gspread.cell.Cell = await cls._request(cls._users_ws.find, str(user_id), in_column=1)
         await asyncio.sleep(0.1)
-        logging.trace(f"[Database] {user_id=} found")
-        cls._users_ws.delete_row(user_cell.row)
+        logging.trace("[Database] user_id=%r found", user_id)
+        await cls._request(cls._users_ws.delete_row, user_cell.row)
         await asyncio.sleep(0.1)
         logging.info(f"[Database] {user_id=} deleted.")
 
@@ -243,7 +583,7 @@ class Database:
         if not cls._loaded:
             raise DatabaseNotLoadedError
         cls.ulb_users.pop(user)
-        asyncio.create_task(cls._delete_user_task(user.id))
+        cls._write("delete_user", user.id)
 
     @classmethod
     async def _set_guild_task(cls, guild_id: int, role_id: int, rename: bool):
@@ -258,16 +598,16 @@ class Database:
         role_id : `int`
             Ulb Role id
         """
-        guild_cell: gspread.cell.Cell = cls._guilds_ws.find(str(guild_id), in_column=1)
+        guild_cell: gspread.cell.Cell = await cls._request(cls._guilds_ws.find, str(guild_id), in_column=1)
         await asyncio.sleep(0.1)
         if guild_cell:
-            logging.debug(f"[Database] {guild_id=} found.")
-            cls._guilds_ws.update_cell(guild_cell.row, 2, str(role_id))
-            cls._guilds_ws.update_cell(guild_cell.row, 3, rename)
+            logging.debug("[Database] guild_id=%r found.", guild_id)
+            await cls._request(cls._guilds_ws.update_cell, guild_cell.row, 2, str(role_id))
+            await cls._request(cls._guilds_ws.update_cell, guild_cell.row, 3, rename)
             logging.info(f"[Database] {guild_id=} update with {role_id=} and {rename=}.")
         else:
-            logging.debug(f"[Database] {guild_id=} not found.")
-            cls._guilds_ws.append_row(values=[str(guild_id), str(role_id), rename])
+            logging.debug("[Database] guild_id=%r not found.", guild_id)
+            await cls._request(cls._guilds_ws.append_row, [str(guild_id), str(role_id), rename])
             logging.info(f"[Database] {guild_id=} added with {role_id=} and {rename=}.")
 
     @classmethod
@@ -285,8 +625,9 @@ class Database:
         """
         if not cls._loaded:
             raise DatabaseNotLoadedError
+        cls._pending_guilds.pop(guild.id, None)
         cls.ulb_guilds[guild] = UlbGuild(role, rename)
-        asyncio.create_task(cls._set_guild_task(guild.id, role.id, rename))
+        cls._write("set_guild", guild.id, role.id, rename)
 
     @classmethod
     async def _delete_guild_task(cls, guild_id: int):
@@ -297,10 +638,10 @@ class Database:
         guild_id : `int`
             The guild id
         """
-        guild_cell: gspread.cell.Cell = cls._guilds_ws.find(str(guild_id), in_column=1)
+        guild_cell: gspread.cell.Cell = await cls._request(cls._guilds_ws.find, str(guild_id), in_column=1)
         await asyncio.sleep(0.1)
-        logging.trace(f"[Database] {guild_id=} found")
-        cls._guilds_ws.delete_row(guild_cell.row)
+        logging.trace("[Database] guild_id=%r found", guild_id)
+        await cls._request(cls._guilds_ws.delete_row, guild_cell.row)
         await asyncio.sleep(0.1)
         logging.info(f"[Database] {guild_id=} deleted.")
 
@@ -318,7 +659,7 @@ class Database:
         if not cls._loaded:
             raise DatabaseNotLoadedError
         cls.ulb_guilds.pop(guild)
-        asyncio.create_task(cls._delete_guild_task(guild.id))
+        cls._write("delete_guild", guild.id)
 
     @classmethod
     def get_user_by_name(self, name: str) -> Optional[disnake.User]:
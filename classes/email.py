@@ -1,10 +1,32 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import collections
 import logging
 import os
-import smtplib
 import ssl
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
+import threading
+from typing import Deque
+from typing import Tuple
+
+from bot import CircuitBreaker
+from bot import CircuitOpenError
+from bot import lazy_import
+from bot import Metrics
+from bot import TaskRegistry
+
+smtplib = lazy_import("smtplib")
+mime_multipart = lazy_import("email.mime.multipart")
+mime_text = lazy_import("email.mime.text")
+
+
+def _is_smtp_outage(ex: Exception) -> bool:
+    """The SMTP server is considered down on any error but a refused recipient, which only concerns one address."""
+    return isinstance(ex, OSError) and not isinstance(ex, smtplib.SMTPRecipientsRefused)
+
+
+def _is_permanent(ex: Exception) -> bool:
+    """A 5xx reply of the SMTP server will not succeed by retrying the same email."""
+    return isinstance(ex, smtplib.SMTPResponseException) and ex.smtp_code >= 500
 
 
 class EmailManagerInstantiationError:
@@ -19,16 +41,36 @@ class EmailManager:
 
     This should be used as a class, and not instantiated.
 
+    The SMTP server is called through a circuit breaker. While it is down, the emails are queued in an outbox and sent
+    in order once a probe succeeds. A queued email refused with a permanent error (5xx) is dropped after
+    `max_attempts` tries, so it does not block the ones behind it.
+
     Classmethods
     -----------
+    send(target_email: `str`, token: `str`): `coro`
+        Send an email for the token verification from a thread, or queue it if the SMTP server is down
     send_token(targer_email: `str`, token: `str`)
         Send an email for the token verification
     """
 
-    _email_addr: str = os.getenv("EMAIL_ADDR")
+    _email_addr: str = None
     _port = 465  # For SSL
-    _auth_token: str = os.getenv("EMAIL_AUTH_TOKEN")
-    _context: ssl.SSLContext = ssl.create_default_context()
+    timeout = 15  # In sec
+    max_attempts = 3
+    _auth_token: str = None
+    _context: ssl.SSLContext = None
+    in_flight: int = 0
+    _in_flight_lock = threading.Lock()  # Updated from the sending threads
+    _breaker = CircuitBreaker("smtp", is_failure=_is_smtp_outage)
+    _outbox: Deque[Tuple[str, str]] = collections.deque()
+    _flush_task: asyncio.Task = None
+
+    @classmethod
+    def _setup(cls) -> None:
+        """Read the credentials and create the SSL context on first use, instead of at import."""
+        cls._email_addr = os.getenv("EMAIL_ADDR")
+        cls._auth_token = os.getenv("EMAIL_AUTH_TOKEN")
+        cls._context = ssl.create_default_context()
 
     @classmethod
     def _content(cls, target_email: str, token: str):
@@ -41,7 +83,7 @@ class EmailManager:
         token: `str`
             The token to inlude in the email
         """
-        msg = MIMEMultipart("alternative")
+        msg = mime_multipart.MIMEMultipart("alternative")
         msg["Subject"] = "Discord - ULB email adresse vérification"
         msg["From"] = cls._email_addr
         msg["To"] = target_email
@@ -61,10 +103,89 @@ class EmailManager:
 </html>
 """
 
-        msg.attach(MIMEText(html, "html"))
+        msg.attach(mime_text.MIMEText(html, "html"))
 
         return msg.as_string()
 
+    @classmethod
+    async def send(cls, target_email: str, token: str) -> bool:
+        """Send an email with the token verification from a thread, without blocking the event loop. The sending is
+        finished on shutdown even if the caller is cancelled.
+
+        If the SMTP server is down, or emails are already waiting, the email is queued and sent later.
+
+        Parameters
+        ----------
+        target_email : `str`
+            The address email of the receiver
+        token : `str`
+            The token to include in the email
+
+        Returns
+        -------
+        `bool`
+            True if the email was sent, False if it was queued
+
+        Raises
+        ------
+        `smtplib.SMTPRecipientsRefused`
+            Raised if the address email is refused
+        """
+        if not cls._outbox:
+            try:
+                await cls._breaker.call(lambda: cls._send_in_thread(target_email, token))
+                return True
+            except CircuitOpenError:
+                pass
+            except Exception as ex:
+                if not _is_smtp_outage(ex):
+                    raise
+                logging.warning(f"[EMAIL] Token email to {target_email} queued: {type(ex).__name__}: {ex}")
+        cls._outbox.append((target_email, token))
+        Metrics.incr("email_queued")
+        Metrics.gauge_callback("email_outbox", lambda: len(cls._outbox))
+        if cls._flush_task is None or cls._flush_task.done():
+            cls._flush_task = TaskRegistry.spawn(cls._flush(), "email")
+        return False
+
+    @classmethod
+    def _send_in_thread(cls, target_email: str, token: str) -> asyncio.Future:
+        return asyncio.shield(TaskRegistry.spawn(asyncio.to_thread(cls.send_token, target_email, token), "email"))
+
+    @classmethod
+    async def _flush(cls) -> None:
+        """Send the queued emails in order, once the circuit breaker lets a call through. On shutdown, the emails that
+        could not be sent are logged."""
+        attempts = 0  # Of the email at the head of the outbox
+        try:
+            while cls._outbox:
+                if cls._breaker.retry_in() > 0:
+                    if TaskRegistry.closing:
+                        break
+                    await asyncio.sleep(1)
+                    continue
+                target_email, token = cls._outbox[0]
+                try:
+                    await cls._breaker.call(lambda: cls._send_in_thread(target_email, token))
+                except CircuitOpenError:
+                    await asyncio.sleep(1)
+                    continue
+                except Exception as ex:
+                    attempts += 1
+                    if _is_smtp_outage(ex) and not (_is_permanent(ex) and attempts >= cls.max_attempts):
+                        await asyncio.sleep(1)
+                        continue
+                    Metrics.incr("email_dropped")
+                    logging.error(f"[EMAIL] Queued token email to {target_email} dropped: {type(ex).__name__}: {ex}")
+                cls._outbox.popleft()
+                attempts = 0
+        finally:
+            if cls._outbox and TaskRegistry.closing:
+                logging.warning(
+                    f"[EMAIL] {len(cls._outbox)} token emails not sent: "
+                    + ", ".join(target_email for target_email, _ in cls._outbox)
+                )
+
     @classmethod
     def send_token(cls, target_email: str, token: str):
         """Send an email with the token verification
@@ -76,8 +197,20 @@ class EmailManager:
         token : `str`
             The token to include in the email
         """
-        with smtplib.SMTP_SSL("smtp.gmail.com", cls._port, context=cls._context) as server:
+        if cls._context is None:
+            cls._setup()
+        with cls._in_flight_lock:
+            cls.in_flight += 1
+        try:
+            cls._send(target_email, token)
+        finally:
+            with cls._in_flight_lock:
+                cls.in_flight -= 1
+
+    @classmethod
+    def _send(cls, target_email: str, token: str):
+        with smtplib.SMTP_SSL("smtp.gmail.com", cls._port, context=cls._context, timeout=cls.timeout) as server:
             server.login(cls._email_addr, cls._auth_token)
             content: str = cls._content(target_email, token)
             server.sendmail(cls._email_addr, target_email, content)
-            logging.trace(f"[EMAIL] Token email sent to {target_email}")
+            logging.trace("[EMAIL] Token email sent to %s", target_email)
@@ -41,7 +41,9 @@ class FeedbackModal(disnake.ui.Modal):
 
     async def callback(self, interaction: disnake.ModalInteraction, /) -> None:
         await interaction.response.defer(with_message=True, ephemeral=True)
-        logging.trace(f"[Feedback] Returning {self.type} feedback by {interaction.author} from {interaction.guild}")
+        logging.trace(
+            "[Feedback] Returning %s feedback by %s from %s", self.type, interaction.author, interaction.guild
+        )
         feedback: str = interaction.text_values.get("feedback")
         if self.type == FeedbackType.issu:
             embed = disnake.Embed(
@@ -67,4 +69,4 @@ class FeedbackModal(disnake.ui.Modal):
                 color=disnake.Color.blue(),
             )
         )
-        logging.trace(f"[Feedback] feedback {self.type} by {interaction.author} from {interaction.guild} ended")
+        logging.trace("[Feedback] feedback %s by %s from %s ended", self.type, interaction.author, interaction.guild)
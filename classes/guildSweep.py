@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import time
+from typing import Dict
+from typing import Optional
+
+from .database import Database
+from .memberCache import MemberCache
+from .utils import update_guild
+from bot import Cluster
+from bot import Metrics
+from bot import TaskRegistry
+
+
+class _Sweep:
+    __slots__ = ("task", "reason", "shard", "done", "total", "start")
+
+    def __init__(self, reason: str, shard: Optional[int]) -> None:
+        self.task: asyncio.Task = None
+        self.reason: str = reason
+        self.shard: Optional[int] = shard
+        self.done: int = 0
+        self.total: int = 0
+        self.start: float = time.perf_counter()
+
+    @property
+    def label(self) -> str:
+        return "all" if self.shard is None else str(self.shard)
+
+
+class GuildSweepInstantiationError(Exception):
+    """The Exception to be raise when the GuildSweep class is instantiated."""
+
+    def __init__(self, *args: object) -> None:
+        super().__init__("The GuildSweep class cannot be instantiated, but only used as a class.")
+
+
+class GuildSweep:
+    """Represent the background job updating all the ULB guilds.
+
+    A sweep covers the guilds of one shard, or all the guilds. Only one sweep runs at a time for a shard: starting a new
+    one cancels the running one of the same shard, and a sweep of all the guilds cancels all the running sweeps.
+
+    In clustered mode, only the guilds of the shards whose lease is held by this node are swept, so a shard run by two
+    nodes (during a rolling restart for example) is not swept twice.
+
+    On shutdown, the running sweeps are cancelled (the member updates already started are drained) and their progress
+    is reported. The guilds left are checked by the startup sweep of the next run.
+
+    This class is only used as a class and should not be instantiated
+
+    Classmethods
+    ------------
+    start(reason: `str`, shard: `Optional[int]`): `asyncio.Task`
+        Start a new sweep in background
+    wait(shard: `int`): `coro`
+        Wait for the guilds of a shard to be swept, by the running sweep or the ones replacing it
+    cancel(): `bool`
+        Cancel the running sweeps
+    running(): `bool`
+        Check if a sweep is running
+    progress(): `str`
+        Get a short description of the progress of the last sweeps
+    """
+
+    _sweeps: Dict[Optional[int], _Sweep] = {}
+
+    def __init__(self) -> None:
+        raise GuildSweepInstantiationError
+
+    @classmethod
+    def start(cls, reason: str, shard: Optional[int] = None) -> asyncio.Task:
+        """Start a new sweep in background, cancelling the running one.
+
+        Parameters
+        ----------
+        reason : `str`
+            Why the sweep is started, for the logs
+        shard : `Optional[int]`
+            Only update the guilds of this shard, by default None (all the guilds)
+
+        Returns
+        -------
+        `asyncio.Task`
+            The task of the sweep
+        """
+        if shard is None:
+            replaced = cls.cancel()
+        else:
+            replaced = cls._cancel(cls._sweeps.get(shard))
+        if replaced:
+            logging.info(f"[GuildSweep] Running sweep replaced by a new one ({reason})")
+        sweep = cls._sweeps[shard] = _Sweep(reason, shard)
+        sweep.task = asyncio.create_task(cls._run(sweep))
+        TaskRegistry.checkpoint(cls._checkpoint)
+        return sweep.task
+
+    @classmethod
+    def _covering(cls, shard: int) -> Optional[_Sweep]:
+        """Get the last sweep started for the guilds of a shard."""
+        sweeps = [sweep for key, sweep in cls._sweeps.items() if key in (shard, None)]
+        return max(sweeps, key=lambda sweep: sweep.start, default=None)
+
+    @classmethod
+    async def wait(cls, shard: int) -> bool:
+        """Wait for the guilds of a shard to be swept. If the running sweep is replaced by a new one (`/update`, shard
+        resumed...), the new one is awaited instead.
+
+        Parameters
+        ----------
+        shard : `int`
+            The shard
+
+        Returns
+        -------
+        `bool`
+            True once a sweep of the shard is done, False if it was cancelled without being replaced (on shutdown)
+        """
+        while True:
+            sweep = cls._covering(shard)
+            if sweep is None:
+                return False
+            await asyncio.wait([sweep.task])
+            if not sweep.task.cancelled():
+                return True
+            if cls._covering(shard) is sweep:
+                return False
+
+    @classmethod
+    def _checkpoint(cls) -> str:
+        stopped = [sweep for sweep in cls._sweeps.values() if cls._cancel(sweep)]
+        if not stopped:
+            return "guild sweeps: none running"
+        return "guild sweeps: " + ", ".join(
+            f"shard {sweep.label} ({sweep.reason}) stopped at {sweep.done}/{sweep.total} guilds" for sweep in stopped
+        )
+
+    @staticmethod
+    def _cancel(sweep: Optional[_Sweep]) -> bool:
+        if sweep is None or sweep.task.done():
+            return False
+        sweep.task.cancel()
+        return True
+
+    @classmethod
+    def cancel(cls) -> bool:
+        """Cancel the running sweeps.
+
+        Returns
+        -------
+        `bool`
+            True if a sweep was running
+        """
+        return any([cls._cancel(sweep) for sweep in cls._sweeps.values()])
+
+    @classmethod
+    def running(cls) -> bool:
+        return any(not sweep.task.done() for sweep in cls._sweeps.values())
+
+    @classmethod
+    def progress(cls) -> str:
+        if not cls._sweeps:
+            return "Aucune mise à jour des serveurs lancée."
+        lines = []
+        for sweep in cls._sweeps.values():
+            state = "en cours" if not sweep.task.done() else "annulée" if sweep.task.cancelled() else "terminée"
+            shard = "" if sweep.shard is None else f" [shard {sweep.shard}]"
+            lines.append(
+                f"Mise à jour des serveurs{shard} ({sweep.reason}) {state} : {sweep.done}/{sweep.total} serveurs."
+            )
+        return "\n".join(lines)
+
+    @classmethod
+    async def _update_guild(cls, sweep: _Sweep, guild, guild_data) -> None:
+        try:
+            await MemberCache.ensure(guild)
+            await update_guild(guild, role=guild_data.role, rename=guild_data.rename)
+        except Exception as ex:
+            logging.error(f"[GuildSweep] [Guild {guild.name}:{guild.id}] Not able to update guild: {ex}")
+        sweep.done += 1
+        Metrics.gauge("guild_sweep_done", sweep.done, shard=sweep.label)
+        if sweep.done % max(1, sweep.total // 10) == 0 or sweep.done == sweep.total:
+            logging.info(f"[GuildSweep] [Shard {sweep.label}] {sweep.done}/{sweep.total} guilds checked")
+
+    @classmethod
+    async def _run(cls, sweep: _Sweep) -> None:
+        guilds = [
+            (guild, guild_data)
+            for guild, guild_data in Database.ulb_guilds.items()
+            if (sweep.shard is None or guild.shard_id == sweep.shard) and Cluster.holds(f"shard-{guild.shard_id}")
+        ]
+        sweep.total = len(guilds)
+        Metrics.gauge("guild_sweep_done", 0, shard=sweep.label)
+        Metrics.gauge("guild_sweep_total", sweep.total, shard=sweep.label)
+        logging.info(f"[GuildSweep] [Shard {sweep.label}] Checking {sweep.total} guilds ({sweep.reason})...")
+        try:
+            await asyncio.gather(*[cls._update_guild(sweep, guild, guild_data) for guild, guild_data in guilds])
+        except asyncio.CancelledError:
+            logging.warning(
+                f"[GuildSweep] [Shard {sweep.label}] Sweep cancelled after {sweep.done}/{sweep.total} guilds"
+            )
+            Metrics.incr("guild_sweeps", outcome="cancelled", shard=sweep.label)
+            raise
+        duration = time.perf_counter() - sweep.start
+        Metrics.incr("guild_sweeps", outcome="done", shard=sweep.label)
+        Metrics.observe("guild_sweep_seconds", duration, shard=sweep.label)
+        logging.info(f"[GuildSweep] [Shard {sweep.label}] All guilds checked in {duration:.1f}s !")
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import os
+import sys
+import time
+from datetime import timedelta
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Set
+
+import disnake
+
+from .database import Database
+from bot import Metrics
+
+
+class MemberCacheInstantiationError(Exception):
+    """The Exception to be raise when the MemberCache class is instantiated."""
+
+    def __init__(self, *args: object) -> None:
+        super().__init__("The MemberCache class cannot be instantiated, but only used as a class.")
+
+
+class MemberCache:
+    """Represent the selective member cache policy, enabled with `MEMBER_CACHE=selective`.
+
+    The guilds are not chunked at startup. The ULB guilds are chunked one at a time (one every `chunk_interval`
+    seconds) when their shard gets ready or when a sweep needs them, then pruned right away so that only the members the
+    bot works with stay cached:
+    - the registered users
+    - the users in a pending registration (see `retain()`)
+    - the members who joined less than `recent_time` seconds ago
+    All the guilds are pruned again every `prune_interval` seconds. A member not cached anymore is fetched on demand
+    with `fetch_member()`.
+
+    This class is only used as a class and should not be instantiated
+
+    Classmethods
+    ------------
+    enabled(): `bool`
+        Check if the selective policy is enabled
+    fetch(bot: `Bot`, shard_id: `int`): `coro`
+        Chunk and prune the ULB guilds of a shard
+    ensure(guild: `disnake.Guild`): `coro`
+        Chunk and prune a guild if it was not since its shard got ready
+    fetch_member(guild: `disnake.Guild`, user_id: `int`): `coro`
+        Get a member from the cache or from the gateway
+    prune(guild: `disnake.Guild`): `int`
+        Remove the members not retained from the cache of a guild
+    retain(provider: `Callable[[], Iterable[int]]`):
+        Add a provider of user ids to keep in the cache
+    report(bot: `Bot`): `str`
+        Get the state of the cache and an estimation of the memory saved
+    """
+
+    # Config params
+    recent_time = 60 * 60  # In sec
+    prune_interval = 15 * 60  # In sec
+    chunk_interval = float(os.getenv("MEMBER_CHUNK_INTERVAL") or 1)  # In sec
+
+    _bot = None
+    _synced: Dict[int, disnake.Guild] = {}
+    _pruned_ids: Dict[int, Set[int]] = {}  # The ids of the members pruned from each guild since it was chunked
+    _retainers: List[Callable[[], Iterable[int]]] = []
+    _lock: asyncio.Lock = None
+    _last_request: float = 0.0
+    _pruned: int = 0
+    _member_size: Optional[int] = None
+    _task: asyncio.Task = None
+
+    def __init__(self) -> None:
+        raise MemberCacheInstantiationError
+
+    @staticmethod
+    def enabled() -> bool:
+        return os.getenv("MEMBER_CACHE", "").lower() == "selective"
+
+    @classmethod
+    def retain(cls, provider: Callable[[], Iterable[int]]) -> None:
+        """Add a provider of user ids to keep in the cache, called on each pruning.
+
+        Parameters
+        ----------
+        provider : `Callable[[], Iterable[int]]`
+            Returns the ids of the users to keep
+        """
+        if provider not in cls._retainers:
+            cls._retainers.append(provider)
+
+    @classmethod
+    async def _rate_limit(cls) -> None:
+        """Wait for the turn of the next gateway request, so the members requests are spaced by `chunk_interval`."""
+        if cls._lock is None:
+            cls._lock = asyncio.Lock()
+        async with cls._lock:
+            wait = cls._last_request + cls.chunk_interval - time.monotonic()
+            if wait > 0:
+                Metrics.observe("member_cache_rate_limit_seconds", wait)
+                await asyncio.sleep(wait)
+            cls._last_request = time.monotonic()
+
+    @classmethod
+    async def fetch(cls, bot, shard_id: int) -> None:
+        """Chunk and prune the ULB guilds of a shard, one at a time. A shard ready again got new guild objects, so they
+        are all chunked again.
+
+        Parameters
+        ----------
+        bot : `Bot`
+            The bot
+        shard_id : `int`
+            The shard that is ready
+        """
+        cls._bot = bot
+        guild_ids = Database.guild_ids()
+        guilds = [guild for guild in bot.guilds if guild.shard_id == shard_id and guild.id in guild_ids]
+        start = time.perf_counter()
+        for guild in guilds:
+            await cls.ensure(guild)
+        logging.info(
+            f"[MemberCache] [Shard {shard_id}] {len(guilds)} guilds fetched in {time.perf_counter() - start:.1f}s"
+        )
+        if cls._task is None:
+            Metrics.gauge_callback("member_cache_members", lambda: sum(len(guild.members) for guild in bot.guilds))
+            Metrics.gauge_callback("member_cache_saved_bytes", cls._saved_bytes)
+            cls._task = asyncio.create_task(cls._prune_loop())
+
+    @classmethod
+    async def ensure(cls, guild: disnake.Guild) -> None:
+        """Chunk and prune a guild, unless it was since its shard got ready. Does nothing if the policy is disabled.
+
+        Parameters
+        ----------
+        guild : `disnake.Guild`
+            The guild
+        """
+        if not cls.enabled() or cls._synced.get(guild.id) is guild:
+            return
+        await cls._rate_limit()
+        start = time.perf_counter()
+        members = await guild.chunk(cache=True)
+        Metrics.observe("member_cache_chunk_seconds", time.perf_counter() - start)
+        cls._synced[guild.id] = guild
+        cls._pruned_ids[guild.id] = set()
+        pruned = cls.prune(guild)
+        logging.trace(
+            "[MemberCache] [Guild %s:%s] %s members chunked, %s pruned", guild.name, guild.id, len(members), pruned
+        )
+
+    @classmethod
+    async def fetch_member(cls, guild: disnake.Guild, user_id: int) -> Optional[disnake.Member]:
+        """Get a member from the cache, or from the gateway if the policy is enabled. A fetched member stays cached until
+        the next pruning. A user missing from the cache of a guild chunked since its shard got ready, and not pruned
+        since, is not a member (the joins are cached): the gateway is not queried.
+
+        Parameters
+        ----------
+        guild : `disnake.Guild`
+            The guild
+        user_id : `int`
+            The id of the user
+
+        Returns
+        -------
+        `Optional[disnake.Member]`
+            The member, `None` if the user is not a member of the guild
+        """
+        member = guild.get_member(user_id)
+        if member is not None or not cls.enabled():
+            return member
+        if cls._synced.get(guild.id) is guild and user_id not in cls._pruned_ids.get(guild.id, ()):
+            Metrics.incr("member_cache_fetches_skipped")
+            return None
+        await cls._rate_limit()
+        Metrics.incr("member_cache_fetches")
+        members = await guild.query_members(user_ids=[user_id], limit=1, cache=True)
+        cls._pruned_ids.get(guild.id, set()).discard(user_id)
+        return members[0] if members else None
+
+    @classmethod
+    def _retained_ids(cls) -> Set[int]:
+        ids = Database.user_ids()
+        for provider in cls._retainers:
+            ids.update(provider())
+        return ids
+
+    @classmethod
+    def prune(cls, guild: disnake.Guild, retained: Set[int] = None) -> int:
+        """Remove from the cache of a guild the members that are not retained by the policy.
+
+        Parameters
+        ----------
+        guild : `disnake.Guild`
+            The guild
+        retained : `Optional[Set[int]]`
+            The ids of the users to keep, by default the registered users and the ones of the `retain()` providers
+
+        Returns
+        -------
+        `int`
+            The number of members removed
+        """
+        if retained is None:
+            retained = cls._retained_ids()
+        if guild.me is not None:
+            retained.add(guild.me.id)
+        recent = disnake.utils.utcnow() - timedelta(seconds=cls.recent_time)
+        pruned = [
+            member
+            for member in guild.members
+            if member.id not in retained and (member.joined_at is None or member.joined_at < recent)
+        ]
+        if pruned and cls._member_size is None:
+            cls._member_size = cls._estimate_member_size(pruned[:100])
+        for member in pruned:
+            guild._remove_member(member)
+        cls._pruned_ids.setdefault(guild.id, set()).update(member.id for member in pruned)
+        cls._pruned += len(pruned)
+        Metrics.incr("member_cache_pruned", len(pruned))
+        return len(pruned)
+
+    @classmethod
+    async def _prune_loop(cls) -> None:
+        while True:
+            await asyncio.sleep(cls.prune_interval)
+            retained = cls._retained_ids()
+            pruned = sum(cls.prune(guild, set(retained)) for guild in cls._bot.guilds)
+            logging.info(f"[MemberCache] {pruned} members pruned from the cache")
+
+    @staticmethod
+    def _size(obj: object, skip=("guild", "_state", "_user")) -> int:
+        size = sys.getsizeof(obj)
+        for klass in type(obj).__mro__:
+            for slot in getattr(klass, "__slots__", ()):
+                if slot not in skip and hasattr(obj, slot):
+                    size += sys.getsizeof(getattr(obj, slot))
+        return size
+
+    @classmethod
+    def _estimate_member_size(cls, members: List[disnake.Member]) -> int:
+        """Estimate the memory used by a cached member and its user, from their attributes and the dict entries."""
+        dict_entries = 2 * 3 * sys.getsizeof(0)  # Entry in the members of the guild and in the users of the bot
+        return sum(cls._size(member) + cls._size(member._user) + dict_entries for member in members) // len(members)
+
+    @classmethod
+    def _saved_bytes(cls) -> int:
+        if cls._bot is None or cls._member_size is None:
+            return 0
+        not_cached = sum(max(0, (guild.member_count or 0) - len(guild.members)) for guild in cls._bot.guilds)
+        return not_cached * cls._member_size
+
+    @classmethod
+    def report(cls, bot) -> str:
+        """Get the state of the cache and an estimation of the memory saved by the policy.
+
+        Parameters
+        ----------
+        bot : `Bot`
+            The bot
+
+        Returns
+        -------
+        `str`
+            The report
+        """
+        if not cls.enabled():
+            return "Tous les membres sont en cache (MEMBER_CACHE non défini)."
+        cached = sum(len(guild.members) for guild in bot.guilds)
+        total = sum(guild.member_count or 0 for guild in bot.guilds)
+        saved = cls._saved_bytes() / 2**20
+        return (
+            f"{cached}/{total} membres en cache, {cls._pruned} retirés depuis le démarrage.\n"
+            + f"~{saved:.1f} MiB économisés (~{cls._member_size or 0} octets par membre)."
+        )
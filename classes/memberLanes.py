@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import functools
+from collections import deque
+from typing import Any
+from typing import Callable
+from typing import Coroutine
+from typing import Dict
+from typing import Hashable
+
+import disnake
+
+from bot import Metrics
+from bot import TaskRegistry
+
+
+class _Op:
+    __slots__ = ("func", "future", "callers", "task")
+
+    def __init__(self) -> None:
+        self.func: Callable[[], Coroutine] = None
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.callers: int = 0
+        self.task: asyncio.Task = None
+
+
+class _Lane:
+    __slots__ = ("task", "queued")
+
+    def __init__(self) -> None:
+        self.task: asyncio.Task = None
+        self.queued: "deque[_Op]" = deque()
+
+
+class MemberLanesInstantiationError(Exception):
+    """The Exception to be raise when the MemberLanes class is instantiated."""
+
+    def __init__(self, *args: object) -> None:
+        super().__init__("The MemberLanes class cannot be instantiated, but only used as a class.")
+
+
+class MemberLanes:
+    """Represent the lanes serializing the edits of the members and the bulk updates of the guilds.
+
+    Each (guild, member) has a lane running one operation at a time, the others queued behind it. A new operation
+    replaces the last queued one if it is of the same kind (the same function), which is superseded: its callers get the
+    result of the new one. Else it is queued after it, so a removal asked for is never dropped by an update. So a member
+    updated many times by the sweeps and the events while an edit runs is edited at most twice, and never by an outdated
+    operation after a newer one.
+
+    Each guild has a lane too, for the bulk updates (sweeps, `/setup`, role change...), with the same rules. The bulk
+    updates of a guild run one at a time, and their member edits go through the member lanes. Unlike a member edit, a
+    bulk update is cancelled (queued or running) when all its callers are cancelled, so a cancelled sweep stops editing
+    the members of its guilds.
+
+    The lanes run in tasks of the `TaskRegistry`, drained on shutdown.
+
+    This class is only used as a class and should not be instantiated
+
+    Classmethods
+    ------------
+    member(member: `disnake.Member`, op: `Callable[[], Coroutine]`): `coro`
+        Run an edit of a member in its lane
+    guild(guild: `disnake.Guild`, op: `Callable[[], Coroutine]`): `coro`
+        Run a bulk update of a guild in its lane
+    """
+
+    _members: Dict[Hashable, _Lane] = {}
+    _guilds: Dict[Hashable, _Lane] = {}
+    _metrics: bool = False
+
+    def __init__(self) -> None:
+        raise MemberLanesInstantiationError
+
+    @classmethod
+    async def member(cls, member: disnake.Member, op: Callable[[], Coroutine]) -> Any:
+        """Run an edit of a member after the one running for this member, superseding the one queued.
+
+        Parameters
+        ----------
+        member : `disnake.Member`
+            The member
+        op : `Callable[[], Coroutine]`
+            The coroutine function editing the member, only called if not superseded
+
+        Returns
+        -------
+        `Any`
+            The result of the operation, or of the one of the same kind that superseded it
+        """
+        return await asyncio.shield(cls._submit(cls._members, (member.guild.id, member.id), op, "member").future)
+
+    @classmethod
+    async def guild(cls, guild: disnake.Guild, op: Callable[[], Coroutine]) -> Any:
+        """Run a bulk update of a guild after the one running for this guild, superseding the one queued. The update is
+        cancelled if all its callers are cancelled.
+
+        Parameters
+        ----------
+        guild : `disnake.Guild`
+            The guild
+        op : `Callable[[], Coroutine]`
+            The coroutine function updating the guild, only called if not superseded
+
+        Returns
+        -------
+        `Any`
+            The result of the operation, or of the one of the same kind that superseded it
+        """
+        lane_op = cls._submit(cls._guilds, guild.id, op, "guild")
+        try:
+            return await asyncio.shield(lane_op.future)
+        except asyncio.CancelledError:
+            lane_op.callers -= 1
+            if lane_op.callers == 0:
+                cls._abandon(cls._guilds.get(guild.id), lane_op)
+            raise
+
+    @classmethod
+    def _submit(cls, lanes: Dict[Hashable, _Lane], key: Hashable, op: Callable[[], Coroutine], kind: str) -> _Op:
+        if not cls._metrics:
+            Metrics.gauge_callback("lanes_active", lambda: len(cls._members), lane="member")
+            Metrics.gauge_callback("lanes_active", lambda: len(cls._guilds), lane="guild")
+            cls._metrics = True
+        lane = lanes.get(key)
+        if lane is None:
+            lane = lanes[key] = _Lane()
+        if lane.queued and cls._kind(lane.queued[-1].func) == cls._kind(op):
+            Metrics.incr("lane_ops", lane=kind, outcome="superseded")
+        else:
+            lane.queued.append(_Op())
+        lane_op = lane.queued[-1]
+        lane_op.func = op
+        lane_op.callers += 1
+        if lane.task is None:
+            lane.task = TaskRegistry.spawn(cls._run(lanes, key, lane, kind), kind)
+        return lane_op
+
+    @staticmethod
+    def _kind(op: Callable[[], Coroutine]) -> Any:
+        """Get the code run by an operation, unwrapping the `functools.partial`."""
+        while isinstance(op, functools.partial):
+            op = op.func
+        return getattr(op, "__code__", op)
+
+    @staticmethod
+    def _abandon(lane: _Lane, op: _Op) -> None:
+        """Cancel an operation without callers anymore, whether it is queued or running."""
+        if lane is not None and op in lane.queued:
+            lane.queued.remove(op)
+            op.future.cancel()
+        elif op.task is not None:
+            op.task.cancel()
+
+    @staticmethod
+    async def _run(lanes: Dict[Hashable, _Lane], key: Hashable, lane: _Lane, kind: str) -> None:
+        try:
+            while lane.queued:
+                op = lane.queued.popleft()
+                op.task = TaskRegistry.spawn(op.func(), kind)
+                try:
+                    await asyncio.wait([op.task])
+                except asyncio.CancelledError:
+                    op.task.cancel()
+                    op.future.cancel()
+                    raise
+                if op.task.cancelled():
+                    op.future.cancel()
+                    Metrics.incr("lane_ops", lane=kind, outcome="cancelled")
+                    continue
+                if op.task.exception() is not None:
+                    op.future.set_exception(op.task.exception())
+                else:
+                    op.future.set_result(op.task.result())
+                Metrics.incr("lane_ops", lane=kind, outcome="run")
+        finally:
+            del lanes[key]
+            for op in lane.queued:
+                op.future.cancel()
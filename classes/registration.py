@@ -1,13 +1,15 @@
 # -*- coding: utf-8 -*-
 import asyncio
+import hashlib
+import hmac
 import logging
 import os
 import secrets
-import smtplib
-from datetime import datetime
+import sys
+import time
 from typing import Coroutine
-from typing import Dict
 from typing import List
+from typing import Set
 from typing import Tuple
 
 import disnake
@@ -17,9 +19,25 @@ from .database import Database
 from .database import DatabaseNotLoadedError
 from .database import UlbGuild
 from .email import EmailManager
+from .memberCache import MemberCache
+from .registrationStore import RegistrationStep
+from .registrationStore import RegistrationStore
+from .registrationStore import StoredRegistration
 from .utils import remove_user
 from .utils import update_user
 from bot import Bot
+from bot import Cluster
+from bot import lazy_import
+from bot import Metrics
+from bot import Priority
+from bot import Readiness
+from bot import Scheduler
+from bot import SessionTable
+from bot import SessionTableFullError
+from bot import Stage
+from bot import TaskRegistry
+
+smtplib = lazy_import("smtplib")
 
 
 class RegistrationNotSetError(Exception):
@@ -50,8 +68,16 @@ class CallbackModal(disnake.ui.Modal):
         The corountine to be call as interaction callback. The coroutine only arg should be `disnake.ModalInteraction`.
     """
 
-    def __init__(self, *, title: str, components: disnake.Component, timeout: float = 600, callback: Coroutine) -> None:
-        super().__init__(title=title, components=components, timeout=timeout)
+    def __init__(
+        self,
+        *,
+        title: str,
+        components: disnake.Component,
+        custom_id: str = disnake.utils.MISSING,
+        timeout: float = 600,
+        callback: Coroutine,
+    ) -> None:
+        super().__init__(title=title, components=components, custom_id=custom_id, timeout=timeout)
         self.callback_coro = callback
 
     async def callback(self, interaction: disnake.ModalInteraction, /) -> None:
@@ -64,10 +90,14 @@ class Registration:
 
     Classmethods
     ------------
+    preload(): `func`
+        Load the local store, keeping the users of the stored registrations in the member cache until restored.
     setup(cog: `Ulb`): `func`
         Setup the Registration class. This need to be call before any instantiation
     new(inter: `disnake.ApplicationCommandInteraction,` target: `Optional[disnake.User]`): `coro`
         Create and start a new registration.
+    dispatch_modal(inter: `disnake.ModalInteraction`): `coro`
+        Dispatch a modal submitted to a registration restored from the local store.
     """
 
     # Config params
@@ -76,15 +106,44 @@ class Registration:
     token_validity_time = 60 * 10  # In sec
     token_nbr_try = 5
     user_timeout_time = 60 * 10  # In sec
+    max_sessions = int(os.getenv("REGISTRATION_MAX_SESSIONS") or 10_000)
+    session_ttl = float(os.getenv("REGISTRATION_SESSION_TTL") or 60 * 30)  # In sec
 
     # Class params
     _title = "Vérification de l'identité"
     _color = disnake.Colour.dark_blue()
     _contact_user: disnake.User = None
     _set = False
-
-    _current_registrations: Dict[disnake.User, "Registration"] = {}
-    _users_timeout: Dict[disnake.User, datetime] = {}
+    _custom_id_prefix = "ulb-registration"
+    _stored_ids: Set[int] = set()
+
+    # Pending registrations, evicted when abandoned for `session_ttl` or when there are more than `max_sessions`. A
+    # registration which has reached the token step (an email has been sent) is never evicted for a new one.
+    _current_registrations: SessionTable = SessionTable(
+        "registrations",
+        max_size=max_sessions,
+        ttl=session_ttl,
+        on_evict=lambda user, registration, reason: registration._evict(reason),
+        sizeof=lambda registration: registration._sizeof(),
+        evictable=lambda registration: registration.step
+        not in (RegistrationStep.token, RegistrationStep.token_timeout),
+    )
+    # Users timed out after too many invalid tokens, until the end of their timeout. A user evicted because the table is
+    # full is still timed out by the local store.
+    _users_timeout: SessionTable = SessionTable(
+        "users_timeout",
+        max_size=max_sessions,
+        ttl=user_timeout_time,
+        on_evict=lambda user, until, reason: RegistrationStore.delete_timeout(user.id) if reason == "expired" else None,
+    )
+
+    # UI prototypes, shared by all the registrations. They should never be edited, but copied first.
+    _registration_embed: disnake.Embed = None
+    _verification_embed: disnake.Embed = None
+    _token_verification_embed: disnake.Embed = None
+    _token_timeout_embed: disnake.Embed = None
+    _email_input: disnake.ui.TextInput = None
+    _token_input: disnake.ui.TextInput = None
 
     @property
     def set(cls) -> bool:
@@ -95,10 +154,46 @@ class Registration:
         return [reg.email for reg in self._current_registrations.values()]
 
     @classmethod
-    async def _timeout_user(cls, user: disnake.User) -> None:
-        cls._users_timeout[user] = datetime.now()
-        await asyncio.sleep(cls.user_timeout_time)
-        cls._users_timeout.pop(user)
+    def _timeout_user(cls, user: disnake.User, until: float = None) -> None:
+        if until is None:
+            until = time.time() + cls.user_timeout_time
+            RegistrationStore.save_timeout(user.id, until)
+        cls._users_timeout.set(user, until, ttl=until - time.time())
+
+    @classmethod
+    def _registering_ids(cls) -> List[int]:
+        return [user.id for user in cls._current_registrations] + list(cls._stored_ids)
+
+    @classmethod
+    def preload(cls) -> None:
+        """Load the local store before the members are cached, so that the users of the stored registrations and
+        timeouts are kept in the member cache until they are restored by `setup()`."""
+        RegistrationStore.load()
+        cls._stored_ids = RegistrationStore.user_ids()
+        MemberCache.retain(cls._registering_ids)
+
+    @classmethod
+    async def _on_event(cls, event: dict) -> None:
+        """Cancel the pending registration of a user who started a new one on another node of the cluster."""
+        if event["op"] != "started":
+            return
+        pending_registration = next(
+            (reg for user, reg in cls._current_registrations.items() if user.id == event["user_id"]), None
+        )
+        if pending_registration:
+            logging.info(f"[RegistrationForm] [User:{event['user_id']}] Registration restarted on another node.")
+            cls._outcome("restarted")
+            cls._current_registrations.pop(pending_registration.target)
+            await pending_registration._cancel()
+
+    @classmethod
+    def _checkpoint(cls) -> str:
+        """The pending registrations are saved in the store at each step, and restored at startup."""
+        return f"registrations: {len(cls._current_registrations)} pending, restored at startup"
+
+    @staticmethod
+    def _hash_token(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
 
     @classmethod
     def setup(cls, cog: commands.Cog) -> None:
@@ -114,10 +209,120 @@ class Registration:
         `DatabaseNotLoadedError`
             Raise if the Database has not been load.
         """
-        if Database.loaded == False:
+        if not Readiness.is_set(Stage.storage):
             raise DatabaseNotLoadedError
         cls._contact_user = cog.bot.get_user(int(os.getenv("CONTACT_USER_ID")))
+        cls._build_prototypes()
+        RegistrationStore.load()
+        cls._restore(cog.bot)
+        Cluster.subscribe("registration", cls._on_event)
+        MemberCache.retain(cls._registering_ids)
+        Metrics.gauge_callback("registration_pending", lambda: len(cls._current_registrations))
+        Metrics.gauge_callback("registration_users_timeout", lambda: len(cls._users_timeout))
+        Metrics.gauge_callback("email_in_flight", lambda: EmailManager.in_flight)
+        TaskRegistry.checkpoint(cls._checkpoint)
         cls.set = True
+        Readiness.set(Stage.registration)
+
+    @classmethod
+    def _build_prototypes(cls) -> None:
+        """Create the UI elements shared by all the registrations."""
+        cls._registration_embed = disnake.Embed(
+            title=cls._title,
+            description="> Ce serveur est réservé aux étudiant.e.s de l'ULB.\n> Pour accéder à ce serveur, tu dois vérifier ton identité avec ton addresse email **ULB**.",
+            color=cls._color,
+        ).set_thumbnail(Bot.ULB_image)
+        cls._verification_embed = disnake.Embed(
+            title=cls._title, description=f"Vérification en cours...", color=cls._color
+        ).set_thumbnail(url=Bot.ULB_image)
+        cls._token_verification_embed = (
+            disnake.Embed(title=cls._title, color=cls._color)
+            .set_thumbnail(url=Bot.ULB_image)
+            .set_footer(text=f"""Le token est valide pendant {cls.token_validity_time//60} minutes.""")
+        )
+        cls._token_timeout_embed = disnake.Embed(
+            title=cls._title,
+            description="""⚠️ Le token à expiré.\nDemandez un nouveau token ci-dessous.""",
+            color=disnake.Colour.orange(),
+        ).set_thumbnail(url=Bot.ULB_image)
+        cls._email_input = disnake.ui.TextInput(
+            label="Addresse email ULB (@ulb.be) :",
+            custom_id="email",
+            placeholder="ex : theodore.verhaegen@ulb.be",
+        )
+        cls._token_input = disnake.ui.TextInput(
+            label=f"Entre ton token de vérification",
+            custom_id="token",
+            placeholder=f"Token de {cls.token_size} caractères",
+            min_length=cls.token_size,
+            max_length=cls.token_size,
+        )
+
+    @classmethod
+    def _restore(cls, bot: Bot) -> None:
+        """Restore the pending registrations and the users timeouts saved in the local store.
+
+        A persistent view is added for each pending registration so that the buttons of the messages sent before a restart still work.
+
+        Parameters
+        ----------
+        bot : `Bot`
+            The bot
+        """
+        for user_id, until in RegistrationStore.timeouts().items():
+            user = bot.get_user(user_id)
+            if user:
+                cls._timeout_user(user, until)
+
+        for stored in RegistrationStore.registrations():
+            user = bot.get_user(stored.user_id)
+            if not user and Cluster.enabled():
+                continue  # Registration of a user only seen by another node of the cluster
+            if not user or user in Database.ulb_users.keys():
+                RegistrationStore.delete_registration(stored.user_id)
+                continue
+            registration = cls(user)
+            registration.step = stored.step
+            registration.email = stored.email
+            registration.token_hash = stored.token_hash
+            registration.token_expiry = stored.token_expiry
+            registration.nbr_try = stored.nbr_try
+            registration._restored = True
+            if stored.step == RegistrationStep.registration:
+                registration._build_registration_ui(timeout=None)
+                bot.add_view(registration.registration_view)
+            else:
+                registration._build_token_verification_ui(timeout=None)
+                registration._build_token_timeout_ui(timeout=None)
+                bot.add_view(registration.token_verification_view)
+                bot.add_view(registration.token_timeout_view)
+                if stored.step == RegistrationStep.token:
+                    registration._token_task = asyncio.create_task(registration._token_timeout_task(None))
+            cls._current_registrations[user] = registration
+            logging.trace("[RegistrationForm] [User:%s] Registration restored at step %s", user.id, stored.step)
+        cls._stored_ids = set()
+        logging.info(f"[RegistrationForm] {len(cls._current_registrations)} pending registrations restored.")
+
+    @classmethod
+    async def dispatch_modal(cls, inter: disnake.ModalInteraction) -> None:
+        """Dispatch a modal submitted to a registration restored from the local store.
+
+        Modals sent before a restart are not known by the bot anymore, so their submission only trigger the `on_modal_submit` event.
+
+        Parameters
+        ----------
+        inter : `disnake.ModalInteraction`
+            The modal interaction
+        """
+        if not inter.custom_id.startswith(cls._custom_id_prefix):
+            return
+        registration = cls._current_registrations.get(inter.author)
+        if registration is None or not registration._restored:
+            return
+        if inter.custom_id == registration._custom_id("email"):
+            await registration._callback_info_modal(inter)
+        elif inter.custom_id == registration._custom_id("token"):
+            await registration._callback_token_verification_modal(inter)
 
     @classmethod
     async def new(cls, inter: disnake.ApplicationCommandInteraction, target: disnake.User = None) -> None:
@@ -141,11 +346,16 @@ class Registration:
         if not target:
             target = inter.author
 
-        if target in cls._users_timeout.keys():
+        remaining = cls._users_timeout.remaining(target)
+        if remaining is None:
+            until = RegistrationStore.timeout(target.id)  # Timed out on another node, or evicted
+            if until is not None:
+                remaining = until - time.time()
+        if remaining is not None:
             await inter.edit_original_response(
                 embed=disnake.Embed(
                     title=cls._title,
-                    description=f"Vous avez récement dépassé le nombre de tentatives de vérification de votre adresse email.\nVous pourrez à nouveau essayer dans {(cls.user_timeout_time - (cls._users_timeout.get(target).second - datetime.now().second))//60} minutes.",
+                    description=f"Vous avez récement dépassé le nombre de tentatives de vérification de votre adresse email.\nVous pourrez à nouveau essayer dans {int(remaining)//60 + 1} minutes.",
                     color=disnake.Colour.orange(),
                 ).set_thumbnail(Bot.ULB_image)
             )
@@ -156,13 +366,50 @@ class Registration:
 
     def __init__(self, target: disnake.User) -> None:
         self.target = target
+        self.step: str = None
         self.email: str = None
         self.name: str = None
-        self.token: str = None
+        self.token_hash: str = None
+        self.token_expiry: float = None
         self.msg: disnake.Message = None
         self.nbr_try: int = 0
         self._token_task = None
+        self._restored = False
+        self._evicted = False
+        self._last_transition: Tuple[str, float] = None
+
+    def _transition(self, step: str) -> None:
+        """Count a step of the registration funnel and record the time elapsed since the previous one.
+
+        Parameters
+        ----------
+        step : `str`
+            The step reached
+        """
+        now = time.monotonic()
+        Metrics.incr("registration_steps", step=step)
+        if self._last_transition is not None:
+            previous, since = self._last_transition
+            Metrics.observe("registration_transition_seconds", now - since, source=previous, target=step)
+        self._last_transition = (step, now)
+
+    @staticmethod
+    def _outcome(outcome: str) -> None:
+        """Count how a registration attempt ended or failed."""
+        Metrics.incr("registration_outcomes", outcome=outcome)
+
+    def _custom_id(self, name: str) -> str:
+        """Build the deterministic custom_id of a component of this registration."""
+        return f"{self._custom_id_prefix}:{name}:{self.target.id}"
+
+    def _save(self) -> None:
+        """Save the current state of the registration in the local store."""
+        self._current_registrations.touch(self.target)
+        RegistrationStore.save_registration(
+            StoredRegistration(self.target.id, self.step, self.email, self.token_hash, self.token_expiry, self.nbr_try)
+        )
 
+    @Metrics.timed("registration_handler_seconds", handler="start")
     async def _start(self, inter: disnake.ApplicationCommandInteraction) -> None:
         """Start a registration.
 
@@ -180,6 +427,7 @@ class Registration:
         # Already registered
         if ulb_user:
             logging.info(f"[RegistrationForm] [User:{self.target.id}] Refused because user already registered.")
+            self._outcome("already_registered")
             await inter.edit_original_message(
                 embed=disnake.Embed(
                     title=self._title,
@@ -193,10 +441,27 @@ class Registration:
         pending_registration = self._current_registrations.get(self.target)
         if pending_registration:
             logging.info(f"[RegistrationForm] [User:{self.target.id}] Previous registration process cancelled.")
+            self._outcome("restarted")
             await pending_registration._cancel()
-        self._current_registrations[self.target] = self
+        try:
+            self._current_registrations[self.target] = self
+        except SessionTableFullError:
+            logging.warning(
+                f"[RegistrationForm] [User:{self.target.id}] Refused because too many pending registrations."
+            )
+            self._outcome("full")
+            await inter.edit_original_message(
+                embed=disnake.Embed(
+                    title=self._title,
+                    description="⏳ Trop de vérifications sont en cours en ce moment. Réessaye dans quelques minutes.",
+                    color=disnake.Colour.orange(),
+                ).set_thumbnail(Bot.ULB_image)
+            )
+            return
+        Cluster.publish("registration", {"op": "started", "user_id": self.target.id})
 
         logging.info(f"[RegistrationForm] [User:{self.target.id}] Registration started")
+        self._transition("start")
         await self._start_registration_step(inter)
 
     async def _start_registration_step(self, inter: disnake.ApplicationCommandInteraction) -> None:
@@ -207,38 +472,36 @@ class Registration:
         inter : `disnake.ApplicationCommandInteraction`
             The slash command interaction that trigger the step
         """
-        # Create UI elements for registration
-        self.registration_embed = disnake.Embed(
-            title=self._title,
-            description="> Ce serveur est réservé aux étudiant.e.s de l'ULB.\n> Pour accéder à ce serveur, tu dois vérifier ton identité avec ton addresse email **ULB**.",
-            color=self._color,
-        ).set_thumbnail(Bot.ULB_image)
-        self.registration_view = disnake.ui.View()
+        self._build_registration_ui()
+        self.step = RegistrationStep.registration
+        self._save()
+
+        # Send the message with button
+        self.msg = await inter.edit_original_message(embed=self._registration_embed, view=self.registration_view)
+        logging.trace("[RegistrationForm] [User:%s] Registration view sent", self.target.id)
+
+    def _build_registration_ui(self, timeout: float = 180) -> None:
+        """Create the UI elements of the registration step.
+
+        Parameters
+        ----------
+        timeout : `Optional[float]`
+            The timeout of the view. `None` for a persistent view.
+        """
+        self.registration_view = disnake.ui.View(timeout=timeout)
         self.registration_button = disnake.ui.Button(
-            label="Vérifier son identité", emoji="📧", style=disnake.ButtonStyle.primary
+            label="Vérifier son identité",
+            emoji="📧",
+            style=disnake.ButtonStyle.primary,
+            custom_id=self._custom_id("register"),
         )
         self.registration_button.callback = self._callback_registration_button
         self.registration_view.add_item(self.registration_button)
-        self.registration_view.on_timeout = self._stop
-        self.info_modal = CallbackModal(
-            title=self._title,
-            timeout=60 * 5,
-            components=[
-                disnake.ui.TextInput(
-                    label="Addresse email ULB (@ulb.be) :",
-                    custom_id="email",
-                    placeholder="ex : theodore.verhaegen@ulb.be",
-                ),
-            ],
-            callback=self._callback_info_modal,
-        )
-        self.verification_embed = disnake.Embed(
-            title=self._title, description=f"Vérification en cours...", color=self._color
-        ).set_thumbnail(url=Bot.ULB_image)
+        self.registration_view.on_timeout = self._on_view_timeout
 
-        # Send the message with button
-        self.msg = await inter.edit_original_message(embed=self.registration_embed, view=self.registration_view)
-        logging.trace(f"[RegistrationForm] [User:{self.target.id}] Registration view sent")
+    async def _on_view_timeout(self) -> None:
+        self._outcome("abandoned")
+        await self._stop()
 
     async def _callback_registration_button(self, inter: disnake.MessageInteraction) -> None:
         """Send the registration modal when the registration button is triggered
@@ -248,10 +511,22 @@ class Registration:
         inter : `disnake.MessageInteraction`
             The button interaction
         """
+        if await self._answer_evicted(inter):
+            return
         self.registration_button.disabled = True
-        await inter.response.send_modal(self.info_modal)
-        logging.trace(f"[RegistrationForm] [User:{self.target.id}] Registration modal sent")
+        self._restored = False
+        self._current_registrations.touch(self.target)
+        info_modal = CallbackModal(
+            title=self._title,
+            timeout=60 * 5,
+            custom_id=self._custom_id("email"),
+            components=[self._email_input],
+            callback=self._callback_info_modal,
+        )
+        await inter.response.send_modal(info_modal)
+        logging.trace("[RegistrationForm] [User:%s] Registration modal sent", self.target.id)
 
+    @Metrics.timed("registration_handler_seconds", handler="info_modal")
     async def _callback_info_modal(self, inter: disnake.ModalInteraction) -> None:
         """Check the validity of the email provided to the modal.
 
@@ -266,12 +541,17 @@ class Registration:
         inter : `disnake.ModalInteraction`
             The modal interaction
         """
-        self.msg = await inter.response.edit_message(embed=self.verification_embed, view=self.registration_view)
+        if await self._answer_evicted(inter):
+            return
+        self.msg = await inter.response.edit_message(embed=self._verification_embed, view=self.registration_view)
         logging.trace(
-            f"[RegistrationForm] [User:{self.target.id}] Registration modal callback with email={inter.text_values.get('email')}"
+            "[RegistrationForm] [User:%s] Registration modal callback with email=%s",
+            self.target.id,
+            inter.text_values.get("email"),
         )
 
         self.email = inter.text_values.get("email")
+        self._transition("email_submitted")
 
         # Check email format validity
         splited_mail: List[str] = self.email.split("@")
@@ -282,51 +562,54 @@ class Registration:
             or len(splited_mail[1].split(".")[0]) == 0
             or splited_mail[1].split(".")[1] == 0
         ):
-            logging.trace(f"[RegistrationForm] [User:{self.target.id}] Format not valid.")
+            logging.trace("[RegistrationForm] [User:%s] Format not valid.", self.target.id)
+            self._outcome("invalid_format")
             self.registration_button.disabled = False
-            self.registration_embed.clear_fields()
-            self.registration_embed.add_field(
+            embed = self._registration_embed.copy().add_field(
                 f"⚠️ Format incorrect",
                 value=f"**{self.email}** n'est pas une adresse email valide.\nVérifie l'adresse email et réessaye.",
             )
-            self.msg = await inter.edit_original_message(embed=self.registration_embed, view=self.registration_view)
+            self.msg = await inter.edit_original_message(embed=embed, view=self.registration_view)
             return
 
         # Check email domain validity
         if splited_mail[1] not in self.email_domains:
-            logging.trace(f"[RegistrationForm] [User:{self.target.id}] Domain not valid.")
+            logging.trace("[RegistrationForm] [User:%s] Domain not valid.", self.target.id)
+            self._outcome("invalid_domain")
             self.registration_button.disabled = False
-            self.registration_embed.clear_fields()
-            self.registration_embed.add_field(
+            embed = self._registration_embed.copy().add_field(
                 f"⚠️ Domaine incorrect",
                 value=f"**{self.email}** n'est pas une adresse email officielle **ULB**.\nUtilise ton adresse email **@ulb.be**.",
             )
-            self.msg = await inter.edit_original_message(embed=self.registration_embed, view=self.registration_view)
+            self.msg = await inter.edit_original_message(embed=embed, view=self.registration_view)
             return
 
         # Check email availablility from registered users
         for user_data in Database.ulb_users.values():
             if user_data.email == self.email:
-                logging.trace(f"[RegistrationForm] [User:{self.target.id}] End because email not available")
-                self.registration_embed.clear_fields()
-                self.registration_embed.colour = disnake.Colour.red()
-                self.registration_embed.remove_footer().add_field(
+                logging.trace("[RegistrationForm] [User:%s] End because email not available", self.target.id)
+                self._outcome("email_unavailable")
+                embed = self._registration_embed.copy()
+                embed.colour = disnake.Colour.red()
+                embed.add_field(
                     f"⛔ Adresse email non disponible",
                     value=f"**{self.email}** est déjà associée à un.e autre utilisateur.rice discord.\nSi cette adresse email est bien la tienne et que quelqu'un a eu accès à ta boite mail pour se faire passer pour toi, envoie un message à {self._contact_user.mention if self._contact_user else 'un.e administrateur.rice du serveur.'}.",
                 )
-                await inter.edit_original_message(embed=self.registration_embed, view=None)
+                await inter.edit_original_message(embed=embed, view=None)
                 await self._stop()
                 return
 
         # Valid and available
-        logging.trace(f"[RegistrationForm] [User:{self.target.id}] Email valid and available.")
+        logging.trace("[RegistrationForm] [User:%s] Email valid and available.", self.target.id)
         await self._start_token_verification_step(inter)
 
     async def _token_timeout_task(self, inter: disnake.ApplicationCommandInteraction):
-        await asyncio.sleep(self.token_validity_time)
+        await asyncio.sleep(max(self.token_expiry - time.time(), 0))
         logging.info(f"[RegistrationForm] [User:{self.target.id}] Token timeout.")
+        self._outcome("token_timeout")
         await self._start_token_timeout_step(inter)
 
+    @Metrics.timed("registration_handler_seconds", handler="token_verification")
     async def _start_token_verification_step(self, inter: disnake.ModalInteraction) -> None:
         """Start the token verification step by creating the necessary UI elements and send it to the user.
 
@@ -337,36 +620,9 @@ class Registration:
         inter : `disnake.ModalInteraction`
             The modal interaction that trigger the step
         """
-        # Create UI elements for the token verification
-        self.token_verification_embed = (
-            disnake.Embed(
-                title=self._title,
-                description=f"""Un token a été envoyé à l'addresse email ***{self.email}***.""",
-                color=self._color,
-            )
-            .set_thumbnail(url=Bot.ULB_image)
-            .set_footer(text=f"""Le token est valide pendant {self.token_validity_time//60} minutes.""")
-        )
-        self.token_verification_view = disnake.ui.View()
-        self.token_verification_button = disnake.ui.Button(
-            label="Entrer le token", emoji="📧", style=disnake.ButtonStyle.primary
-        )
-        self.token_verification_button.callback = self._callback_token_verification_button
-        self.token_verification_view.add_item(self.token_verification_button)
-        self.token_verification_modal = CallbackModal(
-            title=self._title,
-            timeout=60 * 5,
-            components=[
-                disnake.ui.TextInput(
-                    label=f"Entre ton token de vérification",
-                    custom_id="token",
-                    placeholder=f"Token de {self.token_size} caractères",
-                    min_length=self.token_size,
-                    max_length=self.token_size,
-                )
-            ],
-            callback=self._callback_token_verification_modal,
-        )
+        if await self._answer_evicted(inter):
+            return
+        self._build_token_verification_ui()
 
         # Send token verification message en button
         if not inter.response.is_done():
@@ -377,12 +633,20 @@ class Registration:
             self.msg = await inter.edit_original_message(
                 embed=self.token_verification_embed, view=self.token_verification_view
             )
-        logging.trace(f"[RegistrationForm] [User:{self.target.id}] Token view sent.")
-        self.token = secrets.token_hex(self.token_size)[: self.token_size]
-        logging.trace(f"[RegistrationForm] [User:{self.target.id}] Token generated.")
+        logging.trace("[RegistrationForm] [User:%s] Token view sent.", self.target.id)
+        token = secrets.token_hex(self.token_size)[: self.token_size]
+        self.token_hash = self._hash_token(token)
+        self.token_expiry = time.time() + self.token_validity_time
+        self.step = RegistrationStep.token
+        self._save()
+        logging.trace("[RegistrationForm] [User:%s] Token generated.", self.target.id)
         try:
-            EmailManager.send_token(self.email, self.token)
-        except smtplib.SMTPSenderRefused as ex:
+            start = time.perf_counter()
+            sent = await EmailManager.send(self.email, token)
+            if sent:
+                Metrics.observe("email_send_seconds", time.perf_counter() - start)
+        except smtplib.SMTPRecipientsRefused as ex:
+            self._outcome("email_error")
             logging.error(
                 f"[EMAIL] {type(ex).__name__} occured during token email sending for email={self.email}: {ex}"
             )
@@ -394,25 +658,66 @@ class Registration:
                 view=None,
             )
             await self._stop()
+            return
+        if not sent:
+            logging.info(f"[RegistrationForm] [User:{self.target.id}] Token email delayed, the SMTP server is down.")
+            await inter.edit_original_response(
+                embed=self.token_verification_embed.add_field(
+                    name="⏳",
+                    value="L'envoi des emails est ralenti en ce moment, le token arrivera d'ici quelques minutes. Si le token expire avant, demandes-en un nouveau.",
+                )
+            )
 
+        self._transition("email_sent")
         self._token_task = asyncio.create_task(self._token_timeout_task(inter))
 
-    async def _start_token_timeout_step(self, inter: disnake.ApplicationCommandInteraction) -> None:
+    def _build_token_verification_ui(self, timeout: float = 180) -> None:
+        """Create the UI elements of the token verification step.
 
-        # Create UI elements for the token timeout step
-        self.token_timeout_embed = disnake.Embed(
-            title=self._title,
-            description="""⚠️ Le token à expiré.\nDemandez un nouveau token ci-dessous.""",
-            color=disnake.Colour.orange(),
-        ).set_thumbnail(url=Bot.ULB_image)
-        self.token_timeout_view = disnake.ui.View()
+        Parameters
+        ----------
+        timeout : `Optional[float]`
+            The timeout of the view. `None` for a persistent view.
+        """
+        self.token_verification_embed = self._token_verification_embed.copy()
+        self.token_verification_embed.description = f"""Un token a été envoyé à l'addresse email ***{self.email}***."""
+        self.token_verification_view = disnake.ui.View(timeout=timeout)
+        self.token_verification_button = disnake.ui.Button(
+            label="Entrer le token", emoji="📧", style=disnake.ButtonStyle.primary, custom_id=self._custom_id("enter")
+        )
+        self.token_verification_button.callback = self._callback_token_verification_button
+        self.token_verification_view.add_item(self.token_verification_button)
+
+    def _build_token_timeout_ui(self, timeout: float = 180) -> None:
+        """Create the UI elements of the token timeout step.
+
+        Parameters
+        ----------
+        timeout : `Optional[float]`
+            The timeout of the view. `None` for a persistent view.
+        """
+        self.token_timeout_view = disnake.ui.View(timeout=timeout)
         self.token_timeout_button = disnake.ui.Button(
-            label="Renvoyer un token", emoji="📧", style=disnake.ButtonStyle.primary
+            label="Renvoyer un token", emoji="📧", style=disnake.ButtonStyle.primary, custom_id=self._custom_id("resend")
         )
         self.token_timeout_button.callback = self._start_token_verification_step
         self.token_timeout_view.add_item(self.token_timeout_button)
 
-        self.msg = await inter.edit_original_response(embed=self.token_timeout_embed, view=self.token_timeout_view)
+    async def _start_token_timeout_step(self, inter: disnake.ApplicationCommandInteraction = None) -> None:
+        """Invalidate the token and ask the user to request a new one.
+
+        Parameters
+        ----------
+        inter : `Optional[disnake.ApplicationCommandInteraction]`
+            The interaction to edit. If `None` (restored registration), the user is only notified on its next interaction.
+        """
+        self.token_hash = None
+        self.step = RegistrationStep.token_timeout
+        self._save()
+        self._build_token_timeout_ui()
+
+        if inter is not None:
+            self.msg = await inter.edit_original_response(embed=self._token_timeout_embed, view=self.token_timeout_view)
 
     async def _callback_token_verification_button(self, inter: disnake.MessageInteraction) -> None:
         """Send the token modal.
@@ -424,10 +729,26 @@ class Registration:
         inter : `disnake.MessageInteraction`
             The button interaction
         """
+        logging.trace("[RegistrationForm] [User:%s] Token button callback", self.target.id)
+        if await self._answer_evicted(inter):
+            return
+        if self.step == RegistrationStep.token_timeout:
+            self._build_token_timeout_ui()
+            await inter.response.edit_message(embed=self._token_timeout_embed, view=self.token_timeout_view)
+            return
         self.token_verification_button.disabled = True
-        logging.trace(f"[RegistrationForm] [User:{self.target.id}] Token button callback")
-        await inter.response.send_modal(self.token_verification_modal)
+        self._restored = False
+        self._current_registrations.touch(self.target)
+        token_verification_modal = CallbackModal(
+            title=self._title,
+            timeout=60 * 5,
+            custom_id=self._custom_id("token"),
+            components=[self._token_input],
+            callback=self._callback_token_verification_modal,
+        )
+        await inter.response.send_modal(token_verification_modal)
 
+    @Metrics.timed("registration_handler_seconds", handler="token_modal")
     async def _callback_token_verification_modal(self, inter: disnake.ModalInteraction) -> None:
         """Check the token received from the modal.
 
@@ -444,23 +765,30 @@ class Registration:
         inter : `disnake.ModalInteraction`
             The modal interaction
         """
+        if await self._answer_evicted(inter):
+            return
         # If token has timeout
-        if not self.token:
+        if not self.token_hash or time.time() > self.token_expiry:
+            self._outcome("token_expired")
             await inter.response.defer(with_message=False)
             return
 
-        self.msg = await inter.response.edit_message(embed=self.verification_embed, view=self.token_verification_view)
+        self.msg = await inter.response.edit_message(embed=self._verification_embed, view=self.token_verification_view)
         token = inter.text_values.get("token").lower()
-        logging.trace(f"[RegistrationForm] [User:{self.target.id}] Token modal callback with token={token}.")
+        self._transition("token_submitted")
+        logging.trace("[RegistrationForm] [User:%s] Token modal callback with token=%s.", self.target.id, token)
 
         # If token invalid
-        if token != self.token:
-            logging.trace(f"[RegistrationForm] [User:{self.target.id}] Token invalid")
+        if not hmac.compare_digest(self._hash_token(token), self.token_hash):
+            logging.trace("[RegistrationForm] [User:%s] Token invalid", self.target.id)
+            self._outcome("token_invalid")
             self.nbr_try += 1
+            self._save()
 
             # End the registration
             if self.nbr_try >= self.token_nbr_try:
                 logging.info(f"[RegistrationForm] [User:{self.target.id}] End because nbr of try for token exceed")
+                self._outcome("token_nbr_try_exceeded")
                 self.token_verification_embed.clear_fields()
                 self.token_verification_embed.colour = disnake.Colour.red()
                 self.token_verification_embed.remove_footer().add_field(
@@ -471,7 +799,7 @@ class Registration:
                     embed=self.token_verification_embed,
                     view=None,
                 )
-                asyncio.create_task(self._timeout_user(self.target))
+                self._timeout_user(self.target)
 
                 await self._stop()
                 return
@@ -494,7 +822,8 @@ class Registration:
         # Check email availablility from registered users again, if the case two user register with the same email at the same time
         for user_data in Database.ulb_users.values():
             if user_data.email == self.email:
-                logging.trace(f"[RegistrationForm] [User:{self.target.id}] End because email not available")
+                logging.trace("[RegistrationForm] [User:%s] End because email not available", self.target.id)
+                self._outcome("email_unavailable")
                 self.token_verification_embed.clear_fields()
                 self.token_verification_embed.colour = disnake.Colour.red()
                 self.token_verification_embed.remove_footer().add_field(
@@ -505,9 +834,10 @@ class Registration:
                 await self._stop()
                 return
 
-        logging.trace(f"[RegistrationForm] [User:{self.target.id}] Token valid")
+        logging.trace("[RegistrationForm] [User:%s] Token valid", self.target.id)
         await self._register_user_step(inter)
 
+    @Metrics.timed("registration_handler_seconds", handler="register_user")
     async def _register_user_step(self, inter: disnake.ModalInteraction) -> None:
         """Register the user.
 
@@ -520,10 +850,12 @@ class Registration:
         """
         # Extract name and store the user
         name = " ".join([name.title() for name in self.email.split("@")[0].split(".")])
-        logging.trace(f"[RegistrationForm] [User:{self.target.id}] Extracted name from email= {name}")
+        logging.trace("[RegistrationForm] [User:%s] Extracted name from email= %s", self.target.id, name)
         Database.set_user(self.target, name, self.email)
         await self._stop()
         logging.info(f"[RegistrationForm] [User:{self.target.id}] Registration succeed")
+        self._transition("registered")
+        self._outcome("registered")
 
         # Send confirmation message
         await inter.edit_original_message(
@@ -537,11 +869,14 @@ class Registration:
             view=None,
         )
 
-        await update_user(self.target, name=name)
+        with Scheduler.use(Priority.interactive):
+            await update_user(self.target, name=name)
 
     async def _cancel(self) -> None:
         if self._token_task != None:
             self._token_task.cancel()
+        if self.msg is None:
+            return
         try:
             await self.msg.edit(
                 embed=disnake.Embed(
@@ -554,6 +889,65 @@ class Registration:
         except disnake.HTTPException:
             pass
 
+    def _sizeof(self) -> int:
+        """Estimate the memory held by the registration: its attributes and the embeds and views it references."""
+        size = sys.getsizeof(self) + sum(sys.getsizeof(value) for value in vars(self).values())
+        if hasattr(self, "token_verification_embed"):
+            size += len(str(self.token_verification_embed.to_dict()))
+        for name in ("registration_view", "token_verification_view", "token_timeout_view"):
+            if hasattr(self, name):
+                size += sum(sys.getsizeof(item) for item in getattr(self, name).children)
+        return size
+
+    def _evict(self, reason: str) -> None:
+        """Release an abandoned registration evicted from the pending registrations: stop its task and its views, and
+        delete it from the local store.
+
+        Parameters
+        ----------
+        reason : `str`
+            `expired` if it was abandoned for `session_ttl`, `capacity` if there were too many pending registrations
+        """
+        logging.info(f"[RegistrationForm] [User:{self.target.id}] Registration evicted ({reason}).")
+        self._outcome("abandoned" if reason == "expired" else "evicted")
+        if self._token_task is not None:
+            self._token_task.cancel()
+        self._evicted = True
+        for name in ("registration_view", "token_verification_view", "token_timeout_view"):
+            view = getattr(self, name, None)
+            if view is not None:
+                view.stop()
+        self.msg = None
+        RegistrationStore.delete_registration(self.target.id)
+
+    async def _answer_evicted(self, inter: disnake.Interaction) -> bool:
+        """Answer an interaction received by an evicted registration (from a modal still open, or a button of a message
+        sent before), asking the user to start a new registration.
+
+        Parameters
+        ----------
+        inter : `disnake.Interaction`
+            The interaction received
+
+        Returns
+        -------
+        `bool`
+            True if the registration was evicted and the interaction answered
+        """
+        if not self._evicted:
+            return False
+        logging.trace("[RegistrationForm] [User:%s] Interaction received after eviction", self.target.id)
+        embed = disnake.Embed(
+            title=self._title,
+            description="⌛ Cette vérification a expiré. Relance `/ulb` pour recommencer.",
+            color=disnake.Colour.orange(),
+        ).set_thumbnail(Bot.ULB_image)
+        if inter.response.is_done():
+            await inter.edit_original_message(embed=embed, view=None)
+        else:
+            await inter.response.edit_message(embed=embed, view=None)
+        return True
+
     async def _stop(self) -> None:
         """Properly end a registration process by deleting the pending registration entry."""
         if self._token_task != None:
@@ -561,62 +955,66 @@ class Registration:
         current_registration = self._current_registrations.get(self.target)
         if current_registration == self:
             self._current_registrations.pop(self.target)
+            RegistrationStore.delete_registration(self.target.id)
 
 
 class Unregister(disnake.ui.View):
+
+    # UI prototypes, shared by all the views. They should never be edited, but copied first.
+    _deleting_embed = disnake.Embed(
+        title="Suppression des données", description="*Supression en cours...*", colour=disnake.Color.orange()
+    )
+    _deleted_embed = disnake.Embed(
+        title="Suppression des données",
+        description="Ton adresse email à bien été supprimée !",
+        colour=disnake.Colour.teal(),
+    )
+
     def __init__(self, inter: disnake.ApplicationCommandInteraction):
         super().__init__(timeout=5 * 60)
         self.inter = inter
-        self.guilds: List[Tuple[disnake.Guild, UlbGuild]] = []
-        for guild, guild_data in Database.ulb_guilds.items():
-            if inter.user in guild.members:
-                member = guild.get_member(inter.user.id)
-                if guild_data.role in member.roles:
-                    self.guilds.append((guild, guild_data))
-
         self.confirmation: bool = False
-        self.embeds = [
-            disnake.Embed(
-                title="Déjà vérifié",
-                description=f"Ton compte est actuellement associé à l'adresse email `{Database.ulb_users.get(self.inter.author).email}`\nTu peux supprimer ton adresse email en cliquant ci-dessous.",
-                colour=disnake.Colour.teal(),
-            ),
-            disnake.Embed(
-                title="Suppression des données",
-                description=f"⚠️ En supprimant ton adresse email, tu n'auras plus accès aux serveurs restreints aux utilisateurs vérifiés dont tu fais parti:\n`"
-                + "`\n`".join([g.name for g, _ in self.guilds])
-                + "`",
-                colour=disnake.Colour.orange(),
-            ),
-            disnake.Embed(
-                title="Suppression des données", description="*Supression en cours...*", colour=disnake.Color.orange()
-            ),
-            disnake.Embed(
-                title="Suppression des données",
-                description="Ton adresse email à bien été supprimée !",
-                colour=disnake.Colour.teal(),
-            ),
-        ]
+
+    def _registered_embed(self) -> disnake.Embed:
+        return disnake.Embed(
+            title="Déjà vérifié",
+            description=f"Ton compte est actuellement associé à l'adresse email `{Database.ulb_users.get(self.inter.author).email}`\nTu peux supprimer ton adresse email en cliquant ci-dessous.",
+            colour=disnake.Colour.teal(),
+        )
+
+    def _confirmation_embed(self) -> disnake.Embed:
+        guilds: List[Tuple[disnake.Guild, UlbGuild]] = []
+        for guild, guild_data in Database.ulb_guilds.items():
+            member = guild.get_member(self.inter.user.id)
+            if member and guild_data.role in member.roles:
+                guilds.append((guild, guild_data))
+        return disnake.Embed(
+            title="Suppression des données",
+            description=f"⚠️ En supprimant ton adresse email, tu n'auras plus accès aux serveurs restreints aux utilisateurs vérifiés dont tu fais parti:\n`"
+            + "`\n`".join([g.name for g, _ in guilds])
+            + "`",
+            colour=disnake.Colour.orange(),
+        )
 
     @classmethod
     async def new(cls, inter: disnake.ApplicationCommandInteraction):
         new_view = cls(inter)
-        await inter.edit_original_response(embed=new_view.embeds[0], view=new_view)
+        await inter.edit_original_response(embed=new_view._registered_embed(), view=new_view)
 
     @disnake.ui.button(label="Supprimer mes données", emoji="🚮", style=disnake.ButtonStyle.danger)
     async def delete_data(self, button: disnake.Button, inter: disnake.MessageInteraction):
         if not self.confirmation:
             self.confirmation = True
             button.label = "Confirmer"
-            await inter.response.edit_message(embed=self.embeds[1], view=self)
+            await inter.response.edit_message(embed=self._confirmation_embed(), view=self)
         else:
-            await inter.response.edit_message(embed=self.embeds[2], view=None)
+            await inter.response.edit_message(embed=self._deleting_embed, view=None)
             await remove_user(inter.author)
-            await inter.edit_original_response(embed=self.embeds[3])
+            await inter.edit_original_response(embed=self._deleted_embed)
 
     async def on_timeout(self) -> None:
         await self.inter.edit_original_response(
-            embed=self.embeds[1].set_footer(
+            embed=self._confirmation_embed().set_footer(
                 text="La commande a expirée. Tu peux recommencer si tu veux supprimer ton adresse email"
             ),
             view=None,
@@ -648,7 +1046,8 @@ class AdminAddUserModal(disnake.ui.Modal):
             )
         )
 
-        await update_user(self.user, name=name)
+        with Scheduler.use(Priority.interactive):
+            await update_user(self.user, name=name)
 
 
 class AdminEditUserModal(disnake.ui.Modal):
@@ -685,4 +1084,5 @@ class AdminEditUserModal(disnake.ui.Modal):
             )
         )
 
-        await update_user(self.user, name=name)
+        with Scheduler.use(Priority.interactive):
+            await update_user(self.user, name=name)
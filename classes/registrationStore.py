@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+
+from bot import TaskRegistry
+
+
+class RegistrationStep:
+    registration = "registration"
+    token = "token"
+    token_timeout = "token_timeout"
+
+
+class StoredRegistration:
+    """Represent a pending registration as saved in the local store
+
+    Parameters
+    ----------
+    user_id: `int`
+        The id of the user being registered
+    step: `RegistrationStep`
+        The step the registration has reached
+    email: `Optional[str]`
+        The email provided by the user
+    token_hash: `Optional[str]`
+        The sha256 of the token sent by email
+    token_expiry: `Optional[float]`
+        The timestamp after which the token is not valid anymore
+    nbr_try: `int`
+        The number of invalid token already provided
+    """
+
+    def __init__(
+        self,
+        user_id: int,
+        step: str,
+        email: str = None,
+        token_hash: str = None,
+        token_expiry: float = None,
+        nbr_try: int = 0,
+    ) -> None:
+        self.user_id: int = user_id
+        self.step: str = step
+        self.email: str = email
+        self.token_hash: str = token_hash
+        self.token_expiry: float = token_expiry
+        self.nbr_try: int = nbr_try
+
+
+class RegistrationStoreInstantiationError(Exception):
+    """The Exception to be raise when the RegistrationStore class is instantiated."""
+
+    def __init__(self, *args: object) -> None:
+        super().__init__("The RegistrationStore class cannot be instantiated, but only used as a class.")
+
+
+class RegistrationStore:
+    """Represent the local store of the pending registrations.
+
+    The pending registrations and the users timeouts are saved in a sqlite file, so that a restarted bot can pick
+    them up without sending a new email. In clustered mode, they are saved in the store shared by the nodes
+    (`CLUSTER_STORE`) unless `REGISTRATION_STORE` is set, so a user timeout applies on all the nodes.
+
+    The writes are run in order in a dedicated thread, as the file can be locked by another node, and drained on
+    shutdown by the `TaskRegistry`. The reads do not wait for the writers of the other nodes.
+
+    This class is only used as a class and should not be instantiated
+
+    Classmethods
+    ------------
+    load(path: `Optional[str]`):
+        Open the store. This need to be called before using the other methods
+    save_registration(registration: `StoredRegistration`):
+        Add or update a pending registration
+    delete_registration(user_id: `int`):
+        Delete a pending registration
+    registrations(): `List[StoredRegistration]`
+        Get all the pending registrations that are not expired
+    save_timeout(user_id: `int`, until: `float`):
+        Add or update a user timeout
+    delete_timeout(user_id: `int`):
+        Delete a user timeout
+    timeouts(): `Dict[int, float]`
+        Get all the users timeouts that are not expired
+    timeout(user_id: `int`): `Optional[float]`
+        Get the end of the timeout of a user
+    """
+
+    # Config params
+    registration_validity_time = 60 * 60  # In sec
+
+    _default_path = "data/registrations.sqlite3"
+    _conn: sqlite3.Connection = None
+    _executor: ThreadPoolExecutor = None
+
+    def __init__(self) -> None:
+        raise RegistrationStoreInstantiationError
+
+    @classmethod
+    def load(cls, path: str = None) -> None:
+        """Open the sqlite store and create the tables if needed.
+
+        Parameters
+        ----------
+        path : `Optional[str]`
+            The path of the sqlite file. If `None`, `REGISTRATION_STORE` or `CLUSTER_STORE` env variable or the default
+            path is used.
+        """
+        if cls._conn:
+            return
+        if path is None:
+            path = os.getenv("REGISTRATION_STORE") or os.getenv("CLUSTER_STORE") or cls._default_path
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        cls._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        cls._conn.execute("PRAGMA busy_timeout = 5000")  # The file can be shared with the other nodes of the cluster
+        cls._conn.execute("PRAGMA journal_mode = WAL")  # The readers do not wait for the writers
+        cls._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="registration-store")
+        cls._conn.execute(
+            """CREATE TABLE IF NOT EXISTS registrations (
+                user_id INTEGER PRIMARY KEY,
+                step TEXT NOT NULL,
+                email TEXT,
+                token_hash TEXT,
+                token_expiry REAL,
+                nbr_try INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL
+            )"""
+        )
+        cls._conn.execute(
+            """CREATE TABLE IF NOT EXISTS timeouts (
+                user_id INTEGER PRIMARY KEY,
+                until REAL NOT NULL
+            )"""
+        )
+        logging.info(f"[RegistrationStore] Store loaded from {path}")
+
+    @classmethod
+    def _execute(cls, sql: str, params: tuple) -> None:
+        """Queue a write, run after the ones already queued in the thread of the store."""
+        future = cls._executor.submit(cls._conn.execute, sql, params)
+        future.add_done_callback(cls._write_done)
+        TaskRegistry.spawn(cls._wait(future), "store")
+
+    @staticmethod
+    async def _wait(future: Future) -> None:
+        try:
+            await asyncio.wrap_future(future)
+        except Exception:
+            pass  # Logged by `_write_done()`
+
+    @staticmethod
+    def _write_done(future: Future) -> None:
+        ex = None if future.cancelled() else future.exception()
+        if ex is not None:
+            logging.error(f"[RegistrationStore] Not able to write to the store: {type(ex).__name__}: {ex}")
+
+    @classmethod
+    def save_registration(cls, registration: StoredRegistration) -> None:
+        """Add or update a pending registration.
+
+        Parameters
+        ----------
+        registration : `StoredRegistration`
+            The registration to save
+        """
+        cls._execute(
+            "INSERT OR REPLACE INTO registrations VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                registration.user_id,
+                registration.step,
+                registration.email,
+                registration.token_hash,
+                registration.token_expiry,
+                registration.nbr_try,
+                time.time(),
+            ),
+        )
+
+    @classmethod
+    def delete_registration(cls, user_id: int) -> None:
+        """Delete a pending registration.
+
+        Parameters
+        ----------
+        user_id : `int`
+            The id of the registered user
+        """
+        cls._execute("DELETE FROM registrations WHERE user_id = ?", (user_id,))
+
+    @classmethod
+    def registrations(cls) -> List[StoredRegistration]:
+        """Get all the pending registrations, after purging the ones not updated for `registration_validity_time`.
+
+        Returns
+        -------
+        `List[StoredRegistration]`
+            The pending registrations
+        """
+        oldest = time.time() - cls.registration_validity_time
+        cls._execute("DELETE FROM registrations WHERE updated_at < ?", (oldest,))
+        rows = cls._conn.execute(
+            "SELECT user_id, step, email, token_hash, token_expiry, nbr_try FROM registrations WHERE updated_at >= ?",
+            (oldest,),
+        ).fetchall()
+        return [StoredRegistration(*row) for row in rows]
+
+    @classmethod
+    def save_timeout(cls, user_id: int, until: float) -> None:
+        """Add or update a user timeout.
+
+        Parameters
+        ----------
+        user_id : `int`
+            The id of the user
+        until : `float`
+            The timestamp of the end of the timeout
+        """
+        cls._execute("INSERT OR REPLACE INTO timeouts VALUES (?, ?)", (user_id, until))
+
+    @classmethod
+    def delete_timeout(cls, user_id: int) -> None:
+        """Delete a user timeout.
+
+        Parameters
+        ----------
+        user_id : `int`
+            The id of the user
+        """
+        cls._execute("DELETE FROM timeouts WHERE user_id = ?", (user_id,))
+
+    @classmethod
+    def timeouts(cls) -> Dict[int, float]:
+        """Get all the users timeouts, after purging the expired ones.
+
+        Returns
+        -------
+        `Dict[int, float]`
+            The end timestamp of the timeout, by user id
+        """
+        now = time.time()
+        cls._execute("DELETE FROM timeouts WHERE until < ?", (now,))
+        return dict(cls._conn.execute("SELECT user_id, until FROM timeouts WHERE until >= ?", (now,)).fetchall())
+
+    @classmethod
+    def user_ids(cls) -> Set[int]:
+        """Get the ids of the users with a pending registration or a timeout, expired or not.
+
+        Returns
+        -------
+        `Set[int]`
+            The ids of the users
+        """
+        rows = cls._conn.execute("SELECT user_id FROM registrations UNION SELECT user_id FROM timeouts").fetchall()
+        return {row[0] for row in rows}
+
+    @classmethod
+    def timeout(cls, user_id: int) -> Optional[float]:
+        """Get the end of the timeout of a user, set on this node or on another node of the cluster.
+
+        Parameters
+        ----------
+        user_id : `int`
+            The id of the user
+
+        Returns
+        -------
+        `Optional[float]`
+            The end timestamp of the timeout, `None` if the user is not timed out
+        """
+        row = cls._conn.execute(
+            "SELECT until FROM timeouts WHERE user_id = ? AND until >= ?", (user_id, time.time())
+        ).fetchone()
+        return row[0] if row else None
@@ -1,11 +1,20 @@
 # -*- coding: utf-8 -*-
 import asyncio
+import functools
 import logging
+from typing import List
 
 import disnake
 from disnake import HTTPException
 
 from .database import Database
+from .memberCache import MemberCache
+from .memberLanes import MemberLanes
+from bot import Priority
+from bot import Readiness
+from bot import Scheduler
+from bot import Stage
+from bot import TaskRegistry
 
 
 class RoleNotInGuildError(Exception):
@@ -13,14 +22,18 @@ class RoleNotInGuildError(Exception):
         super().__init__(f"The role  {role.name}:{role.id} is not part of the guild {guild.name}:{guild.id}.")
 
 
-async def wait_data(inter: disnake.ApplicationCommandInteraction = None, timeout: int = None) -> bool:
-    """Async sleep until Database is loaded
+async def wait_ready(stage: str, inter: disnake.ApplicationCommandInteraction = None, timeout: float = None) -> bool:
+    """Async wait until a readiness stage is reached
+
+    For an inter from a guild, only the shard of the guild needs to reach the stage.
 
     Parameters
     ----------
+    stage : str
+        The `Stage` to wait for
     inter : disnake.ApplicationCommandInteraction, optional
         The inter to edit_original_response in case of timeout, by default None
-    timeout : int, optional
+    timeout : float, optional
         The timeout duration, by default None. Must be provide if inter is provided.
 
     Returns
@@ -30,32 +43,52 @@ async def wait_data(inter: disnake.ApplicationCommandInteraction = None, timeout
     """
     if inter != None and timeout == None:
         logging.warning(
-            f"[Utils:wait_data] timeout cannot be None if inter is provided at the same time. Timeout=30 is used instead."
+            f"[Utils:wait_ready] timeout cannot be None if inter is provided at the same time. Timeout=30 is used instead."
         )
         timeout = 30
-    if not Database.loaded:
-        logging.trace("[Utils] Waiting for database to be loaded...")
-        current_time = 0
-        while not Database.loaded and (timeout == None or current_time < timeout):
-            await asyncio.sleep(1)
-            current_time += 1
-        if not Database.loaded:
-            logging.error("[Utils] Database load waiting timeout !")
-            if inter != None:
-                await inter.edit_original_response(
-                    embed=disnake.Embed(
-                        title="Commande temporairement inaccessible.",
-                        description="Veuillez réessayer dans quelques instants.",
-                        color=disnake.Color.orange(),
-                    )
+    shard = inter.guild.shard_id if inter != None and inter.guild != None else None
+    if Readiness.is_set(stage, shard=shard):
+        return True
+    logging.trace("[Utils] Waiting for %s...", stage)
+    if not await Readiness.wait(stage, timeout, shard=shard):
+        logging.error(f"[Utils] {stage} waiting timeout !")
+        if inter != None:
+            await inter.edit_original_response(
+                embed=disnake.Embed(
+                    title="Commande temporairement inaccessible.",
+                    description="Veuillez réessayer dans quelques instants.",
+                    color=disnake.Color.orange(),
                 )
-            return False
+            )
+        return False
     return True
 
 
+async def wait_data(inter: disnake.ApplicationCommandInteraction = None, timeout: float = None) -> bool:
+    """Async wait until Database is loaded
+
+    Parameters
+    ----------
+    inter : disnake.ApplicationCommandInteraction, optional
+        The inter to edit_original_response in case of timeout, by default None
+    timeout : float, optional
+        The timeout duration, by default None. Must be provide if inter is provided.
+
+    Returns
+    -------
+    bool
+        True if not timeout, False if timeout
+    """
+    return await wait_ready(Stage.storage, inter, timeout)
+
+
 async def update_member(member: disnake.Member, *, name: str = None, role: disnake.Role = None, rename: bool = None):
     """Update the role and nickname of a given member for the associated guild
 
+    The update runs in the lane of the member (see `MemberLanes`), after the edit running for this member and
+    superseding the one queued. It is finished even if the caller (a sweep for example) is cancelled. The edits wait for
+    a slot of `Scheduler.discord`, with the priority of the caller.
+
     Parameters
     ----------
     member : `disnake.Member`
@@ -72,6 +105,13 @@ async def update_member(member: disnake.Member, *, name: str = None, role: disna
     `RoleNotInGuildError`:
         Raised if the provided role in not in the roles of the associated guild
     """
+    op = functools.partial(_update_member, member, name=name, role=role, rename=rename, priority=Scheduler.current())
+    await MemberLanes.member(member, op)
+
+
+async def _update_member(
+    member: disnake.Member, *, name: str = None, role: disnake.Role = None, rename: bool = None, priority: str
+):
     if role == None:
         role = Database.ulb_guilds.get(member.guild).role
     elif role not in member.guild.roles:
@@ -84,16 +124,18 @@ async def update_member(member: disnake.Member, *, name: str = None, role: disna
             name = Database.ulb_users.get(member).name
         if member.nick == None or member.nick != name:
             try:
-                await member.edit(nick=f"{name}")
-                logging.info(f"[Utils:update_user] [User:{member.id}] [Guild:{member.guild.id}] Set name={name}")
+                async with Scheduler.discord.slot(priority):
+                    await member.edit(nick=f"{name}")
+                logging.info("[Utils:update_user] [User:%s] [Guild:%s] Set name=%s", member.id, member.guild.id, name)
             except HTTPException as ex:
                 logging.warning(
                     f'[Utils:update_user] [User:{member.id}] [Guild:{member.guild.id}] Not able to edit user "{member.name}:{member.id}" nick to "{name}": {ex}'
                 )
     if role not in member.roles:
         try:
-            await member.add_roles(role)
-            logging.info(f"[Utils:update_user] [User:{member.id}] [Guild:{member.guild.id}] Set role={role.id}")
+            async with Scheduler.discord.slot(priority):
+                await member.add_roles(role)
+            logging.info("[Utils:update_user] [User:%s] [Guild:%s] Set role=%s", member.id, member.guild.id, role.id)
         except HTTPException as ex:
             logging.error(
                 f'[Utils:update_user] [User:{member.id}] [Guild:{member.guild.id}] Not able to add ulb role "{role.name}:{role.id}" to ulb user "{member.name}:{member.id}": {ex}'
@@ -113,16 +155,55 @@ async def update_user(user: disnake.User, *, name: str = None):
     if name == None:
         name = Database.ulb_users.get(user).name
     for guild, guild_data in Database.ulb_guilds.items():
-        member = guild.get_member(user.id)
+        member = await MemberCache.fetch_member(guild, user.id)
         if member:
             await update_member(member, name=name, role=guild_data.role, rename=guild_data.rename)
 
 
+async def update_users(users: List[disnake.User], *, workers: int = 4) -> int:
+    """Update several users across all ULB guilds with a bounded pool of workers, with the bulk priority.
+
+    Parameters
+    ----------
+    users : `List[disnake.User]`
+        The users to update
+    workers : `int`
+        The maximum number of users updated concurrently, by default 4
+
+    Returns
+    -------
+    `int`
+        The number of users that could not be updated
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    for user in users:
+        queue.put_nowait(user)
+    failed = 0
+
+    async def worker():
+        nonlocal failed
+        while not queue.empty():
+            user = queue.get_nowait()
+            try:
+                await update_user(user)
+            except Exception as ex:
+                failed += 1
+                logging.error(f"[Utils:update_users] [User:{user.id}] Not able to update user: {ex}")
+
+    with Scheduler.use(Priority.bulk):
+        await asyncio.gather(*[worker() for _ in range(min(workers, len(users)))])
+    return failed
+
+
 async def update_guild(guild: disnake.Guild, *, role: disnake.Role = None, rename: bool = None) -> None:
     """Update a given guilds.
 
     This add role and rename any registered member on the server. This don't affect not registered member.
 
+    The update runs in the lane of the guild (see `MemberLanes`): the updates of a guild run one at a time, and a new
+    one supersedes the one queued. Its member edits have the bulk priority (see `Scheduler`). It stops on shutdown, the
+    next startup sweep finishing it.
+
     Parameters
     ----------
     guild : `disnake.Guild`
@@ -136,24 +217,16 @@ async def update_guild(guild: disnake.Guild, *, role: disnake.Role = None, renam
         role = Database.ulb_guilds.get(guild).role
     if rename == None:
         rename = Database.ulb_guilds.get(guild).rename
-    for member in guild.members:
-        if member in Database.ulb_users.keys():
-            await update_member(member, role=role, rename=rename)
-
+    await MemberLanes.guild(guild, functools.partial(_update_guild, guild, role=role, rename=rename))
 
-async def update_all_guilds() -> None:
-    """Update all guilds.
 
-    This create tasks to do it.
-    """
-    logging.info("[Utils] Checking all guilds...")
-    await asyncio.gather(
-        *[
-            update_guild(guild, role=guild_data.role, rename=guild_data.rename)
-            for guild, guild_data in Database.ulb_guilds.items()
-        ]
-    )
-    logging.info("[Utils] All guilds checked !")
+async def _update_guild(guild: disnake.Guild, *, role: disnake.Role, rename: bool) -> None:
+    with Scheduler.use(Priority.bulk):
+        for member in guild.members:
+            if TaskRegistry.closing:
+                return
+            if member in Database.ulb_users.keys():
+                await update_member(member, role=role, rename=rename)
 
 
 async def remove_user(user: disnake.User) -> None:
@@ -168,16 +241,52 @@ async def remove_user(user: disnake.User) -> None:
     Database.delete_user(user)
     for guild, guild_data in Database.ulb_guilds.items():
         if user in guild.members:
-            member = guild.get_member(user.id)
-            if guild_data.role in member.roles:
-                try:
-                    await member.remove_roles(guild_data.role)
-                except disnake.HTTPException:
-                    logging.error(
-                        f"[Cog:Admin] [Delete user {user.name}:{user.id}] Not able to remove role {guild_data.role.name}:{guild_data.role.id} of guild {guild.name}:{guild.id}."
-                    )
-                if guild_data.rename and member.nick == user_data.name:
-                    try:
-                        await member.edit(nick=None)
-                    except disnake.HTTPException:
-                        logging.warning(f"[Cog:Admin] [Delete user {user.name}:{user.id}] Not able to remove nickname")
+            await remove_member(
+                guild.get_member(user.id), role=guild_data.role, rename=guild_data.rename, name=user_data.name
+            )
+
+
+async def remove_member(member: disnake.Member, *, role: disnake.Role, rename: bool, name: str) -> bool:
+    """Remove the ULB role of a member, and its nickname if set by the bot. The edit runs in the lane of the member
+    (see `MemberLanes`).
+
+    Parameters
+    ----------
+    member : `disnake.Member`
+        The member
+    role : `disnake.Role`
+        The ULB role of the guild
+    rename : `bool`
+        Does the guild force rename or not
+    name : `str`
+        The name of the user, removed if it is the nickname of the member
+
+    Returns
+    -------
+    `bool`
+        False if the role could not be removed
+    """
+    op = functools.partial(_remove_member, member, role=role, rename=rename, name=name, priority=Scheduler.current())
+    return await MemberLanes.member(member, op)
+
+
+async def _remove_member(member: disnake.Member, *, role: disnake.Role, rename: bool, name: str, priority: str) -> bool:
+    removed = True
+    if role in member.roles:
+        try:
+            async with Scheduler.discord.slot(priority):
+                await member.remove_roles(role)
+        except disnake.HTTPException:
+            removed = False
+            logging.error(
+                f"[Utils:remove_member] [User:{member.id}] [Guild:{member.guild.id}] Not able to remove role {role.name}:{role.id} of guild {member.guild.name}:{member.guild.id}."
+            )
+        if rename and member.nick == name:
+            try:
+                async with Scheduler.discord.slot(priority):
+                    await member.edit(nick=None)
+            except disnake.HTTPException:
+                logging.warning(
+                    f"[Utils:remove_member] [User:{member.id}] [Guild:{member.guild.id}] Not able to remove nickname"
+                )
+    return removed
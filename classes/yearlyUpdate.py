@@ -1,13 +1,21 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import logging
+from typing import List
 
 import disnake
 
 from .utils import remove_user
+from bot import Priority
+from bot import Scheduler
+from bot import TaskRegistry
 from classes.database import Database
 
 
 class YearlyUpdate(disnake.ui.View):
+    _done: int = 0
+    _total: int = 0
+
     def __init__(self, reason: str):
         super().__init__()
         self.reason = reason
@@ -26,12 +34,33 @@ class YearlyUpdate(disnake.ui.View):
 
     async def remove_and_notify(self, user: disnake.User):
         await remove_user(user)
-        await user.send(
-            embed=disnake.Embed(
-                title="ULB accès retiré",
-                description=f"Ta vérification aux serveurs Discord ULB a été retirée pour la raison suivante : *{self.reason}*.\nUtilise **/ulb** pour re-vérifier ton adresse email ULB afin d'avoir à nouveau accès aux serveurs ULB sur Discord.",
+        async with Scheduler.discord.slot():
+            await user.send(
+                embed=disnake.Embed(
+                    title="ULB accès retiré",
+                    description=f"Ta vérification aux serveurs Discord ULB a été retirée pour la raison suivante : *{self.reason}*.\nUtilise **/ulb** pour re-vérifier ton adresse email ULB afin d'avoir à nouveau accès aux serveurs ULB sur Discord.",
+                )
             )
-        )
+
+    async def _remove_and_notify_all(self, users: List[disnake.User]) -> bool:
+        """Remove and notify the users one by one. On shutdown, stop after the current user: the users left are still
+        registered, so running the command again finishes the update."""
+        YearlyUpdate._done, YearlyUpdate._total = 0, len(users)
+        TaskRegistry.checkpoint(YearlyUpdate._checkpoint)
+        with Scheduler.use(Priority.bulk):
+            for user in users:
+                if TaskRegistry.closing:
+                    logging.warning(f"[yearly-update] Stopped by the shutdown after {self._done}/{self._total} users")
+                    return False
+                await self.remove_and_notify(user)
+                YearlyUpdate._done += 1
+        return True
+
+    @classmethod
+    def _checkpoint(cls) -> str:
+        if cls._done == cls._total:
+            return "yearly update: not running"
+        return f"yearly update: stopping at {cls._done}/{cls._total} users, run /yearly-update again to finish"
 
     @disnake.ui.button(label="Confirmer", style=disnake.ButtonStyle.danger)
     async def confirm(self, button: disnake.Button, inter: disnake.ApplicationCommandInteraction):
@@ -43,8 +72,8 @@ class YearlyUpdate(disnake.ui.View):
         )
         logging.info("[yearly-update] Starting to remove and notify all users")
         users = list(Database.ulb_users.keys())
-        for user in users:
-            await self.remove_and_notify(user)
+        if not await asyncio.shield(TaskRegistry.spawn(self._remove_and_notify_all(users), "yearly_update")):
+            return
         logging.info("[yearly-update] All users removed and notified !")
         if inter.is_expired():
             await inter.channel.send(
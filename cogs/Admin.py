@@ -1,15 +1,31 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import io
 import logging
 import os
+import tempfile
 from typing import List
 
 import disnake
 from disnake.ext import commands
 
 from bot import Bot
+from bot import Cluster
+from bot import LoopWatchdog
+from bot import MemoryProfiler
+from bot import Metrics
+from bot import Readiness
+from bot import SamplingProfiler
 from classes import Database
 from classes import utils
 from classes import YearlyUpdate
+from classes.bulkUsers import ExportFormat
+from classes.bulkUsers import iter_users
+from classes.bulkUsers import read_users_csv
+from classes.bulkUsers import write_users
+from classes.consistencyCheck import ConsistencyCheck
+from classes.guildSweep import GuildSweep
+from classes.memberCache import MemberCache
 from classes.registration import AdminAddUserModal
 from classes.registration import AdminEditUserModal
 
@@ -18,6 +34,13 @@ class Admin(commands.Cog):
     def __init__(self, bot: Bot):
         """Initialize the cog"""
         self.bot: Bot = bot
+        Cluster.subscribe("admin", self.on_cluster_event)
+
+    async def on_cluster_event(self, event: dict) -> None:
+        """Run on this node the admin actions started on another node of the cluster."""
+        if event["op"] == "update":
+            await Database.load(self.bot)
+            GuildSweep.start(f"admin update from {event['node']}")
 
     @commands.slash_command(
         name="update",
@@ -28,12 +51,75 @@ class Admin(commands.Cog):
     )
     async def update(self, inter: disnake.ApplicationCommandInteraction):
         await inter.response.defer(ephemeral=True)
-        Database.load(self.bot)
-        await utils.update_all_guilds()
+        await Database.load(self.bot)
+        Cluster.publish("admin", {"op": "update", "node": Cluster.node})
+        try:
+            await GuildSweep.start("admin update")
+        except asyncio.CancelledError:
+            await inter.edit_original_response(
+                embed=disnake.Embed(description="Update cancelled !", color=disnake.Color.orange())
+            )
+            return
         await inter.edit_original_response(
             embed=disnake.Embed(description="All servers updated !", color=disnake.Color.green())
         )
 
+    @commands.slash_command(
+        name="sweep",
+        description="Voir ou annuler la mise à jour des serveurs en cours.",
+        guilds=[int(os.getenv("ADMIN_GUILD_ID"))],
+        default_member_permissions=disnake.Permissions.all(),
+        dm_permission=False,
+    )
+    async def sweep(
+        self,
+        inter: disnake.ApplicationCommandInteraction,
+        action: str = commands.Param(
+            description="L'action à effectuer", default="status", choices=["status", "cancel"]
+        ),
+    ):
+        if action == "cancel" and GuildSweep.cancel():
+            await asyncio.sleep(0)  # Let the sweep handle its cancellation
+        await inter.response.send_message(
+            embed=disnake.Embed(title="Sweep", description=GuildSweep.progress(), color=disnake.Color.teal()),
+            ephemeral=True,
+        )
+
+    @commands.slash_command(
+        name="consistency",
+        description="Comparer la google sheet avec le cache du bot.",
+        guilds=[int(os.getenv("ADMIN_GUILD_ID"))],
+        default_member_permissions=disnake.Permissions.all(),
+        dm_permission=False,
+    )
+    async def consistency(
+        self,
+        inter: disnake.ApplicationCommandInteraction,
+        action: str = commands.Param(
+            description="status : dernière vérification, check : vérifier, repair : vérifier et réparer la sheet",
+            default="status",
+            choices=["status", "check", "repair"],
+        ),
+    ):
+        await inter.response.defer(ephemeral=True)
+        if action == "status":
+            report = ConsistencyCheck.last
+        else:
+            if not (await utils.wait_data(inter, 15)):
+                return
+            report = await ConsistencyCheck.run(repair=action == "repair")
+        if report is None:
+            description = "Aucune vérification effectuée depuis le démarrage."
+        else:
+            description = f"```{str(report)[:4000]}```"
+        await inter.edit_original_response(
+            embed=disnake.Embed(
+                title="Cohérence de la google sheet",
+                description=description,
+                color=disnake.Color.orange() if report and report.divergences else disnake.Color.teal(),
+            )
+        )
+
     @commands.slash_command(
         name="yearly-update",
         description="Retirer tous les utilisateur.rice.s en leur envoyant une notification par email",
@@ -49,8 +135,108 @@ class Admin(commands.Cog):
             default="Vérification annuelle",
         ),
     ):
+        if not Cluster.is_leader():
+            await inter.response.send_message(
+                embed=disnake.Embed(
+                    description=f"Cette commande ne peut être lancée que sur le leader du cluster ({Cluster.leader()}).",
+                    color=disnake.Color.orange(),
+                ),
+                ephemeral=True,
+            )
+            return
         await YearlyUpdate.new(raison, inter)
 
+    @commands.slash_command(
+        name="metrics",
+        description="Voir les métriques du bot (compteurs et latences).",
+        guilds=[int(os.getenv("ADMIN_GUILD_ID"))],
+        default_member_permissions=disnake.Permissions.all(),
+        dm_permission=False,
+    )
+    async def metrics(self, inter: disnake.ApplicationCommandInteraction):
+        await inter.response.defer(ephemeral=True)
+        summary = Metrics.summary()
+        files = [disnake.File(io.BytesIO(Metrics.render().encode()), filename="metrics.txt")]
+        stalls = LoopWatchdog.stalls()
+        if stalls:
+            files.append(disnake.File(io.BytesIO(stalls.encode()), filename="stalls.txt"))
+        await inter.edit_original_response(
+            embed=disnake.Embed(
+                title="Métriques",
+                description=f"```{summary[:4000] if summary else 'Aucune métrique.'}```",
+                color=disnake.Color.teal(),
+            )
+            .add_field(name="Démarrage", value=f"```{Readiness.timeline()}```", inline=False)
+            .add_field(name="Cache des membres", value=MemberCache.report(self.bot), inline=False),
+            files=files,
+        )
+
+    @commands.slash_command(
+        name="memory",
+        description="Profiler la mémoire du bot avec tracemalloc.",
+        guilds=[int(os.getenv("ADMIN_GUILD_ID"))],
+        default_member_permissions=disnake.Permissions.all(),
+        dm_permission=False,
+    )
+    async def memory(
+        self,
+        inter: disnake.ApplicationCommandInteraction,
+        action: str = commands.Param(
+            description="start : démarrer, snapshot : comparer avec le snapshot précédent, stop : arrêter",
+            choices=["start", "snapshot", "stop"],
+        ),
+        top: int = commands.Param(description="Nombre de sites d'allocation par groupe", default=25, ge=1, le=200),
+        frames: int = commands.Param(description="Profondeur des tracebacks (start)", default=10, ge=1, le=50),
+    ):
+        await inter.response.defer(ephemeral=True)
+        if action == "start":
+            MemoryProfiler.start(frames)
+            description = "tracemalloc démarré, snapshot de référence pris."
+        elif action == "stop":
+            MemoryProfiler.stop()
+            description = "tracemalloc arrêté."
+        elif not MemoryProfiler.running():
+            description = "tracemalloc n'est pas démarré. Utilisez d'abord `start`."
+        else:
+            summary, report = MemoryProfiler.snapshot(top)
+            await inter.edit_original_response(
+                embed=disnake.Embed(title="Mémoire", description=f"```{summary[:4000]}```", color=disnake.Color.teal()),
+                file=disnake.File(io.BytesIO(report.encode()), filename="memory.txt"),
+            )
+            return
+        await inter.edit_original_response(
+            embed=disnake.Embed(title="Mémoire", description=description, color=disnake.Color.teal())
+        )
+
+    @commands.slash_command(
+        name="profile",
+        description="Profiler le bot pendant quelques secondes (profiler par échantillonnage).",
+        guilds=[int(os.getenv("ADMIN_GUILD_ID"))],
+        default_member_permissions=disnake.Permissions.all(),
+        dm_permission=False,
+    )
+    async def profile(
+        self,
+        inter: disnake.ApplicationCommandInteraction,
+        seconds: int = commands.Param(description="Durée du profil en secondes", ge=1, le=300),
+        interval: int = commands.Param(description="Intervalle entre deux échantillons en ms", default=5, ge=1, le=100),
+    ):
+        await inter.response.defer(ephemeral=True)
+        if SamplingProfiler.running():
+            await inter.edit_original_response(
+                embed=disnake.Embed(
+                    title="Profil", description="Un profil est déjà en cours.", color=disnake.Color.orange()
+                )
+            )
+            return
+        summary, collapsed = await SamplingProfiler.profile(seconds, interval / 1000)
+        await inter.edit_original_response(
+            embed=disnake.Embed(
+                title=f"Profil ({seconds}s)", description=f"```{summary[:4000]}```", color=disnake.Color.teal()
+            ),
+            file=disnake.File(io.BytesIO(collapsed.encode()), filename="profile.collapsed.txt"),
+        )
+
     @commands.slash_command(
         name="user",
         guilds=[int(os.getenv("ADMIN_GUILD_ID"))],
@@ -86,6 +272,55 @@ class Admin(commands.Cog):
 
         await inter.response.send_modal(AdminAddUserModal(user))
 
+    @user.sub_command(name="import", description="Importer des utilisateur.rice.s depuis un CSV (user_id,name,email).")
+    async def user_import(
+        self,
+        inter: disnake.ApplicationCommandInteraction,
+        fichier: disnake.Attachment = commands.Param(
+            description="Le fichier CSV avec les colonnes user_id,name,email."
+        ),
+    ):
+        await inter.response.defer(ephemeral=True)
+        if not (await utils.wait_data(inter, 15)):
+            return
+        try:
+            lines = (await fichier.read()).decode("utf-8-sig").splitlines()
+        except (disnake.HTTPException, UnicodeDecodeError) as ex:
+            await inter.edit_original_response(
+                embed=disnake.Embed(description=f"Impossible de lire le fichier : {ex}", color=disnake.Colour.red())
+            )
+            return
+
+        report = read_users_csv(lines, self.bot.get_user, AdminAddUserModal._email_default_value)
+        if report.users:
+            Database.set_users(report.users)
+        logging.info(
+            f"[Cog:Admin] [Import] {report.new} users added, {report.updated} users updated, {len(report.errors)} rows rejected."
+        )
+
+        embed = disnake.Embed(
+            title="Import des utilisateur.rice.s",
+            description=f"**Ajouté.e.s :** `{report.new}`\n**Mis à jour :** `{report.updated}`\n**Lignes rejetées :** `{len(report.errors)}`",
+            color=disnake.Colour.green() if not report.errors else disnake.Colour.orange(),
+        )
+        if report.errors:
+            embed.add_field(
+                name="⚠️ Lignes rejetées",
+                value="\n".join(f"**{line}** : {reason}" for line, reason in report.errors[:10])
+                + (f"\n*... et {len(report.errors) - 10} autres*" if len(report.errors) > 10 else ""),
+                inline=False,
+            )
+        if report.users:
+            embed.set_footer(text="Mise à jour des rôles et pseudos en cours...")
+        await inter.edit_original_response(embed=embed)
+
+        if report.users:
+            failed = await utils.update_users([user for user, _, _ in report.users])
+            embed.set_footer(
+                text="Rôles et pseudos mis à jour." + (f" {failed} utilisateur.rice.s en erreur." if failed else "")
+            )
+            await inter.edit_original_response(embed=embed)
+
     @user.sub_command(name="edit", description="Editer un.e utilisateur.rice ULB (un seul paramètre requis)")
     async def user_edit(
         self,
@@ -309,24 +544,16 @@ class Admin(commands.Cog):
             if remove_ulb == "Oui":
                 for guild, guild_data in Database.ulb_guilds.items():
                     if user in guild.members:
-                        member = guild.get_member(user.id)
-                        if guild_data.role in member.roles:
-                            try:
-                                await member.remove_roles(guild_data.role)
-                            except disnake.HTTPException:
-                                error_roles.append(
-                                    f"**{guild_data.role.name}:{guild_data.role.id}** du serveur **{guild.name}:{guild.id}**"
-                                )
-                                logging.error(
-                                    f"[Cog:Admin] [Delete user {user.name}:{user.id}] Not able to remove role {guild_data.role.name}:{guild_data.role.id} of guild {guild.name}:{guild.id}."
-                                )
-                            if guild_data.rename and member.nick == user_data.name:
-                                try:
-                                    await member.edit(nick=None)
-                                except disnake.HTTPException:
-                                    logging.warning(
-                                        f"[Cog:Admin] [Delete user {user.name}:{user.id}] Not able to remove nickname"
-                                    )
+                        removed = await utils.remove_member(
+                            guild.get_member(user.id),
+                            role=guild_data.role,
+                            rename=guild_data.rename,
+                            name=user_data.name,
+                        )
+                        if not removed:
+                            error_roles.append(
+                                f"**{guild_data.role.name}:{guild_data.role.id}** du serveur **{guild.name}:{guild.id}**"
+                            )
 
             embed = disnake.Embed(
                 title=f"L'utilisateur.rice à bien été supprimé.e !",
@@ -343,6 +570,53 @@ class Admin(commands.Cog):
                 embed=embed,
             )
 
+    @commands.slash_command(
+        name="export",
+        description="Exporter les utilisateur.rice.s enregistré.e.s dans un fichier compressé.",
+        guilds=[int(os.getenv("ADMIN_GUILD_ID"))],
+        default_member_permissions=disnake.Permissions.all(),
+        dm_permission=False,
+    )
+    async def export(
+        self,
+        inter: disnake.ApplicationCommandInteraction,
+        format: str = commands.Param(
+            description="Le format du fichier", choices=[ExportFormat.csv, ExportFormat.jsonl], default=ExportFormat.csv
+        ),
+        serveur: str = commands.Param(
+            description="L'id du serveur dont les membres doivent être exportés (tous par défaut)", default=None
+        ),
+    ):
+        await inter.response.defer(ephemeral=True)
+        if not (await utils.wait_data(inter, 15)):
+            return
+        guild = None
+        if serveur:
+            guild = self.bot.get_guild(int(serveur)) if serveur.isdigit() else None
+            if not guild:
+                await inter.edit_original_response(
+                    embed=disnake.Embed(
+                        description=f"L'id {serveur} ne correspond à aucun server accessible par le bot.",
+                        color=disnake.Color.red(),
+                    )
+                )
+                return
+
+        file = tempfile.TemporaryFile()
+        count = await asyncio.to_thread(write_users, iter_users(guild), format, file)
+        file.seek(0)
+        logging.info(f"[Cog:Admin] [Export] {count} users exported as {format}.")
+        await inter.edit_original_response(
+            embed=disnake.Embed(
+                title="Export des utilisateur.rice.s",
+                description=f"`{count}` utilisateur.rice.s exporté.e.s"
+                + (f" du serveur **{guild.name}**." if guild else "."),
+                color=disnake.Color.green(),
+            ),
+            file=disnake.File(file, filename=f"ulb_users.{format}.gz"),
+        )
+        file.close()
+
     @commands.slash_command(name="server", default_member_permissions=disnake.Permissions.all())
     async def server(self, inter: disnake.ApplicationCommandInteraction):
         pass
@@ -451,6 +725,7 @@ class Admin(commands.Cog):
             if str(userdata.email).startswith(user_input) and userdata.email != "N/A"
         ]
 
+    @export.autocomplete("serveur")
     @server_info.autocomplete("id")
     async def email_autocomplete(self, inter: disnake.ApplicationCommandInteraction, user_input: str):
         return [str(server.id) for server in Database.ulb_guilds.keys() if str(server.id).startswith(user_input)]
@@ -1,55 +1,91 @@
 # -*- coding: utf-8 -*-
 import asyncio
 import logging
+from typing import Dict
 
 import disnake
 from disnake import ApplicationCommandInteraction
 from disnake.ext import commands
 
 from bot import Bot
+from bot import Priority
+from bot import Readiness
+from bot import Scheduler
+from bot import Stage
 from classes import *
+from classes.consistencyCheck import ConsistencyCheck
 from classes.feedback import FeedbackModal
 from classes.feedback import FeedbackType
+from classes.guildSweep import GuildSweep
+from classes.memberCache import MemberCache
 
 
 class Ulb(commands.Cog):
     def __init__(self, bot: Bot):
         """Initialize the cog"""
         self.bot: Bot = bot
+        self._load_task: asyncio.Task = None
+        self._startup_tasks: Dict[int, asyncio.Task] = {}
+
+    @commands.Cog.listener("on_shard_ready")
+    async def on_shard_ready(self, shard_id: int):
+        task = self._startup_tasks.get(shard_id)
+        if task and not task.done():
+            logging.warning(f"[Cog:Ulb] Startup of shard {shard_id} already running, ignoring on_shard_ready")
+            return
+        self._startup_tasks[shard_id] = asyncio.create_task(self.startup(shard_id))
+
+    async def startup(self, shard_id: int) -> None:
+        """Load the data on the first ready shard, then resolve the guilds and users of the shard and check its guilds
+        in background. The registration is setup once the data of all the shards is resolved, as the pending
+        registrations of the users not resolved yet would be dropped.
+
+        The commands are served as soon as the registration is ready, without waiting for the guilds to be checked.
+
+        Parameters
+        ----------
+        shard_id : `int`
+            The shard that is ready
+        """
+        await Readiness.wait(Stage.gateway, shard=shard_id)
+        # A shard ready again got a new session, with new guild and member objects: the data is loaded again
+        reload = Readiness.is_set(Stage.storage, shard=shard_id)
+        failed = self._load_task is not None and self._load_task.done() and self._load_task.exception() is not None
+        if self._load_task is None or reload or failed:
+            self._load_task = asyncio.create_task(Database.load(self.bot))
+        try:
+            await self._load_task
+            if MemberCache.enabled():
+                if not Readiness.is_set(Stage.registration):
+                    Registration.preload()  # Keep the users of the stored registrations cached until restored
+                await MemberCache.fetch(self.bot, shard_id)
+            Database.resolve(self.bot, shard_id)
+            ConsistencyCheck.start()  # Does nothing if already started
+            if Readiness.is_set(Stage.storage) and (reload or not Readiness.is_set(Stage.registration)):
+                Registration.setup(self)
+        except Exception as ex:
+            logging.error(f"[Cog:Ulb] Startup failed: {type(ex).__name__}: {ex}\n{self.bot.tracebackEx(ex)}")
+            return
+        logging.info(f"[Cog:Ulb] Shard {shard_id} ready !")
+        GuildSweep.start("startup", shard=shard_id)
+        if not await GuildSweep.wait(shard_id):
+            return
+        Readiness.set(Stage.initial_sync, shard=shard_id)
+        if Readiness.is_set(Stage.initial_sync):
+            logging.info("[Cog:Ulb] Startup timeline:\n" + Readiness.timeline())
 
-    @commands.Cog.listener("on_ready")
-    async def on_ready(self):
-        Database.load(self.bot)
-        Registration.setup(self)
-        logging.info("[Cog:Ulb] Ready !")
-        await utils.update_all_guilds()
-
-    async def wait_setup(self, inter: disnake.ApplicationCommandInteraction) -> None:
-        """Async sleep until GoogleSheet is loaded and RegistrationForm is set"""
-        if await utils.wait_data(inter, 15):
-            if not Registration.set:
-                logging.trace("[Cog:Ulb]  Waiting for registrationForm to be set...")
-                max_time = 10
-                current_time = 0
-                while not Registration.set and current_time < max_time:
-                    await asyncio.sleep(1)
-                    current_time += 1
-                if not Registration.set:
-                    await inter.edit_original_response(
-                        embed=disnake.Embed(
-                            title="Commande temporairement inaccessible",
-                            description="Veuillez réessayer dans quelques instants.",
-                            color=disnake.Color.orange(),
-                        )
-                    )
-                return False
-        return True
+    async def wait_setup(self, inter: disnake.ApplicationCommandInteraction) -> bool:
+        """Async wait until GoogleSheet is loaded and RegistrationForm is set"""
+        return await utils.wait_data(inter, 15) and await utils.wait_ready(Stage.registration, inter, 10)
 
     @commands.slash_command(name="ulb", description="Gérer son adresse email ULB.")
     async def ulb(self, inter: ApplicationCommandInteraction):
         await inter.response.defer(ephemeral=True)
         if not (await self.wait_setup(inter)):
             return
+        if not Readiness.is_set(Stage.first_ulb):
+            Readiness.set(Stage.first_ulb)
+            logging.info(f"[Cog:Ulb] First /ulb served {Readiness.reached(Stage.first_ulb):.3f}s after start")
         if inter.author in Database.ulb_users.keys():
             await Unregister.new(inter)
         else:
@@ -208,37 +244,43 @@ class Ulb(commands.Cog):
         inter: disnake.ApplicationCommandInteraction,
         type: str = commands.Param(description="type de feedback", choices=[FeedbackType.issu, FeedbackType.improve]),
     ):
-        logging.trace(f"[Feedback] Starting {type} feedback by {inter.user} from {inter.guild}")
+        logging.trace("[Feedback] Starting %s feedback by %s from %s", type, inter.user, inter.guild)
         await inter.response.send_modal(modal=FeedbackModal(self.bot, type))
 
+    @commands.Cog.listener("on_modal_submit")
+    async def on_modal_submit(self, inter: disnake.ModalInteraction):
+        if Readiness.is_set(Stage.registration):
+            await Registration.dispatch_modal(inter)
+
     @commands.Cog.listener("on_member_join")
     async def on_member_join(self, member: disnake.Member):
         if not (await utils.wait_data()):
             return
-        logging.trace(f"[Cog:Ulb] [Guild:{member.guild.id}] [User:{member.id}] user joined")
+        logging.trace("[Cog:Ulb] [Guild:%s] [User:%s] user joined", member.guild.id, member.id)
 
         guild_data = Database.ulb_guilds.get(member.guild, None)
         # if ulb_role is None, this mean that the guild is not set
         if guild_data == None:
-            logging.trace(f"[Cog:Ulb] [Guild:{member.guild.id}] [User:{member.id}] Guild is not set. Ending event")
+            logging.trace("[Cog:Ulb] [Guild:%s] [User:%s] Guild is not set. Ending event", member.guild.id, member.id)
             return
 
         name = Database.ulb_users.get(member, None)
         # If name is None, this mean that the member is not registered yet
         if not name:
             logging.trace(
-                f"[Cog:Ulb] [Guild:{member.guild.id}] [User:{member.id}] Member not registered yet. Sending message."
-            )
-            await member.send(
-                embed=disnake.Embed(
-                    title=f"Bienvenue sur le serveur __**{member.guild.name}**__",
-                    description="""Ce serveur est limité aux membre de l'**ULB**.\nPour accéder à ce serveur, tu dois vérifier ton identité avec ton addresse email **ULB** en utilisant la commande **"/ulb"**.""",
-                    color=disnake.Color.teal(),
-                ).set_thumbnail(url=self.bot.ULB_image)
+                "[Cog:Ulb] [Guild:%s] [User:%s] Member not registered yet. Sending message.", member.guild.id, member.id
             )
+            async with Scheduler.discord.slot(Priority.background):
+                await member.send(
+                    embed=disnake.Embed(
+                        title=f"Bienvenue sur le serveur __**{member.guild.name}**__",
+                        description="""Ce serveur est limité aux membre de l'**ULB**.\nPour accéder à ce serveur, tu dois vérifier ton identité avec ton addresse email **ULB** en utilisant la commande **"/ulb"**.""",
+                        color=disnake.Color.teal(),
+                    ).set_thumbnail(url=self.bot.ULB_image)
+                )
         else:
             logging.trace(
-                f"[Cog:Ulb] [Guild:{member.guild.id}] [User:{member.id}] Member already registered. Updating member."
+                "[Cog:Ulb] [Guild:%s] [User:%s] Member already registered. Updating member.", member.guild.id, member.id
             )
             await utils.update_member(member, role=guild_data.role, rename=guild_data.rename)
 
@@ -255,7 +297,11 @@ class Ulb(commands.Cog):
             and after.permissions.change_nickname == True
         ):
             logging.trace(
-                f"[Cog:Ulb] [Guild {after.guild.name}:{after.guild.id}] [Role {after.name}:{after.id}] Nickname permission conflict detected. Sending message to editer user..."
+                "[Cog:Ulb] [Guild %s:%s] [Role %s:%s] Nickname permission conflict detected. Sending message to editer user...",
+                after.guild.name,
+                after.guild.id,
+                after.name,
+                after.id,
             )
             async for audit in after.guild.audit_logs(action=disnake.AuditLogAction.role_update, limit=10):
                 if (
@@ -285,11 +331,19 @@ class Ulb(commands.Cog):
         guild_data = Database.ulb_guilds.get(role.guild, None)
         if guild_data:
             logging.trace(
-                f"[Cog:Ulb] [Guild {role.guild.name}:{role.guild.id}] [Role {role.name}:{role.id}] Role deleted: Remonving entry from database..."
+                "[Cog:Ulb] [Guild %s:%s] [Role %s:%s] Role deleted: Remonving entry from database...",
+                role.guild.name,
+                role.guild.id,
+                role.name,
+                role.id,
             )
             Database.delete_guild(role.guild)
             logging.trace(
-                f"[Cog:Ulb] [Guild {role.guild.name}:{role.guild.id}] [Role {role.name}:{role.id}] Role deleted Entry removed from database. Sending message to editer user..."
+                "[Cog:Ulb] [Guild %s:%s] [Role %s:%s] Role deleted Entry removed from database. Sending message to editer user...",
+                role.guild.name,
+                role.guild.id,
+                role.name,
+                role.id,
             )
             async for audit in role.guild.audit_logs(action=disnake.AuditLogAction.role_delete, limit=10):
                 if audit.target == role:
@@ -314,13 +368,16 @@ class Ulb(commands.Cog):
             return
 
         if guild in Database.ulb_guilds.keys():
-            logging.trace(f"[Cog:Ulb] [Guild {guild.name}:{guild.id}] Guild removed: Deleting entey from database...")
+            logging.trace(
+                "[Cog:Ulb] [Guild %s:%s] Guild removed: Deleting entey from database...", guild.name, guild.id
+            )
             await Database.delete_guild(guild)
             logging.info(f"[Cog:Ulb] [Guild {guild.name}:{guild.id}] Guild removed: Entry deleted from database.")
 
-    @commands.Cog.listener("on_resumed")
-    async def on_resumed(self):
-        await utils.update_all_guilds()
+    @commands.Cog.listener("on_shard_resumed")
+    async def on_shard_resumed(self, shard_id: int):
+        if Readiness.is_set(Stage.storage, shard=shard_id):
+            GuildSweep.start("resumed", shard=shard_id)
 
     @commands.Cog.listener("on_guild_join")
     async def on_guild_join(self, guild: disnake.Guild):
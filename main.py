@@ -16,13 +16,15 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
-import logging
+import logging.handlers
 import os
 import platform
 
 from dotenv import load_dotenv
 
 from bot import Bot
+from bot import setup_logging
+from bot import ShardedBot
 
 
 def addLoggingLevel(levelName: str, levelNum: int, methodName: str = None):
@@ -80,14 +82,14 @@ if __name__ == "__main__":
 
     addLoggingLevel("TRACE", logging.INFO - 5)
 
+    load_dotenv()
+
     logFormatter = logging.Formatter("%(asctime)s [%(threadName)-12.12s] [%(levelname)-5.5s]  %(message)s")
-    rootLogger = logging.getLogger()
-    rootLogger.setLevel(logging.DEBUG)
 
     consoleHandler = logging.StreamHandler()
     consoleHandler.setFormatter(logFormatter)
     consoleHandler.setLevel(logging.TRACE)
-    rootLogger.addHandler(consoleHandler)
+    handlers = [consoleHandler]
 
     if platform.system() == "Linux":
         fileInfoHandler = logging.handlers.RotatingFileHandler(
@@ -99,17 +101,19 @@ if __name__ == "__main__":
         fileInfoHandler.setFormatter(logFormatter)
         fileInfoHandler.setLevel(logging.TRACE)
         fileInfoHandler.doRollover()
-        rootLogger.addHandler(fileInfoHandler)
+        handlers.append(fileInfoHandler)
         fileDebugHandler.setFormatter(logFormatter)
         fileDebugHandler.setLevel(logging.DEBUG)
         fileDebugHandler.doRollover()
-        rootLogger.addHandler(fileDebugHandler)
+        handlers.append(fileDebugHandler)
 
-    else:
-        logging.warning("Non Linux system. Log info and debug file won't be available.")
+    # The handlers are run by a dedicated thread, so the event loop never waits for the console or the files
+    setup_logging(handlers)
+    rootLogger = logging.getLogger()
 
-    load_dotenv()
+    if platform.system() != "Linux":
+        logging.warning("Non Linux system. Log info and debug file won't be available.")
 
-    bot = Bot(logger=rootLogger, logFormatter=logFormatter)
+    bot = (ShardedBot if os.getenv("SHARD_COUNT") else Bot)(logger=rootLogger, logFormatter=logFormatter)
 
     bot.run(os.getenv("DISCORD_TOKEN"))
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+from bot import breaker
+from bot import CircuitBreaker
+from bot import CircuitOpenError
+
+
+class Outage(Exception):
+    pass
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(breaker.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def circuit() -> CircuitBreaker:
+    return CircuitBreaker(
+        "test", is_failure=lambda ex: isinstance(ex, Outage), failures=3, reset_timeout=30, max_reset_timeout=100
+    )
+
+
+async def ok():
+    return "ok"
+
+
+async def down():
+    raise Outage
+
+
+def call(circuit: CircuitBreaker, func):
+    return asyncio.run(circuit.call(func))
+
+
+def fail(circuit: CircuitBreaker, times: int = 1) -> None:
+    for _ in range(times):
+        with pytest.raises(Outage):
+            call(circuit, down)
+
+
+def test_opens_after_consecutive_failures(clock, circuit):
+    fail(circuit, 2)
+    assert circuit.state == CircuitBreaker.closed
+    fail(circuit)
+    assert circuit.state == CircuitBreaker.open
+    with pytest.raises(CircuitOpenError):
+        call(circuit, ok)
+    assert circuit.retry_in() == 30
+
+
+def test_success_resets_the_failure_count(clock, circuit):
+    fail(circuit, 2)
+    assert call(circuit, ok) == "ok"
+    fail(circuit, 2)
+    assert circuit.state == CircuitBreaker.closed
+
+
+def test_other_errors_are_not_failures(clock, circuit):
+    async def refused():
+        raise ValueError
+
+    for _ in range(5):
+        with pytest.raises(ValueError):
+            call(circuit, refused)
+    assert circuit.state == CircuitBreaker.closed
+
+
+def test_half_open_lets_a_single_probe_through(clock, circuit):
+    fail(circuit, 3)
+    clock.now += 30
+    assert circuit.allow()
+    assert circuit.state == CircuitBreaker.half_open
+    assert not circuit.allow()
+    circuit.success()
+    assert circuit.state == CircuitBreaker.closed
+    assert circuit.allow()
+
+
+def test_successful_probe_closes_the_circuit(clock, circuit):
+    fail(circuit, 3)
+    clock.now += 30
+    assert call(circuit, ok) == "ok"
+    assert circuit.state == CircuitBreaker.closed
+    assert circuit.retry_in() == 0
+
+
+def test_failed_probe_doubles_the_timeout_up_to_the_maximum(clock, circuit):
+    fail(circuit, 3)
+    for timeout in (60, 100, 100):
+        clock.now += circuit.retry_in()
+        fail(circuit)
+        assert circuit.state == CircuitBreaker.open
+        assert circuit.retry_in() == timeout
+
+
+def test_timeout_is_reset_once_closed(clock, circuit):
+    fail(circuit, 3)
+    clock.now += 30
+    fail(circuit)
+    clock.now += 60
+    call(circuit, ok)
+    fail(circuit, 3)
+    assert circuit.retry_in() == 30
+
+
+def test_cancelled_probe_frees_the_half_open_circuit(clock, circuit):
+    async def main():
+        task = asyncio.create_task(circuit.call(lambda: asyncio.sleep(10)))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    fail(circuit, 3)
+    clock.now += 30
+    asyncio.run(main())
+    assert circuit.state == CircuitBreaker.half_open
+    assert circuit.allow()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from classes.bulkUsers import read_users_csv
+from classes.database import Database
+from classes.database import UlbUser
+
+
+class User:
+    def __init__(self, id: int) -> None:
+        self.id = id
+
+    def __repr__(self) -> str:
+        return f"User({self.id})"
+
+
+USERS = {id: User(id) for id in (1, 2, 3, 4)}
+
+
+@pytest.fixture(autouse=True)
+def registered(monkeypatch):
+    monkeypatch.setattr(Database, "ulb_users", {USERS[4]: UlbUser("Registered User", "registered.user@ulb.be")})
+
+
+def read(*lines: str):
+    return read_users_csv(["user_id,name,email"] + list(lines), USERS.get)
+
+
+def test_valid_rows():
+    report = read("1,First User,first.user@ulb.be", "4,Registered User,registered.user@ulb.be")
+    assert report.errors == []
+    assert report.users == [
+        (USERS[1], "First User", "first.user@ulb.be"),
+        (USERS[4], "Registered User", "registered.user@ulb.be"),
+    ]
+    assert (report.new, report.updated) == (1, 1)
+
+
+def test_email_column_is_optional():
+    report = read_users_csv(["user_id,name", "1,First User"], USERS.get)
+    assert report.errors == []
+    assert report.users == [(USERS[1], "First User", "N/A")]
+
+
+@pytest.mark.parametrize("header", ["", "user_id,email", "id,name,email"])
+def test_header_must_have_user_id_and_name(header):
+    report = read_users_csv([header, "1,First User,first.user@ulb.be"], USERS.get)
+    assert report.users == []
+    assert report.errors == [(1, "L'entête doit contenir les colonnes user_id et name (et email, optionnelle).")]
+
+
+@pytest.mark.parametrize(
+    "line, error",
+    [
+        ("abc,First User,first.user@ulb.be", "user_id invalide"),
+        ("9,Unknown User,unknown.user@ulb.be", "Pas d'utilisateur.rice discord"),
+        ("1,,first.user@ulb.be", "Nom manquant"),
+        ("1,First User,first.user.ulb.be", "Adresse email invalide"),
+        ("1,First User,registered.user@ulb.be", "est déjà utilisée"),
+    ],
+)
+def test_invalid_rows_are_rejected(line, error):
+    report = read(line, "2,Second User,second.user@ulb.be")
+    assert [user for user, _, _ in report.users] == [USERS[2]]
+    assert len(report.errors) == 1
+    assert report.errors[0][0] == 2
+    assert error in report.errors[0][1]
+
+
+def test_duplicates_in_the_file_are_rejected():
+    report = read(
+        "1,First User,first.user@ulb.be",
+        "1,First User Again,other.user@ulb.be",
+        "2,Second User,first.user@ulb.be",
+        "3,Third User,",
+        "2,Second User,",
+    )
+    assert [user for user, _, _ in report.users] == [USERS[1], USERS[3], USERS[2]]
+    assert [line for line, _ in report.errors] == [3, 4]
+
+
+def test_registered_user_can_keep_its_email():
+    report = read("4,Renamed User,registered.user@ulb.be")
+    assert report.errors == []
+    assert report.updated == 1
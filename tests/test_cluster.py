@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+from bot import Cluster
+
+
+@pytest.fixture
+def cluster(monkeypatch, tmp_path):
+    monkeypatch.setenv("CLUSTER_STORE", str(tmp_path / "cluster.sqlite3"))
+    monkeypatch.setenv("CLUSTER_NODE", "test-node")
+    monkeypatch.setattr(Cluster, "poll_interval", 0.01)
+    monkeypatch.setattr(Cluster, "_workers", {})
+    monkeypatch.setattr(Cluster, "_leases", set())
+    monkeypatch.setattr(Cluster, "_held", set())
+    return Cluster
+
+
+async def until(condition, timeout: float = 2) -> None:
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not reached")
+
+
+def test_node_is_read_on_start(cluster):
+    async def main():
+        await cluster.start()
+        try:
+            assert cluster.node == "test-node"
+            assert cluster.is_leader()
+        finally:
+            await cluster.stop()
+
+    asyncio.run(main())
+
+
+def test_leader_runs_the_jobs_in_order(cluster):
+    async def main():
+        done = []
+
+        async def handler(payload):
+            done.append(payload["n"])
+
+        await cluster.start()
+        try:
+            cluster.worker("test", handler)
+            for n in range(5):
+                cluster.submit("test", {"n": n})
+            await until(lambda: len(done) == 5)
+            assert done == [0, 1, 2, 3, 4]
+        finally:
+            await cluster.stop()
+
+    asyncio.run(main())
+
+
+def test_failing_job_is_retried_then_dead_lettered(cluster, monkeypatch):
+    monkeypatch.setattr(Cluster, "job_max_attempts", 3)
+
+    async def main():
+        calls = []
+
+        async def handler(payload):
+            calls.append(payload["n"])
+            if payload["n"] == 0:
+                raise ValueError("poison")
+
+        await cluster.start()
+        try:
+            cluster.worker("test", handler)
+            cluster.submit("test", {"n": 0})
+            cluster.submit("test", {"n": 1})
+            await until(lambda: 1 in calls)
+            assert calls == [0, 0, 0, 1]
+            dead = await cluster._call(
+                lambda: cluster._conn.execute("SELECT kind, attempts, error FROM dead_jobs").fetchall()
+            )
+            assert dead == [("test", 3, "ValueError: poison")]
+        finally:
+            await cluster.stop()
+
+    asyncio.run(main())
+
+
+def test_stop_releases_the_leases_and_closes_the_store(cluster):
+    async def main():
+        await cluster.start()
+        assert await cluster.claim("shard-0")
+        await cluster.stop()
+        assert cluster._conn is None
+        assert not cluster.holds("shard-0")
+        cluster.publish("test", {})  # Dropped, the store is closed
+
+    asyncio.run(main())
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+from classes.memberLanes import MemberLanes
+
+
+class Guild:
+    def __init__(self, id: int) -> None:
+        self.id = id
+
+
+class Member:
+    def __init__(self, id: int, guild: Guild) -> None:
+        self.id = id
+        self.guild = guild
+
+
+GUILD = Guild(1)
+
+
+def op(name: str, calls: list, release: asyncio.Event = None):
+    async def run():
+        calls.append(f"{name} start")
+        if release is not None:
+            await release.wait()
+        calls.append(f"{name} end")
+        return name
+
+    return run
+
+
+def test_ops_of_a_member_run_one_at_a_time():
+    async def main():
+        member, calls, release = Member(1, GUILD), [], asyncio.Event()
+        first = asyncio.create_task(MemberLanes.member(member, op("first", calls, release)))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(MemberLanes.member(member, op("second", calls)))
+        await asyncio.sleep(0)
+        release.set()
+        assert await asyncio.gather(first, second) == ["first", "second"]
+        assert calls == ["first start", "first end", "second start", "second end"]
+        assert MemberLanes._members == {}
+
+    asyncio.run(main())
+
+
+def test_queued_op_is_superseded_by_a_newer_one():
+    async def main():
+        member, calls, release = Member(1, GUILD), [], asyncio.Event()
+        running = asyncio.create_task(MemberLanes.member(member, op("running", calls, release)))
+        await asyncio.sleep(0)
+        superseded = asyncio.create_task(MemberLanes.member(member, op("superseded", calls)))
+        newer = asyncio.create_task(MemberLanes.member(member, op("newer", calls)))
+        await asyncio.sleep(0)
+        release.set()
+        assert await asyncio.gather(running, superseded, newer) == ["running", "newer", "newer"]
+        assert "superseded start" not in calls
+
+    asyncio.run(main())
+
+
+def test_lanes_of_different_members_run_concurrently():
+    async def main():
+        calls, release = [], asyncio.Event()
+        first = asyncio.create_task(MemberLanes.member(Member(1, GUILD), op("first", calls, release)))
+        second = asyncio.create_task(MemberLanes.member(Member(2, GUILD), op("second", calls, release)))
+        await asyncio.sleep(0.01)
+        assert calls == ["first start", "second start"]
+        release.set()
+        await asyncio.gather(first, second)
+
+    asyncio.run(main())
+
+
+def test_error_is_raised_to_the_caller_and_the_lane_goes_on():
+    async def main():
+        member, calls = Member(1, GUILD), []
+
+        async def failing():
+            raise ValueError
+
+        with pytest.raises(ValueError):
+            await MemberLanes.member(member, failing)
+        assert await MemberLanes.member(member, op("next", calls)) == "next"
+
+    asyncio.run(main())
+
+
+def test_cancelled_caller_does_not_cancel_the_op():
+    async def main():
+        member, calls, release = Member(1, GUILD), [], asyncio.Event()
+        caller = asyncio.create_task(MemberLanes.member(member, op("op", calls, release)))
+        await asyncio.sleep(0)
+        caller.cancel()
+        release.set()
+        await asyncio.sleep(0.01)
+        assert calls == ["op start", "op end"]
+
+    asyncio.run(main())
+
+
+def test_guild_lane_supersedes_like_member_lanes():
+    async def main():
+        calls, release = [], asyncio.Event()
+        running = asyncio.create_task(MemberLanes.guild(GUILD, op("sweep", calls, release)))
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(MemberLanes.guild(GUILD, op("old setup", calls)))
+        newer = asyncio.create_task(MemberLanes.guild(GUILD, op("new setup", calls)))
+        await asyncio.sleep(0)
+        release.set()
+        assert await asyncio.gather(running, queued, newer) == ["sweep", "new setup", "new setup"]
+        assert MemberLanes._guilds == {}
+
+    asyncio.run(main())
+
+
+def test_cancelled_guild_caller_cancels_the_running_update():
+    async def main():
+        calls, release = [], asyncio.Event()
+        sweep = asyncio.create_task(MemberLanes.guild(GUILD, op("sweep", calls, release)))
+        await asyncio.sleep(0.01)
+        sweep.cancel()
+        replacing = asyncio.create_task(MemberLanes.guild(GUILD, op("replacing", calls)))
+        await asyncio.sleep(0.01)
+        release.set()
+        assert await replacing == "replacing"
+        assert calls == ["sweep start", "replacing start", "replacing end"]
+
+    asyncio.run(main())
+
+
+def test_guild_update_shared_by_another_caller_is_not_cancelled():
+    async def main():
+        calls, release = [], asyncio.Event()
+        running = asyncio.create_task(MemberLanes.guild(GUILD, op("running", calls, release)))
+        await asyncio.sleep(0)
+        first = asyncio.create_task(MemberLanes.guild(GUILD, op("queued", calls)))
+        second = asyncio.create_task(MemberLanes.guild(GUILD, op("queued", calls)))
+        await asyncio.sleep(0)
+        first.cancel()
+        release.set()
+        assert await asyncio.gather(running, second) == ["running", "queued"]
+
+    asyncio.run(main())
+
+
+def test_queued_op_of_another_kind_is_not_superseded():
+    async def main():
+        member, calls, release = Member(1, GUILD), [], asyncio.Event()
+
+        async def remove():
+            calls.append("remove")
+            return True
+
+        running = asyncio.create_task(MemberLanes.member(member, op("running", calls, release)))
+        await asyncio.sleep(0)
+        removal = asyncio.create_task(MemberLanes.member(member, remove))
+        update = asyncio.create_task(MemberLanes.member(member, op("update", calls)))
+        await asyncio.sleep(0)
+        release.set()
+        assert await asyncio.gather(running, removal, update) == ["running", True, "update"]
+        assert calls == ["running start", "running end", "remove", "update start", "update end"]
+
+    asyncio.run(main())
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+from bot import Priority
+from bot import scheduler
+from bot import Scheduler
+
+
+@pytest.fixture
+def make_scheduler(monkeypatch):
+    def make(capacity: int) -> Scheduler:
+        monkeypatch.setenv("SCHEDULER_TEST_SLOTS", str(capacity))
+        return Scheduler("test", "SCHEDULER_TEST_SLOTS", 4)
+
+    return make
+
+
+async def hold(sched: Scheduler, priority: str, release: asyncio.Event, order: list, name: str) -> None:
+    async with sched.slot(priority):
+        order.append(name)
+        await release.wait()
+
+
+async def saturate(sched: Scheduler, counts: dict, release: asyncio.Event, order: list) -> list:
+    tasks = [
+        asyncio.create_task(hold(sched, priority, release, order, f"{priority}{i}"))
+        for priority, count in counts.items()
+        for i in range(count)
+    ]
+    await asyncio.sleep(0)
+    return tasks
+
+
+@pytest.mark.parametrize("capacity", [2, 3, 4, 8])
+def test_background_and_bulk_leave_a_slot_to_interactive(make_scheduler, capacity):
+    async def main():
+        sched = make_scheduler(capacity)
+        release, order = asyncio.Event(), []
+        tasks = await saturate(sched, {Priority.bulk: 10, Priority.background: 10}, release, order)
+        running = sched._running
+        assert running[Priority.background] + running[Priority.bulk] == capacity - 1
+        assert running[Priority.bulk] <= max(1, capacity // 2)
+        assert running[Priority.background] <= max(1, capacity // 2)
+
+        interactive = asyncio.create_task(hold(sched, Priority.interactive, release, order, "interactive"))
+        await asyncio.sleep(0)
+        assert "interactive" in order
+        release.set()
+        await asyncio.gather(*tasks, interactive)
+        assert sum(sched._running.values()) == 0
+
+    asyncio.run(main())
+
+
+def test_interactive_can_use_every_slot(make_scheduler):
+    async def main():
+        sched = make_scheduler(4)
+        release, order = asyncio.Event(), []
+        tasks = await saturate(sched, {Priority.interactive: 6}, release, order)
+        assert sched._running[Priority.interactive] == 4
+        release.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+
+
+def test_free_slot_goes_to_the_most_urgent_class(make_scheduler):
+    async def main():
+        sched = make_scheduler(2)
+        release, order = asyncio.Event(), []
+        blockers = await saturate(sched, {Priority.interactive: 2}, release, order)
+        waiting = await saturate(
+            sched, {Priority.bulk: 1, Priority.background: 1, Priority.interactive: 1}, asyncio.Event(), order
+        )
+        release.set()
+        await asyncio.gather(*blockers)
+        await asyncio.sleep(0)
+        assert order[2:] == ["interactive0", "background0"]
+        for task in waiting:
+            task.cancel()
+        await asyncio.gather(*waiting, return_exceptions=True)
+
+    asyncio.run(main())
+
+
+def test_aging_raises_the_priority_of_waiting_calls(make_scheduler, monkeypatch):
+    async def main():
+        sched = make_scheduler(2)
+        now = [100.0]
+        monkeypatch.setattr(scheduler.time, "monotonic", lambda: now[0])
+        release, order = asyncio.Event(), []
+        blockers = await saturate(sched, {Priority.interactive: 2}, release, order)
+        waiting = await saturate(sched, {Priority.bulk: 1}, asyncio.Event(), order)
+        now[0] += 3 * sched.aging  # The bulk call is now more urgent than a new interactive one
+        waiting += await saturate(sched, {Priority.interactive: 1}, asyncio.Event(), order)
+        release.set()
+        await asyncio.gather(*blockers)
+        await asyncio.sleep(0)
+        assert order[2] == "bulk0"
+        for task in waiting:
+            task.cancel()
+        await asyncio.gather(*waiting, return_exceptions=True)
+
+    asyncio.run(main())
+
+
+def test_cancelled_waiter_releases_its_place(make_scheduler):
+    async def main():
+        sched = make_scheduler(1)
+        release, order = asyncio.Event(), []
+        blockers = await saturate(sched, {Priority.interactive: 1}, release, order)
+        waiting = await saturate(sched, {Priority.interactive: 1}, release, order)
+        waiting[0].cancel()
+        await asyncio.gather(*waiting, return_exceptions=True)
+        assert sched._waiters == []
+        release.set()
+        await asyncio.gather(*blockers)
+        assert sum(sched._running.values()) == 0
+
+    asyncio.run(main())
+
+
+def test_priority_is_inherited_by_tasks():
+    async def main():
+        async def current():
+            return Scheduler.current()
+
+        assert Scheduler.current() == Priority.background
+        with Scheduler.use(Priority.interactive):
+            assert await asyncio.create_task(current()) == Priority.interactive
+        assert Scheduler.current() == Priority.background
+
+    asyncio.run(main())
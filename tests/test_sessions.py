@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from bot import sessions
+from bot import SessionTable
+from bot import SessionTableFullError
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(sessions.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def evicted() -> list:
+    return []
+
+
+def make_table(evicted: list, max_size: int = 3, ttl: float = 10) -> SessionTable:
+    return SessionTable(
+        "test", max_size=max_size, ttl=ttl, on_evict=lambda key, value, reason: evicted.append((key, reason))
+    )
+
+
+def test_evicts_least_recently_used_when_full(clock, evicted):
+    table = make_table(evicted)
+    for key in "abc":
+        table[key] = key
+    table.get("a")
+    table["d"] = "d"
+    assert evicted == [("b", "capacity")]
+    assert table.keys() == ["c", "a", "d"]
+
+
+def test_replacing_an_entry_does_not_evict(clock, evicted):
+    table = make_table(evicted)
+    for key in "abc":
+        table[key] = key
+    table["a"] = "new"
+    assert evicted == []
+    assert table.get("a") == "new"
+
+
+def test_expired_entry_is_evicted_on_access(clock, evicted):
+    table = make_table(evicted)
+    table["a"] = "a"
+    clock.now += 10
+    assert "a" not in table
+    assert table.get("a") is None
+    assert evicted == [("a", "expired")]
+
+
+def test_touch_postpones_expiry(clock, evicted):
+    table = make_table(evicted)
+    table["a"] = "a"
+    clock.now += 8
+    table.touch("a")
+    clock.now += 8
+    assert table.get("a") == "a"
+    assert table.remaining("a") == pytest.approx(2)
+
+
+def test_entry_ttl(clock, evicted):
+    table = make_table(evicted)
+    table.set("a", "a", ttl=1)
+    table["b"] = "b"
+    clock.now += 1
+    assert table.remaining("a") is None
+    assert "b" in table
+
+
+def test_sweep_evicts_expired_entries_only(clock, evicted):
+    table = make_table(evicted)
+    table["a"] = "a"
+    clock.now += 5
+    table["b"] = "b"
+    table.touch("a")  # Leaves a stale entry in the expiry index
+    clock.now += 6
+    assert table.sweep() == 0
+    clock.now += 5
+    assert table.sweep() == 2
+    assert sorted(evicted) == [("a", "expired"), ("b", "expired")]
+    assert len(table) == 0
+
+
+def test_full_table_evicts_expired_entries_first(clock, evicted):
+    table = make_table(evicted)
+    table.set("a", "a", ttl=1)
+    table["b"] = "b"
+    table["c"] = "c"
+    clock.now += 1
+    table["d"] = "d"
+    assert evicted == [("a", "expired")]
+    assert table.keys() == ["b", "c", "d"]
+
+
+def test_pop_does_not_evict(clock, evicted):
+    table = make_table(evicted)
+    table["a"] = "a"
+    assert table.pop("a") == "a"
+    assert table.pop("a", "default") == "default"
+    assert evicted == []
+
+
+def test_bytes_follow_the_entries(clock, evicted):
+    table = SessionTable("test", max_size=2, ttl=10, sizeof=len)
+    table["a"] = "xx"
+    table["b"] = "yyy"
+    assert table.bytes == 5
+    table["a"] = "x"
+    assert table.bytes == 4
+    table["c"] = "zzzz"  # Evicts b
+    assert table.bytes == 5
+    table.pop("a")
+    assert table.bytes == 4
+
+
+def test_failing_eviction_callback_does_not_break_the_table(clock):
+    def on_evict(key, value, reason):
+        raise ValueError
+
+    table = SessionTable("test", max_size=1, ttl=10, on_evict=on_evict)
+    table["a"] = "a"
+    table["b"] = "b"
+    assert table.keys() == ["b"]
+
+
+def test_skips_entries_not_evictable_when_full(clock, evicted):
+    table = SessionTable(
+        "test",
+        max_size=2,
+        ttl=10,
+        on_evict=lambda key, value, reason: evicted.append((key, reason)),
+        evictable=lambda value: value != "pinned",
+    )
+    table["a"] = "pinned"
+    table["b"] = "b"
+    table["c"] = "c"
+    assert evicted == [("b", "capacity")]
+    table["c"] = "pinned"
+    with pytest.raises(SessionTableFullError):
+        table["d"] = "d"
+    assert table.keys() == ["a", "c"]